@@ -0,0 +1,626 @@
+from collections import namedtuple
+
+import pandas as pd
+import numpy as np
+
+from equity import EquityCurve
+
+# 持仓时间分类 (分钟)
+# 关键修正：为了方便前端绑定，这里使用简单的英文 Key，前端再映射回中文显示
+DURATION_BINS = [0, 5, 15, 60, 240, float('inf')]
+# 对应：剥头皮, 超短线, 日内短线, 日内波段, 长线
+DURATION_KEYS = ['less_5m', '5m_15m', '15m_60m', '1h_4h', 'more_4h']
+
+# dt.dayofweek 的 0-6 依次对应的星期名
+DAY_NAMES = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+NS_PER_HOUR = 3_600_000_000_000
+# 1970-01-01 是星期四
+EPOCH_WEEKDAY = 3
+
+# 持久化聚合状态的格式版本：字段含义变化时递增，旧版本状态直接作废 (回退到全量重算)
+STATE_VERSION = 4
+
+
+
+class UnorderedStreamError(ValueError):
+    """
+    分块之间的平仓时间区间互相交叠 (文件没有按时间排序)，
+    无法用首尾连续状态拼接出准确的连胜/连败，调用方应回退到整表模式。
+    """
+
+
+class StateVersionError(ValueError):
+    """保存的聚合状态版本与当前代码不一致，调用方应丢弃状态全量重算"""
+
+
+def held_mask(closed):
+    """
+    增量分析时不写进状态、下次从新导出里重新读取的交易：最后一个平仓时刻的交易和平仓时间缺失的交易。
+    新增交易可能与它们平仓时间相同 (或同样缺失)，稳定排序后谁先谁后取决于新导出里的行序，
+    只有连同新交易一起重新折叠，增量分析的连胜连败和权益曲线才与全量重算一致。
+    """
+    return (closed.isna() | (closed == closed.max())).to_numpy()
+
+
+# 逐笔衍生量 (numpy 数组)：净盈亏、估算手续费、持仓分钟、开仓小时 / 星期 (缺失为 -1)；volume 为总交易额
+TradeFeatures = namedtuple('TradeFeatures', ['net_pnl', 'est_fee', 'duration_minutes', 'open_hour', 'weekday', 'volume'])
+
+
+def _time_ns(series):
+    """时间列转成 int64 纳秒 (带时区的为 UTC) 和 NaT 掩码"""
+    times = pd.DatetimeIndex(series)
+    return times.as_unit('ns').asi8, times.isna()
+
+
+def trade_features(df, fee_rate):
+    """
+    由标准化明细的基础列一次算出逐笔衍生量，全部是新数组，不往 df 上加列：
+    同一张明细可以按不同费率 / 并发地分析。成交额缓冲区求和后原地乘费率变成手续费，
+    小时和星期共用一个整点数组，尽量少分配整列的临时数组。
+    """
+    # 1. 估算手续费 (很多平台的 PNL 不含手续费) & 净利润 = 毛利 - 估算手续费
+    fee = df['Entry Price'].to_numpy(dtype='float64') + df['Avg. Close Price'].to_numpy(dtype='float64')
+    fee *= df['Closed Vol.'].to_numpy(dtype='float64')
+    volume = fee.sum()
+    fee *= fee_rate
+    net_pnl = df['Closing PNL'].to_numpy(dtype='float64') - fee
+
+    # 2. 持仓时长 (分钟)，任一端缺失记 0
+    opened, opened_nat = _time_ns(df['Opened'])
+    closed, closed_nat = _time_ns(df['Closed'])
+    duration = (closed - opened) / 1e9
+    duration[opened_nat | closed_nat] = 0.0
+    duration /= 60
+
+    # 3. 开仓小时 / 星期 (按本地挂钟时间，带时区的列先去掉时区)
+    wall = df['Opened'].dt.tz_localize(None) if df['Opened'].dt.tz is not None else None
+    hours = (opened if wall is None else _time_ns(wall)[0]) // NS_PER_HOUR
+    open_hour = (hours % 24).astype(np.int8)
+    hours //= 24
+    hours += EPOCH_WEEKDAY
+    hours %= 7
+    weekday = hours.astype(np.int8)
+    open_hour[opened_nat] = -1
+    weekday[opened_nat] = -1
+    return TradeFeatures(net_pnl, fee, duration, open_hour, weekday, volume)
+
+
+def _sum_by_code(values, codes):
+    """按非负整数编码分组求和 (-1 为缺失，不参与分组)，结果以编码为索引"""
+    valid = codes >= 0
+    if not valid.all():
+        values, codes = values[valid], codes[valid]
+    return pd.Series(values).groupby(codes).sum()
+
+
+def run_lengths(signs):
+    """
+    游程编码 (Run-Length)：把按时间排好序的盈亏符号序列切成连续同号区间。
+    返回 (起点, 长度, 符号) 三个数组，全程向量化，不在 Python 里逐组循环。
+    NaN 与任何值都不相等，会各自成段，后续按符号筛选时自然被忽略。
+    """
+    signs = np.asarray(signs)
+    n = len(signs)
+    if n == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), signs[:0]
+    starts = np.concatenate([[0], np.flatnonzero(signs[1:] != signs[:-1]) + 1])
+    lengths = np.diff(np.append(starts, n))
+    return starts, lengths, signs[starts]
+
+
+def longest_run(starts, lengths, run_signs, sign):
+    """
+    找出指定符号 (1 = 连胜, -1 = 连败) 的最长区间，返回 [lo, hi) 切片边界。
+    长度相同时取时间上最早的一段，与逐组遍历时 '>' 的比较语义一致。
+    """
+    candidates = np.flatnonzero(run_signs == sign)
+    if len(candidates) == 0:
+        return None
+    best = candidates[np.argmax(lengths[candidates])]
+    lo = int(starts[best])
+    return lo, lo + int(lengths[best])
+
+
+def _add_grouped(a, b):
+    """按索引合并两份分组结果 (Series / DataFrame 均可)，同一 key 求和"""
+    if len(a) == 0:
+        return b
+    if len(b) == 0:
+        return a
+    return pd.concat([a, b]).groupby(level=0).sum()
+
+
+def _plain_index(obj):
+    """分组键是 category 时，结果的索引转回普通 object 索引，合并时不会带出没出现过的类别"""
+    if isinstance(obj.index, pd.CategoricalIndex):
+        obj.index = obj.index.astype(object)
+    return obj
+
+
+def _series_state(s):
+    return [s.index.tolist(), s.to_numpy().tolist()]
+
+
+def _series_from_state(state, dtype=float):
+    index, values = state
+    return pd.Series(values, index=index, dtype=dtype)
+
+
+def _time_state(ts):
+    return None if pd.isna(ts) else ts.isoformat()
+
+
+def _time_from_state(value):
+    return pd.NaT if value is None else pd.Timestamp(value)
+
+
+def _nat_min(a, b):
+    return b if pd.isna(a) else a if pd.isna(b) else min(a, b)
+
+
+def _nat_max(a, b):
+    return b if pd.isna(a) else a if pd.isna(b) else max(a, b)
+
+
+class Run:
+    """一段连续同号的交易：符号、笔数、合计盈亏、各币种盈亏"""
+
+    def __init__(self, sign, length, amount, symbol_pnl):
+        self.sign = sign
+        self.length = length
+        self.amount = amount
+        self.symbol_pnl = symbol_pnl
+
+    @classmethod
+    def from_slice(cls, pnl, symbols, sign):
+        return cls(sign, len(pnl), pnl.sum(), pd.Series(pnl).groupby(symbols).sum())
+
+    def to_state(self):
+        return {"sign": float(self.sign), "length": int(self.length), "amount": float(self.amount),
+                "symbol_pnl": _series_state(self.symbol_pnl)}
+
+    @classmethod
+    def from_state(cls, state):
+        if state is None:
+            return None
+        return cls(state["sign"], state["length"], state["amount"], _series_from_state(state["symbol_pnl"]))
+
+    def join(self, later):
+        return Run(self.sign, self.length + later.length, self.amount + later.amount,
+                   _add_grouped(self.symbol_pnl, later.symbol_pnl))
+
+
+def _longest(*runs):
+    """按时间顺序传入候选区间，取最长的一段 (并列取最早)"""
+    best = None
+    for run in runs:
+        if run is not None and (best is None or run.length > best.length):
+            best = run
+    return best
+
+
+class StreakSummary:
+    """
+    一段按时间排好序的交易的连胜/连败摘要：
+    开头的区间 (head)、结尾的区间 (tail)、以及各符号的最长区间 (best)。
+    相邻两段摘要可以拼接 (merge 满足结合律)，所以分块处理时只需保留这点状态。
+    """
+
+    def __init__(self, n=0, head=None, tail=None, best=None):
+        self.n = n
+        self.head = head
+        self.tail = tail
+        self.best = best or {1: None, -1: None}
+
+    @classmethod
+    def from_sorted(cls, pnl, symbols):
+        n = len(pnl)
+        if n == 0:
+            return cls()
+        starts, lengths, run_signs = run_lengths(np.sign(pnl))
+
+        def make(lo, hi, sign):
+            return Run.from_slice(pnl[lo:hi], symbols[lo:hi], sign)
+
+        head = make(0, int(lengths[0]), run_signs[0])
+        tail = head if len(starts) == 1 else make(int(starts[-1]), n, run_signs[-1])
+        best = {}
+        for sign in (1, -1):
+            found = longest_run(starts, lengths, run_signs, sign)
+            best[sign] = None if found is None else make(found[0], found[1], sign)
+        return cls(n, head, tail, best)
+
+    def to_state(self):
+        runs = {"head": self.head, "tail": self.tail, "best_win": self.best[1], "best_loss": self.best[-1]}
+        return {"n": int(self.n), **{name: run.to_state() if run else None for name, run in runs.items()}}
+
+    @classmethod
+    def from_state(cls, state):
+        return cls(state["n"], Run.from_state(state["head"]), Run.from_state(state["tail"]),
+                   {1: Run.from_state(state["best_win"]), -1: Run.from_state(state["best_loss"])})
+
+    def merge(self, later):
+        """拼接时间上紧随其后的另一段摘要，首尾同号时两段区间连成一段"""
+        if self.n == 0:
+            return later
+        if later.n == 0:
+            return self
+
+        best = {}
+        if self.tail.sign == later.head.sign:
+            middle = self.tail.join(later.head)
+            head = middle if self.head.length == self.n else self.head
+            tail = middle if later.tail.length == later.n else later.tail
+            for sign in (1, -1):
+                best[sign] = _longest(self.best[sign], middle if middle.sign == sign else None, later.best[sign])
+        else:
+            head, tail = self.head, later.tail
+            for sign in (1, -1):
+                best[sign] = _longest(self.best[sign], later.best[sign])
+        return StreakSummary(self.n + later.n, head, tail, best)
+
+
+# 可直接相加的标量合计
+SCALAR_FIELDS = ['trade_count', 'net_pnl', 'gross_pnl', 'total_fees', 'real_profit', 'real_loss', 'win_count',
+                 'loss_count', 'volume', 'duration_minutes', 'efficiency_sum', 'efficiency_count']
+
+
+def _builtin(value):
+    # numpy 标量转成 Python 原生类型
+    return value.item() if hasattr(value, 'item') else value
+
+
+class TradeAggregate:
+    """
+    可合并的交易统计累加器。
+
+    from_frame() 把一块预处理好的交易明细折叠成：各项合计/笔数、
+    持仓分类 / 币种 / 小时 / 星期 的分组统计、连胜连败首尾状态、首末时间、权益曲线。
+    merge() 把两块累加器合并，to_json() 输出与整表分析完全相同结构的结果。
+    整表分析就是只有一块的特例；分块流式分析则逐块 merge，明细只保留权益曲线需要的
+    平仓时间 + 净盈亏两列 (每笔 16 字节)，持久化状态里只有折叠后的曲线。
+    """
+
+    def __init__(self):
+        # 基础体征
+        self.trade_count = 0
+        self.net_pnl = 0.0
+        self.gross_pnl = 0.0
+        self.total_fees = 0.0
+        self.real_profit = 0.0
+        self.real_loss = 0.0
+        self.win_count = 0
+        self.loss_count = 0
+        self.volume = 0.0
+        self.duration_minutes = 0.0
+        self.efficiency_sum = 0.0
+        self.efficiency_count = 0
+        # 多空
+        self.direction = {"long": [0, 0.0], "short": [0, 0.0]}
+        # 持仓分类：笔数 / 盈亏 / 胜场 / 各币种盈亏
+        self.duration = {key: {"count": 0, "pnl": 0.0, "wins": 0, "symbol_pnl": pd.Series(dtype=float)}
+                         for key in DURATION_KEYS}
+        # 币种：盈亏、开仓笔数、胜场、总笔数
+        self.symbols = pd.DataFrame({'Net PnL': pd.Series(dtype=float), 'Opened': pd.Series(dtype=np.int64),
+                                     'wins': pd.Series(dtype=np.int64), 'size': pd.Series(dtype=np.int64)})
+        # 小时 / 星期
+        self.hour = pd.Series(dtype=float)
+        self.weekday = pd.Series(dtype=float)
+        # 时间范围 & 连胜连败 (平仓时间缺失的交易单独成段，排在最后)
+        self.first_opened = pd.NaT
+        self.closed_min = pd.NaT
+        self.closed_max = pd.NaT
+        self.streak = StreakSummary()
+        self.nat_streak = StreakSummary()
+        # 权益曲线 / 回撤 / 水下时间 (只含平仓时间有效的交易)
+        self.equity = EquityCurve()
+
+    @classmethod
+    def from_frame(cls, df, fee_rate):
+        """把一块标准化后的交易明细按费率折叠成累加器 (不修改 df，衍生量见 trade_features)"""
+        agg = cls()
+        features = trade_features(df, fee_rate)
+        pnl = features.net_pnl
+        is_win = pnl > 0
+        winning = pnl[is_win]
+        losing = pnl[pnl < 0]
+        closing = df['Closing PNL'].to_numpy(dtype='float64')
+        duration = features.duration_minutes
+
+        # --- 1. 基础体征 ---
+        agg.trade_count = len(df)
+        agg.net_pnl = pnl.sum()
+        agg.gross_pnl = closing.sum()
+        agg.total_fees = features.est_fee.sum()
+        # 真实盈亏 (Realized) - 排除 0
+        agg.real_profit = winning.sum()
+        agg.real_loss = losing.sum()
+        agg.win_count = len(winning)
+        agg.loss_count = len(losing)
+        # 总交易额
+        agg.volume = features.volume
+        agg.duration_minutes = duration.sum()
+        # 持仓效率，避免除以 0
+        efficiency = np.abs(closing)
+        efficiency /= np.where(duration == 0, 1.0, duration)
+        agg.efficiency_sum = np.nansum(efficiency)
+        agg.efficiency_count = int(np.count_nonzero(~np.isnan(efficiency)))
+
+        # --- 2. 多空 ---
+        side = df['Side'].str.lower()
+        for key, names in (("long", ['long', 'buy']), ("short", ['short', 'sell'])):
+            sub = pnl[side.isin(names).to_numpy()]
+            agg.direction[key] = [len(sub), sub.sum()]
+
+        # --- 3. 持仓分类：按分类编码做一次稳定排序，每个分类变成一段连续切片 ---
+        duration_type = pd.cut(duration, bins=DURATION_BINS, labels=DURATION_KEYS)
+        codes = duration_type.codes
+        order = np.argsort(codes, kind='stable')
+        sorted_pnl = pnl[order]
+        counts = np.bincount(codes[codes >= 0], minlength=len(DURATION_KEYS))
+        wins = np.bincount(codes[(codes >= 0) & is_win], minlength=len(DURATION_KEYS))
+        bounds = np.concatenate([[0], np.cumsum(counts)]) + int((codes < 0).sum())
+        # 分类 × 币种 的盈亏，一次 groupby 得到所有分类的 Top 币种
+        symbol = df['Symbol'].array
+        # 分组键包成 Index：键的个数恰好等于行数 (2 行) 时，裸数组列表会被 pandas 当成列名列表
+        pair_pnl = pd.Series(pnl).groupby([pd.Index(duration_type), pd.Index(symbol)], observed=True).sum()
+        for i, key in enumerate(DURATION_KEYS):
+            if counts[i] > 0:
+                agg.duration[key] = {
+                    "count": int(counts[i]),
+                    "pnl": sorted_pnl[bounds[i]:bounds[i + 1]].sum(),
+                    "wins": int(wins[i]),
+                    "symbol_pnl": _plain_index(pair_pnl.xs(key, level=0))
+                }
+
+        # --- 4. 币种 / 小时 / 星期 ---
+        agg.symbols = pd.DataFrame({'Net PnL': pnl, 'Opened': df['Opened'].array, 'wins': is_win}).groupby(symbol, observed=True).agg(
+            **{'Net PnL': ('Net PnL', 'sum'), 'Opened': ('Opened', 'count'), 'wins': ('wins', 'sum'), 'size': ('Net PnL', 'size')}
+        )
+        agg.symbols = _plain_index(agg.symbols)
+        agg.hour = _sum_by_code(pnl, features.open_hour)
+        # 星期按名称排序，与字符串分组的顺序一致 (并列时取同一天)
+        weekday = _sum_by_code(pnl, features.weekday)
+        weekday.index = pd.Index([DAY_NAMES[d] for d in weekday.index], dtype=object)
+        agg.weekday = weekday.sort_index()
+
+        # --- 5. 时间范围 & 连胜连败 ---
+        closed = df['Closed'].reset_index(drop=True)
+        agg.first_opened = df['Opened'].min()
+        agg.closed_min = closed.min()
+        agg.closed_max = closed.max()
+        # 按平仓时间排序 (NaT 排最后)，只取位置索引，不复制整张表。
+        # 稳定排序：平仓时间相同的交易保持文件里的先后，整表 / 分块 / 增量分析的连胜连败才一致
+        order = closed.sort_values(kind='stable').index.to_numpy()
+        pnl_sorted = pnl[order]
+        symbol_sorted = df['Symbol'].to_numpy()[order]
+        n_valid = int(closed.notna().sum())
+        agg.streak = StreakSummary.from_sorted(pnl_sorted[:n_valid], symbol_sorted[:n_valid])
+        agg.nat_streak = StreakSummary.from_sorted(pnl_sorted[n_valid:], symbol_sorted[n_valid:])
+        closed_ns = pd.DatetimeIndex(closed.to_numpy()[order[:n_valid]]).as_unit('ns').asi8
+        agg.equity = EquityCurve.from_sorted(closed_ns, pnl_sorted[:n_valid])
+        return agg
+
+    def merge(self, other):
+        """
+        把另一块累加器并入自身。两块的平仓时间必须前后衔接 (正序或倒序导出都可以)，
+        否则抛出 UnorderedStreamError。
+        """
+        if other.streak.n > 0 and self.streak.n > 0:
+            # 正序接上的部分立即折叠进权益曲线；倒序的部分只能先拼接明细，已折叠的曲线前面不能再接
+            if other.closed_min >= self.closed_max and not other.equity.has_prefix:
+                self.streak = self.streak.merge(other.streak)
+                self.equity = self.equity.extend(other.equity)
+            elif other.closed_max <= self.closed_min and not self.equity.has_prefix:
+                self.streak = other.streak.merge(self.streak)
+                self.equity = other.equity.merge(self.equity)
+            else:
+                raise UnorderedStreamError("交易记录未按平仓时间排序，无法分块计算连胜/连败")
+        elif other.streak.n > 0:
+            self.streak = other.streak
+            self.equity = other.equity
+        self.nat_streak = self.nat_streak.merge(other.nat_streak)
+
+        self.trade_count += other.trade_count
+        self.net_pnl += other.net_pnl
+        self.gross_pnl += other.gross_pnl
+        self.total_fees += other.total_fees
+        self.real_profit += other.real_profit
+        self.real_loss += other.real_loss
+        self.win_count += other.win_count
+        self.loss_count += other.loss_count
+        self.volume += other.volume
+        self.duration_minutes += other.duration_minutes
+        self.efficiency_sum += other.efficiency_sum
+        self.efficiency_count += other.efficiency_count
+
+        for key in self.direction:
+            self.direction[key] = [a + b for a, b in zip(self.direction[key], other.direction[key])]
+        for key in DURATION_KEYS:
+            mine, theirs = self.duration[key], other.duration[key]
+            self.duration[key] = {
+                "count": mine["count"] + theirs["count"],
+                "pnl": mine["pnl"] + theirs["pnl"],
+                "wins": mine["wins"] + theirs["wins"],
+                "symbol_pnl": _add_grouped(mine["symbol_pnl"], theirs["symbol_pnl"])
+            }
+
+        self.symbols = _add_grouped(self.symbols, other.symbols)
+        self.hour = _add_grouped(self.hour, other.hour)
+        self.weekday = _add_grouped(self.weekday, other.weekday)
+
+        self.first_opened = _nat_min(self.first_opened, other.first_opened)
+        self.closed_min = _nat_min(self.closed_min, other.closed_min)
+        self.closed_max = _nat_max(self.closed_max, other.closed_max)
+        return self
+
+    def to_state(self):
+        """
+        导出可 JSON 序列化的紧凑状态：各项合计、分组统计、连胜连败首尾状态、首末时间、权益曲线。
+        体积只与币种数相关，与交易笔数无关。增量分析保存的是不含 held_mask 那部分交易的前缀。
+        """
+        return {
+            "version": STATE_VERSION,
+            "totals": {name: _builtin(getattr(self, name)) for name in SCALAR_FIELDS},
+            "direction": {key: [int(count), float(pnl)] for key, (count, pnl) in self.direction.items()},
+            "duration": {key: {"count": int(b["count"]), "pnl": float(b["pnl"]), "wins": int(b["wins"]),
+                               "symbol_pnl": _series_state(b["symbol_pnl"])}
+                         for key, b in self.duration.items()},
+            "symbols": {"index": self.symbols.index.tolist(),
+                        **{col: self.symbols[col].to_numpy().tolist() for col in self.symbols.columns}},
+            "hour": _series_state(self.hour),
+            "weekday": _series_state(self.weekday),
+            "first_opened": _time_state(self.first_opened),
+            "closed_min": _time_state(self.closed_min),
+            "closed_max": _time_state(self.closed_max),
+            "streak": self.streak.to_state(),
+            "nat_streak": self.nat_streak.to_state(),
+            "equity": self.equity.to_state(),
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        if state.get("version") != STATE_VERSION:
+            raise StateVersionError(f"聚合状态版本 {state.get('version')} 与当前版本 {STATE_VERSION} 不一致")
+        agg = cls()
+        for name in SCALAR_FIELDS:
+            setattr(agg, name, state["totals"][name])
+        agg.direction = {key: list(value) for key, value in state["direction"].items()}
+        agg.duration = {key: {"count": b["count"], "pnl": b["pnl"], "wins": b["wins"],
+                              "symbol_pnl": _series_from_state(b["symbol_pnl"])}
+                        for key, b in state["duration"].items()}
+        symbols = dict(state["symbols"])
+        index = pd.Index(symbols.pop("index"), dtype=object)
+        agg.symbols = pd.DataFrame(symbols, index=index).astype(
+            {'Net PnL': float, 'Opened': np.int64, 'wins': np.int64, 'size': np.int64})
+        agg.hour = _series_from_state(state["hour"])
+        agg.weekday = _series_from_state(state["weekday"])
+        agg.first_opened = _time_from_state(state["first_opened"])
+        agg.closed_min = _time_from_state(state["closed_min"])
+        agg.closed_max = _time_from_state(state["closed_max"])
+        agg.streak = StreakSummary.from_state(state["streak"])
+        agg.nat_streak = StreakSummary.from_state(state["nat_streak"])
+        agg.equity = EquityCurve.from_state(state["equity"])
+        return agg
+
+    def to_json(self):
+        """
+        计算所有指标并返回 JSON
+        """
+        # --- 1. 基础体征 (Vitals) ---
+        total_pnl = self.net_pnl
+        real_loss = self.real_loss
+        real_profit = self.real_profit
+        total_trades = self.trade_count
+
+        # --- 2. 核心绩效 (Performance) ---
+        win_rate = self.win_count / total_trades if total_trades > 0 else 0
+
+        avg_win = real_profit / self.win_count if self.win_count > 0 else 0
+        avg_loss = abs(real_loss / self.loss_count) if self.loss_count > 0 else 0
+        rr_ratio = avg_win / avg_loss if avg_loss > 0 else 0
+
+        profit_factor = real_profit / abs(real_loss) if abs(real_loss) > 0 else 0
+        expectancy = total_pnl / total_trades if total_trades > 0 else np.nan
+
+        # --- 3. 多空偏好 (Direction) ---
+        direction_stats = {
+            key: {"count": count, "pnl": pnl if count > 0 else 0}
+            for key, (count, pnl) in self.direction.items()
+        }
+
+        # --- 4. 持仓时间分类 (Duration) ---
+        duration_stats = {}
+        for key in DURATION_KEYS:
+            bucket = self.duration[key]
+            if bucket['count'] > 0:
+                duration_stats[key] = {
+                    "count": bucket['count'],
+                    "pnl": bucket['pnl'],
+                    "win_rate": bucket['wins'] / bucket['count'],
+                    "top_coins": bucket['symbol_pnl'].sort_values(ascending=False).head(5).index.tolist()
+                }
+            else:
+                 duration_stats[key] = {"count": 0, "pnl": 0, "win_rate": 0, "top_coins": []}
+
+        # --- 5. 交易频率 & 时薪 ---
+        if total_trades > 0:
+            days_span = (self.closed_max - self.first_opened).days + 1
+            frequency = total_trades / days_span if days_span > 0 else total_trades
+        else:
+            frequency = 0
+
+        total_hours = self.duration_minutes / 60
+        hourly_wage = total_pnl / total_hours if total_hours > 0 else 0
+
+        # --- 6. 资产偏好 (Assets) ---
+        if total_trades > 0:
+            asset_grp = self.symbols.copy()
+            asset_grp['win_rate'] = asset_grp['wins'] / asset_grp['size']
+            asset_grp = asset_grp.drop(columns=['wins', 'size']).rename_axis('Symbol').reset_index()
+
+            asset_sorted = asset_grp.sort_values('Net PnL', ascending=False)
+            top_5_assets = asset_sorted.head(5).to_dict('records')
+            bottom_5_assets = asset_sorted.tail(5).to_dict('records')
+        else:
+            top_5_assets = []
+            bottom_5_assets = []
+
+        # --- 7. 连胜/连败 (Streaks) ---
+        streak = self.streak.merge(self.nat_streak)
+        max_win, max_loss = streak.best[1], streak.best[-1]
+
+        # --- 8. 时间分析 (Timing) ---
+        hourly_pnl = self.hour.to_dict()
+        daily_pnl = self.weekday.sort_values(ascending=False)
+        best_day = daily_pnl.index[0] if not daily_pnl.empty else "N/A"
+        worst_day = daily_pnl.index[-1] if not daily_pnl.empty else "N/A"
+
+        # --- 9. 持仓效率 (Efficiency) ---
+        avg_efficiency = self.efficiency_sum / self.efficiency_count if total_trades > 0 else 0
+
+        # --- 10. 组装返回 ---
+        return {
+            "vitals": {
+                "net_pnl": float(total_pnl),
+                "gross_pnl": float(self.gross_pnl),
+                "real_profit": float(real_profit),
+                "real_loss": float(real_loss),
+                "total_fees": float(self.total_fees),
+                "volume": float(self.volume),
+                "trade_count": int(total_trades),
+                "hourly_wage": float(hourly_wage),
+                "frequency": float(frequency)
+            },
+            "performance": {
+                "win_rate": float(win_rate),
+                "rr_ratio": float(rr_ratio),
+                "profit_factor": float(profit_factor),
+                "expectancy": float(expectancy),
+                "avg_efficiency": float(avg_efficiency)
+            },
+            "direction": direction_stats,
+            "duration_analysis": duration_stats,
+            "assets": {
+                "top_5": top_5_assets,
+                "bottom_5": bottom_5_assets
+            },
+            "streaks": {
+                "max_win": {
+                    "count": int(max_win.length) if max_win else 0,
+                    "amount": float(max_win.amount) if max_win else 0.0,
+                    "heroes": max_win.symbol_pnl.sort_values(ascending=False).head(3).index.tolist() if max_win else []
+                },
+                "max_loss": {
+                    "count": int(max_loss.length) if max_loss else 0,
+                    "amount": float(max_loss.amount) if max_loss else 0.0,
+                    "culprits": max_loss.symbol_pnl.sort_values().head(3).index.tolist() if max_loss else []
+                }
+            },
+            "timing": {
+                "hourly_pnl": hourly_pnl,
+                "best_day": best_day,
+                "worst_day": worst_day
+            },
+            "equity": self.equity.to_json()
+        }
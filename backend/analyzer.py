@@ -1,63 +1,108 @@
+from contextlib import nullcontext
+
 import pandas as pd
 import numpy as np
+from aggregates import TradeAggregate, UnorderedStreamError, StateVersionError, held_mask
+from pandas.api.types import is_numeric_dtype, is_bool_dtype, is_datetime64_any_dtype
+from pandas.tseries.api import guess_datetime_format
+from metrics import stage_timer
+from schema import resolve_columns, check_resolution, clean_headers, sniff_csv, csv_source, TIME_FORMATS, USED_COLUMNS
+from fills import reconstruct_trades
+
+# 默认估算手续费率 (双边万五)
+FEE_RATE = 0.0005
+
+# 计算引擎：pandas (默认)；polars 用多线程读取和预处理 CSV (可选依赖，只用于整表分析)，
+# 指标计算与 pandas 引擎共用同一份代码，结果逐位一致
+ENGINES = ('pandas', 'polars')
+
+# 标准化后明细的原始字段 (衍生量分析时现算)：列式缓存保存、多文件合并分析跨进程传回的都是这些列
+STORED_COLUMNS = ['Symbol', 'Side', 'Entry Price', 'Avg. Close Price', 'Closed Vol.', 'Closing PNL',
+                  'Opened', 'Closed']
+
+
+def frame_bytes(df):
+    return int(df.memory_usage(index=True, deep=True).sum()) if df is not None else 0
+
 
 class TradeAnalyzer:
-    def __init__(self, df: pd.DataFrame):
-        # 初始化时直接运行预处理
-        self.df = self._preprocess(df)
+    def __init__(self, df: pd.DataFrame, base=None, fee_rate=FEE_RATE):
+        # 初始化时直接运行预处理；传入 base (之前保存的聚合状态) 时只保留其后新增的交易
+        self.base = base
+        self.fee_rate = fee_rate
+        self.df = self._preprocess(df) if base is None else self._preprocess_new(df, base)
 
-    def _clean_numeric_column(self, series):
+    def _clean_numeric_column(self, series, units=False):
         """
         强力清洗工具：解决 '1,234.56' 这种带逗号的字符串，
         或者 ' 123 ' 这种带空格的数字，防止 Pandas 算成 0。
+        已经是数值类型的列直接走快速通道，不做字符串往返。
+        units=True 时脏值还会去掉末尾的单位 (成交明细里的 '0.5BTC')。
+        """
+        # 0. 快速通道：已经是数值列 (bool 除外)，只统一成 float64 并补 0
+        if is_numeric_dtype(series) and not is_bool_dtype(series):
+            return series.astype('float64').fillna(0.0)
+        # 1. 先整列向量化转数字 (自带去空格)，非数字变成 NaN
+        numeric_s = pd.to_numeric(series, errors='coerce')
+        # 2. 只对转换失败的脏值去掉千分位逗号后再转一次
+        dirty = numeric_s.isna() & series.notna()
+        if dirty.any():
+            cleaned = series[dirty].astype(str).str.strip().str.replace(',', '', regex=False)
+            if units:
+                cleaned = cleaned.str.replace(r'\s*[A-Za-z]+$', '', regex=True)
+            numeric_s[dirty] = pd.to_numeric(cleaned, errors='coerce')
+        # 3. 把 NaN 填为 0.0，保证后续计算不报错
+        return numeric_s.astype('float64').fillna(0.0)
+
+    def _parse_time_column(self, series, time_format=None):
+        """
+        时间列解析：
+        - 已经是 datetime 直接返回
+        - 数值 (或纯数字字符串) 按数量级识别为 秒 / 毫秒 / 微秒 / 纳秒 时间戳
+        - 字符串用已知的交易所格式，或根据第一个非空值推断出格式后整列按格式解析，
+          避免逐行推断
         """
-        # 1. 转为字符串并去空格
-        s = series.astype(str).str.strip()
-        # 2. 去掉千分位逗号
-        s = s.str.replace(',', '')
-        # 3. 强制转为数字，非数字变成 NaN
-        numeric_s = pd.to_numeric(s, errors='coerce')
-        # 4. 把 NaN 填为 0.0，保证后续计算不报错
-        return numeric_s.fillna(0.0)
+        if is_datetime64_any_dtype(series):
+            return series
+        if not is_numeric_dtype(series):
+            sample = series.dropna()
+            sample = sample.iloc[0] if len(sample) else None
+            if isinstance(sample, str) and sample.strip().isdigit():
+                series = pd.to_numeric(series, errors='coerce')
+        if is_numeric_dtype(series) and not is_bool_dtype(series):
+            magnitude = series.abs().max()
+            unit = 's' if magnitude < 1e11 else 'ms' if magnitude < 1e14 else 'us' if magnitude < 1e17 else 'ns'
+            return pd.to_datetime(series, unit=unit, errors='coerce')
+
+        if time_format is None and isinstance(sample, str):
+            time_format = guess_datetime_format(sample.strip())
+        if time_format:
+            parsed = pd.to_datetime(series, format=time_format, errors='coerce')
+            # 已知格式对不上 (整列解析失败) 时退回自动推断
+            if parsed.notna().any() or series.notna().sum() == 0:
+                return parsed
+        return pd.to_datetime(series, errors='coerce')
 
     def _preprocess(self, df):
         """
         数据预处理核心逻辑
         """
         # 1. 清洗列名 (去前后空格)
-        df.columns = [c.strip() for c in df.columns]
+        headers = clean_headers(df.columns)
         
-        # 2. 列名映射字典 (兼容中文、英文、拼写错误)
-        column_mapping = {
-            'Symbol': ['Symbol', 'symbol', 'Instrument', 'Pair', 'Contract', '币种', '交易对', 'Market'],
-            'Side': ['Side', 'Direction', 'Type', '方向', '买卖', 'BS', 'Position Side'],
-            'Size': ['Size', 'Amount', 'Quantity', 'Qty', 'Vol', '数量', '张数', 'Exec Qty', 'Max Open Interest'], 
-            'Entry Price': ['Entry Price', 'Avg. Open Price', 'Avg Entry Price', 'Open Price', '开仓均价', '开仓价', 'EntryPrice'],
-            # 🚨 包含您 CSV 里的特殊拼写错误 'Pirce' 以及常见的变体
-            'Avg. Close Price': [
-                'Avg. Close Pirce', 
-                'Avg. Close Price', 'Close Price', 'Exit Price', 'Avg Price', 
-                '平仓均价', '平仓价', '成交均价', 'Price', 'Fill Price'
-            ],
-            'Closed Vol.': ['Closed Vol.', 'Closed Volume', 'Size', 'Qty', 'Amount', '成交量', '平仓数量'],
-            'Closing PNL': ['Closing PNL', 'Realized PNL', 'PnL', 'Profit', 'Net Profit', '已实现盈亏', '盈亏', 'Realized Profit'],
-            'Opened': ['Opened', 'Open Time', 'Date', 'Time', 'Created Time', '开仓时间', '时间', 'Create Time'],
-            'Closed': ['Closed', 'Close Time', 'Update Time', 'Finished Time', '平仓时间', '更新时间']
-        }
-
-        # 3. 智能重命名列名
-        for standard_col, aliases in column_mapping.items():
-            # 如果标准名已经存在，跳过
-            if standard_col in df.columns: 
-                continue
-            
-            # 遍历别名寻找匹配
-            for alias in aliases:
-                # 忽略大小写匹配
-                match_col = next((c for c in df.columns if c.lower() == alias.lower()), None)
-                if match_col:
-                    df.rename(columns={match_col: standard_col}, inplace=True)
-                    break
+        # 2. 按表头解析列名映射 (交易所格式指纹 / 别名匹配，结果按表头缓存)
+        resolution = resolve_columns(tuple(headers))
+        check_resolution(resolution, headers)
+        self.exchange = resolution.exchange
+
+        # 3. 智能重命名列名，丢掉分析用不到的列
+        # set_axis 不复制数据，之后的整列赋值只替换新表里的列，调用方传入的 df 保持不变
+        df = df.set_axis([resolution.rename.get(h, h) for h in headers], axis=1, copy=False)
+        if resolution.kind == 'fills':
+            return self._preprocess_fills(df)
+        unused = [c for c in df.columns if c not in USED_COLUMNS]
+        if unused:
+            df = df.drop(columns=unused)
 
         # --- 4. 容错逻辑 ---
         
@@ -71,225 +116,441 @@ class TradeAnalyzer:
             if c in df.columns:
                 df[c] = self._clean_numeric_column(df[c])
             else:
-                # 如果缺失关键列，先填 0 (后面会报错提醒)
+                # 价格 / 数量缺失时先填 0 (必需列已在解析表头时检查)
                 df[c] = 0.0
 
-        # 时间列格式化
+        # 时间列格式化 (已知交易所格式优先，否则按首个值推断格式)
+        time_format = TIME_FORMATS.get(resolution.exchange)
         if 'Opened' in df.columns:
-            df['Opened'] = pd.to_datetime(df['Opened'], errors='coerce')
+            df['Opened'] = self._parse_time_column(df['Opened'], time_format)
         if 'Closed' in df.columns:
-            df['Closed'] = pd.to_datetime(df['Closed'], errors='coerce')
+            df['Closed'] = self._parse_time_column(df['Closed'], time_format)
         
         # 如果缺少平仓时间，用开仓时间代替，避免持仓时间计算崩溃
         if 'Closed' not in df.columns and 'Opened' in df.columns:
             df['Closed'] = df['Opened']
 
-        # --- 5. 完整性检查 ---
-        required_cols = ['Entry Price', 'Avg. Close Price', 'Closed Vol.', 'Closing PNL']
-        missing = [c for c in required_cols if c not in df.columns]
-        if missing:
-            # 抛出异常，前端会显示这个错误信息
-            raise ValueError(f"缺少关键列: {missing}。CSV里实际有的列名是: {list(df.columns)}")
+        # 衍生指标 (净盈亏、持仓时长、开仓时段等) 不存成列，分析时由 trade_features 一次算出
 
-        # --- 6. 衍生指标计算 ---
-        
-        # 持仓时长 (分钟)
-        df['duration_minutes'] = (df['Closed'] - df['Opened']).dt.total_seconds().fillna(0) / 60
-        
-        # 估算手续费 (双边万五: 0.0005)
-        # 很多平台手续费没有包含在 PNL 里，所以这里手动估算一个参考值
-        df['est_fee'] = (df['Entry Price'] + df['Avg. Close Price']) * df['Closed Vol.'] * 0.0005
-        
-        # 净利润 = 毛利 (Closing PNL) - 估算手续费
-        # 如果 CSV 里本身 Closing PNL 已经是净利润，这里可能会重复扣除，
-        # 但对于大多数交易所导出的 "Realized PNL" 来说，通常是不含手续费的毛利。
-        df['Net PnL'] = df['Closing PNL'] - df['est_fee']
-        
-        # 补充时间特征 (星期几、小时)
-        if 'Opened' in df.columns:
-            df['day_name'] = df['Opened'].dt.day_name()
-            df['open_hour'] = df['Opened'].dt.hour
-        else:
-            df['day_name'] = 'Unknown'
-            df['open_hour'] = 0
-            
         # 补全方向和币种
         if 'Side' not in df.columns: df['Side'] = 'Long'
         if 'Symbol' not in df.columns: df['Symbol'] = 'Unknown'
+        # 币种 / 方向基数很低，存成 category (每行只占一个整数编码)
+        df['Symbol'] = df['Symbol'].astype('category')
+        df['Side'] = df['Side'].astype('category')
 
         return df
 
+    def _preprocess_fills(self, df):
+        """
+        成交明细的预处理：清洗价格 / 数量、解析成交时间后，按 币种 + 持仓方向 FIFO 重建成
+        已平仓交易 (见 fills.reconstruct_trades)，之后与仓位历史走完全相同的分析。
+        """
+        price = self._clean_numeric_column(df['Price'], units=True).to_numpy()
+        qty = self._clean_numeric_column(df['Quantity'], units=True).to_numpy()
+        time = self._parse_time_column(df['Time'])
+        symbol = df['Symbol'] if 'Symbol' in df.columns else pd.Series('Unknown', index=df.index)
+        trades, stats = reconstruct_trades(symbol, df.get('Side'), df.get('Position Side'), price, qty, time)
+        print(f"[INFO] ✅ 成交明细 {stats['fills']} 条 (跳过 {stats['skipped']} 条) -> 重建交易 {stats['trades']} 笔，"
+              f"未匹配平仓量 {stats['unmatched_qty']:g}，未平仓量 {stats['open_qty']:g}")
+        return trades
+
+    def memory_bytes(self):
+        """标准化后明细表实际占用的内存 (字节)"""
+        return frame_bytes(self.df)
+
+    def _preprocess_new(self, df, base):
+        """
+        增量模式的预处理：先只解析平仓时间，不晚于 base 末笔的行直接丢弃，
+        剩下的行 (通常只有新增的几笔和上次留下的末尾一组) 才做完整预处理。
+        """
+        headers = clean_headers(df.columns)
+        resolution = resolve_columns(headers)
+        check_resolution(resolution, headers)
+        # 成交明细要从第一笔成交开始撮合，不能预先丢行
+        if pd.notna(base.closed_max) and resolution.kind == 'positions':
+            columns = {resolution.rename.get(h, h): c for h, c in zip(headers, df.columns)}
+            # 缺少平仓时间的文件用开仓时间代替 (与 _preprocess 一致)
+            closed = self._parse_time_column(df[columns.get('Closed', columns['Opened'])],
+                                             TIME_FORMATS.get(resolution.exchange))
+            df = df[~(closed <= base.closed_max).to_numpy()]
+        return drop_seen(self._preprocess(df), base)
+
+    def _with_base(self, aggregate):
+        # 新增交易的平仓时间都不早于 base，直接接在 base 后面 (不修改 base 本身)
+        if self.base is None:
+            return aggregate
+        return TradeAggregate().merge(self.base).merge(aggregate)
+
+    def get_aggregate(self):
+        return self._with_base(TradeAggregate.from_frame(self.df, self.fee_rate))
+
+    def get_parts(self):
+        """
+        拆成 (可以保存为状态的前缀, 末尾一组)，两者依次合并就是 get_aggregate() 的结果。
+        末尾一组是 held_mask 选出的交易，不写进状态，下次增量分析从新导出里重新读取。
+        """
+        held = held_mask(self.df['Closed'])
+        settled = self._with_base(TradeAggregate.from_frame(self.df[~held], self.fee_rate))
+        return settled, TradeAggregate.from_frame(self.df[held], self.fee_rate)
+
     def get_analysis_json(self):
         """
         计算所有指标并返回 JSON
         """
-        df = self.df
-        
-        # --- 1. 基础体征 (Vitals) ---
-        total_pnl = df['Net PnL'].sum()
-        gross_pnl = df['Closing PNL'].sum()
-        total_fees = df['est_fee'].sum()
-        
-        # 真实盈亏 (Realized) - 排除 0
-        real_loss = df[df['Net PnL'] < 0]['Net PnL'].sum()
-        real_profit = df[df['Net PnL'] > 0]['Net PnL'].sum()
-        
-        # 总交易额
-        total_volume = ((df['Entry Price'] + df['Avg. Close Price']) * df['Closed Vol.']).sum()
-        
-        # 交易总数
-        total_trades = len(df)
-        winning_trades = df[df['Net PnL'] > 0]
-        losing_trades = df[df['Net PnL'] < 0]
+        return self.get_aggregate().to_json()
 
-        # --- 2. 核心绩效 (Performance) ---
-        win_rate = len(winning_trades) / total_trades if total_trades > 0 else 0
-        
-        avg_win = winning_trades['Net PnL'].mean() if not winning_trades.empty else 0
-        avg_loss = abs(losing_trades['Net PnL'].mean()) if not losing_trades.empty else 0
-        rr_ratio = avg_win / avg_loss if avg_loss > 0 else 0
-        
-        profit_factor = real_profit / abs(real_loss) if abs(real_loss) > 0 else 0
-        expectancy = df['Net PnL'].mean()
 
-        # --- 3. 多空偏好 (Direction) ---
-        longs = df[df['Side'].str.lower().isin(['long', 'buy'])] if 'Side' in df.columns else pd.DataFrame()
-        shorts = df[df['Side'].str.lower().isin(['short', 'sell'])] if 'Side' in df.columns else pd.DataFrame()
-        
-        direction_stats = {
-            "long": {"count": len(longs), "pnl": longs['Net PnL'].sum() if not longs.empty else 0},
-            "short": {"count": len(shorts), "pnl": shorts['Net PnL'].sum() if not shorts.empty else 0}
-        }
-
-        # --- 4. 持仓时间分类 (Duration) ---
-        # 关键修正：为了方便前端绑定，这里使用简单的英文 Key，前端再映射回中文显示
-        bins = [0, 5, 15, 60, 240, float('inf')]
-        # 对应：剥头皮, 超短线, 日内短线, 日内波段, 长线
-        keys = ['less_5m', '5m_15m', '15m_60m', '1h_4h', 'more_4h'] 
-        df['duration_type'] = pd.cut(df['duration_minutes'], bins=bins, labels=keys)
-        
-        duration_stats = {}
-        for key in keys:
-            sub_df = df[df['duration_type'] == key]
-            if not sub_df.empty:
-                top_coins = sub_df.groupby('Symbol')['Net PnL'].sum().sort_values(ascending=False).head(5).index.tolist()
-                win_rate_sub = len(sub_df[sub_df['Net PnL'] > 0]) / len(sub_df)
-                duration_stats[key] = {
-                    "count": len(sub_df),
-                    "pnl": sub_df['Net PnL'].sum(),
-                    "win_rate": win_rate_sub,
-                    "top_coins": top_coins
-                }
+class StreamingTradeAnalyzer(TradeAnalyzer):
+    """
+    分块流式分析：CSV 按块读取，每块走同样的 _preprocess 规则后折叠进
+    TradeAggregate，处理完即丢弃明细，峰值内存只取决于块大小而与文件大小无关。
+    要求交易记录按平仓时间排序 (正序或倒序均可)，否则抛出 UnorderedStreamError。
+    倒序导出的权益曲线要等最早的一块到了才能折叠，期间每笔保留平仓时间和净盈亏 (16 字节)。
+    除浮点合计的累加顺序不同 (末位误差) 外，结果与整表分析一致。
+    传入 sink (TradeStoreWriter) 时，每块标准化后的明细同时追加写进列式缓存。
+    """
+    def __init__(self, chunks, timings=None, base=None, fee_rate=FEE_RATE, sink=None):
+        self.df = None
+        self.base = base
+        self.fee_rate = fee_rate
+        # 已折叠的前缀 (不含末尾一组，见 held_mask) 和平仓时间缺失的交易
+        self.aggregate = TradeAggregate()
+        self.nat = TradeAggregate()
+        # 第一块里平仓时间最晚的一组先放着：倒序导出时它就是全局最后一组，正序导出时确定方向后接回原位
+        self.latest = None
+        self.forward = None
+        # 增量分析时，确认是正序导出后立即把 base 接在前面，之后的块直接折叠进权益曲线
+        self.base_attached = base is None
+        # 明细只在处理单块时存在，内存占用取各块的峰值
+        self.peak_bytes = 0
+        timings = {} if timings is None else timings
+        chunks = iter(chunks)
+        carry, final = None, None
+        while True:
+            with stage_timer(timings, 'read_csv'):
+                chunk = next(chunks, None)
+            with stage_timer(timings, 'preprocess'):
+                last = chunk is None
+                if not last:
+                    chunk = self._preprocess(chunk) if base is None else self._preprocess_new(chunk, base)
+            if sink is not None and not last:
+                with stage_timer(timings, 'store'):
+                    sink.write(chunk[STORED_COLUMNS])
+            with stage_timer(timings, 'preprocess'):
+                # 与下一块平仓时间可能相同的末尾交易先留着，拼到下一块前面一起折叠；
+                # 读完后交出的是最后一块末尾平仓时间相同的一组
+                chunk, carry = _split_boundary(carry, chunk)
+            if chunk is None:
+                break
+            self.peak_bytes = max(self.peak_bytes, frame_bytes(chunk))
+            with stage_timer(timings, 'analysis'):
+                if last:
+                    final = TradeAggregate.from_frame(chunk, self.fee_rate)
+                    continue
+                nat = chunk['Closed'].isna().to_numpy()
+                if nat.any():
+                    self.nat.merge(TradeAggregate.from_frame(chunk[nat], self.fee_rate))
+                    chunk = chunk[~nat]
+                if len(chunk) == 0:
+                    continue
+                if self.latest is None and self.forward is None:
+                    top = (chunk['Closed'] == chunk['Closed'].max()).to_numpy()
+                    self.latest = TradeAggregate.from_frame(chunk[top], self.fee_rate)
+                    self.aggregate.merge(TradeAggregate.from_frame(chunk[~top], self.fee_rate))
+                    continue
+                self._fold(TradeAggregate.from_frame(chunk, self.fee_rate))
+
+        # 最后一组：倒序导出时是最早的交易，折叠进前缀；否则它就是末尾一组
+        group = final
+        if self.latest is not None:
+            if final is not None and final.closed_max < self.latest.closed_min:
+                self._fold(final)
+                group = self.latest
             else:
-                 duration_stats[key] = {"count": 0, "pnl": 0, "win_rate": 0, "top_coins": []}
-
-        # --- 5. 交易频率 & 时薪 ---
-        if 'Closed' in df.columns and total_trades > 0:
-            days_span = (df['Closed'].max() - df['Opened'].min()).days + 1
-            frequency = total_trades / days_span if days_span > 0 else total_trades
-        else:
-            frequency = 0
-        
-        total_hours = df['duration_minutes'].sum() / 60
-        hourly_wage = total_pnl / total_hours if total_hours > 0 else 0
-        
-        # --- 6. 资产偏好 (Assets) ---
-        if total_trades > 0:
-            asset_grp = df.groupby('Symbol').agg({'Net PnL': 'sum', 'Opened': 'count'}).reset_index()
-            # 计算单币种胜率
-            asset_win_rates = []
-            for sym in asset_grp['Symbol']:
-                sub = df[df['Symbol'] == sym]
-                wr = len(sub[sub['Net PnL'] > 0]) / len(sub)
-                asset_win_rates.append(wr)
-            asset_grp['win_rate'] = asset_win_rates
-            
-            asset_sorted = asset_grp.sort_values('Net PnL', ascending=False)
-            top_5_assets = asset_sorted.head(5).to_dict('records')
-            bottom_5_assets = asset_sorted.tail(5).to_dict('records')
-        else:
-            top_5_assets = []
-            bottom_5_assets = []
-
-        # --- 7. 连胜/连败 (Streaks) ---
-        max_loss_streak = 0
-        max_loss_amount = 0
-        loss_culprits = []
-        max_win_streak = 0
-        max_win_amount = 0
-        win_heroes = []
-
-        if total_trades > 0:
-            df_sorted = df.sort_values('Closed')
-            df_sorted['result_sign'] = np.sign(df_sorted['Net PnL'])
-            # 巧妙算法：计算连续组
-            df_sorted['group_id'] = (df_sorted['result_sign'] != df_sorted['result_sign'].shift()).cumsum()
-            streak_groups = df_sorted.groupby(['group_id', 'result_sign'])
-            
-            for (gid, sign), group in streak_groups:
-                if sign == -1: # 连败
-                    if len(group) > max_loss_streak:
-                        max_loss_streak = len(group)
-                        max_loss_amount = group['Net PnL'].sum()
-                        loss_culprits = group.groupby('Symbol')['Net PnL'].sum().sort_values().head(3).index.tolist()
-                elif sign == 1: # 连胜
-                    if len(group) > max_win_streak:
-                        max_win_streak = len(group)
-                        max_win_amount = group['Net PnL'].sum()
-                        win_heroes = group.groupby('Symbol')['Net PnL'].sum().sort_values(ascending=False).head(3).index.tolist()
-
-        # --- 8. 时间分析 (Timing) ---
-        hourly_pnl = df.groupby('open_hour')['Net PnL'].sum().to_dict()
-        daily_pnl = df.groupby('day_name')['Net PnL'].sum().sort_values(ascending=False)
-        best_day = daily_pnl.index[0] if not daily_pnl.empty else "N/A"
-        worst_day = daily_pnl.index[-1] if not daily_pnl.empty else "N/A"
-
-        # --- 9. 持仓效率 (Efficiency) ---
-        # 避免除以 0
-        df['efficiency'] = abs(df['Closing PNL']) / df['duration_minutes'].replace(0, 1)
-        avg_efficiency = df['efficiency'].mean() if not df.empty else 0
-
-        # --- 10. 组装返回 ---
-        return {
-            "vitals": {
-                "net_pnl": float(total_pnl),
-                "gross_pnl": float(gross_pnl),
-                "real_profit": float(real_profit),
-                "real_loss": float(real_loss),
-                "total_fees": float(total_fees),
-                "volume": float(total_volume),
-                "trade_count": int(total_trades),
-                "hourly_wage": float(hourly_wage),
-                "frequency": float(frequency)
-            },
-            "performance": {
-                "win_rate": float(win_rate),
-                "rr_ratio": float(rr_ratio),
-                "profit_factor": float(profit_factor),
-                "expectancy": float(expectancy),
-                "avg_efficiency": float(avg_efficiency)
-            },
-            "direction": direction_stats,
-            "duration_analysis": duration_stats,
-            "assets": {
-                "top_5": top_5_assets,
-                "bottom_5": bottom_5_assets
-            },
-            "streaks": {
-                "max_win": {
-                    "count": int(max_win_streak),
-                    "amount": float(max_win_amount),
-                    "heroes": win_heroes
-                },
-                "max_loss": {
-                    "count": int(max_loss_streak),
-                    "amount": float(max_loss_amount),
-                    "culprits": loss_culprits
-                }
-            },
-            "timing": {
-                "hourly_pnl": hourly_pnl,
-                "best_day": best_day,
-                "worst_day": worst_day
-            }
-        }
\ No newline at end of file
+                self._settle_latest()
+        if group is not None and pd.notna(self.aggregate.closed_max) and group.closed_min < self.aggregate.closed_max:
+            raise UnorderedStreamError("交易记录未按平仓时间排序，无法分块计算连胜/连败")
+        self.held = TradeAggregate().merge(self.nat).merge(group or TradeAggregate())
+
+    def _fold(self, part):
+        """把一块平仓时间有效的交易折叠进前缀；第一次遇到比 latest 晚的块时确定是正序导出"""
+        if self.latest is not None and self.forward is None:
+            self.forward = part.closed_min >= self.latest.closed_max
+            if self.forward:
+                self._settle_latest()
+        self.aggregate.merge(part)
+
+    def _settle_latest(self):
+        if not self.base_attached:
+            self.aggregate = self._with_base(self.aggregate)
+            self.base_attached = True
+        self.aggregate.merge(self.latest)
+        self.latest = None
+
+    def get_parts(self):
+        return self.aggregate if self.base_attached else self._with_base(self.aggregate), self.held
+
+    def get_aggregate(self):
+        settled, held = self.get_parts()
+        return TradeAggregate().merge(settled).merge(held)
+
+    def memory_bytes(self):
+        return self.peak_bytes
+
+
+def _split_boundary(carry, chunk):
+    """
+    分块边界上平仓时间相同的交易必须在同一块里折叠：倒序导出时各块按时间倒过来拼接，
+    并列交易若分在两块，先后就与整表稳定排序 (文件顺序) 不一致。
+    把上一块留下的行拼在本块前面 (保持文件顺序)，再把与本块最后一笔平仓时间相同的行留给下一块。
+    chunk 为 None (已读完) 时交出剩下的行。返回 (这次折叠的明细, 留给下一块的明细)。
+    """
+    if chunk is None:
+        return carry, None
+    if carry is not None and len(chunk) == 0:
+        chunk = carry
+    elif carry is not None:
+        chunk = pd.concat([carry, chunk], ignore_index=True)
+        # 两块的类别不同，拼接后会退化成 object，重新转回 category
+        for col in ['Symbol', 'Side']:
+            chunk[col] = chunk[col].astype('category')
+    closed = chunk['Closed'].dropna()
+    if len(closed) == 0:
+        return chunk, None
+    hold = (chunk['Closed'] == closed.iloc[-1]).to_numpy()
+    return chunk[~hold], chunk[hold]
+
+
+def read_trades_csv(source, columns=None, **kwargs):
+    """
+    读取交易 CSV。thousands=',' 让 C 解析器直接把 '1,234.56' 读成 float64，
+    数字列不再经过 object 字符串中转。
+    columns 为需要的列名 (去空格后，见 ColumnResolution.usecols)，其余列解析时直接跳过。
+    """
+    if columns is not None:
+        wanted = set(columns)
+        kwargs['usecols'] = lambda c: c.strip() in wanted
+    return pd.read_csv(source, thousands=',', **kwargs)
+
+
+def drop_seen(df, base):
+    """
+    去掉已经计入 base 的交易 (df 已预处理)。base 只含末笔平仓时刻之前的交易 (末尾一组见 held_mask)，
+    所以平仓时间不晚于 base 末笔的全部丢弃，其余交易 (包括平仓时间缺失的) 都保留。
+    """
+    if pd.isna(base.closed_max):
+        return df
+    return df[~(df['Closed'] <= base.closed_max).to_numpy()]
+
+
+def load_state(state):
+    """还原之前保存的聚合状态；没有状态或版本不一致时返回 None (全量重算)"""
+    if not state:
+        return None
+    try:
+        return TradeAggregate.from_state(state)
+    except StateVersionError as e:
+        print(f"[WARN] ⚠️ {e}，忽略旧状态全量重算")
+        return None
+
+
+def load_csv_bytes(contents, chunk_rows=None, timings=None, base=None, store=None, store_key=None, engine='pandas',
+                   base_key=None):
+    """
+    解析上传的 CSV，返回已经读完数据的 analyzer (整表为 TradeAnalyzer，分块为 StreamingTradeAnalyzer)。
+    contents 为字节串或文件路径，gzip / zip 压缩的导出边读边解压。只读取列名解析命中的列。
+    指定 chunk_rows 时走分块流式模式；文件未按时间排序则自动回退到整表模式。
+    传入 base (之前保存的聚合状态) 时只处理新增的交易，结果与全量重算一致。
+    传入 store (TradeStore) 时，标准化后的明细以 store_key 存入列式缓存 (分块模式逐块追加写入)；
+    增量分析时旧交易的明细取自 base_key (旧状态对应的上传) 的缓存，取不到就不保存本次的明细。
+    传入 timings 字典时，各阶段耗时 (秒) 会累加进去。
+    engine='polars' 时整表用 PolarsTradeAnalyzer 处理 (不分块)；增量分析或没装 polars 时仍用 pandas。
+    成交明细 (表头按 FILL_COLUMN_MAPPING 识别) 总是整表读入，FIFO 重建成交易后再分析。
+    """
+    timings = {} if timings is None else timings
+    # 先只读表头：缺少必需列直接报错，不读数据体
+    with stage_timer(timings, 'sniff'):
+        resolution = sniff_csv(contents)
+    positions = resolution.kind == 'positions'
+    prefix = None
+    if store is not None and base is not None:
+        prefix = _stored_prefix(store, base_key, base)
+        if prefix is None:
+            print("[WARN] ⚠️ 旧数据的明细缓存不存在，本次增量分析不保存明细")
+            store = None
+    if engine == 'polars' and base is None and positions:
+        analyzer = load_polars(contents, resolution, timings)
+        if analyzer is not None:
+            if store is not None:
+                with stage_timer(timings, 'store'):
+                    store.save(store_key, analyzer.df[STORED_COLUMNS])
+            return analyzer
+    if chunk_rows and positions:
+        try:
+            source, compression = csv_source(contents)
+            chunks = read_trades_csv(source, resolution.usecols, chunksize=chunk_rows, compression=compression)
+            sink = store.writer(store_key) if store is not None else None
+            # 正常结束时写好的缓存文件替换上去；回退整表模式时丢弃，由下面整表保存
+            with nullcontext() if sink is None else sink:
+                if sink is not None and prefix is not None:
+                    sink.write(prefix)
+                return StreamingTradeAnalyzer(chunks, timings, base, sink=sink)
+        except UnorderedStreamError as e:
+            print(f"[WARN] ⚠️ {e}，回退到整表模式")
+    with stage_timer(timings, 'read_csv'):
+        source, compression = csv_source(contents)
+        df = read_trades_csv(source, resolution.usecols, compression=compression)
+    with stage_timer(timings, 'preprocess'):
+        analyzer = TradeAnalyzer(df, base)
+    if store is not None:
+        # 标准化后的明细落盘，之后换参数重新分析时不用再解析 CSV
+        with stage_timer(timings, 'store'):
+            df = analyzer.df[STORED_COLUMNS]
+            if prefix is not None and len(prefix) > 0:
+                df = pd.concat([prefix, df], ignore_index=True) if len(df) > 0 else prefix
+            store.save(store_key, df)
+    return analyzer
+
+
+def _stored_prefix(store, key, base):
+    """
+    增量分析时旧交易的明细：上次上传的列式缓存里平仓时间不晚于 base 末笔的行，
+    正好是 drop_seen 丢掉、没有重新处理的那部分。缓存不存在时返回 None。
+    """
+    df = store.load(key, STORED_COLUMNS) if key else None
+    if df is None:
+        return None
+    return df[(df['Closed'] <= base.closed_max).to_numpy()]
+
+
+def load_polars(contents, resolution, timings):
+    """polars 引擎读取 + 预处理；没装 polars 时返回 None (调用方退回 pandas)"""
+    from polars_engine import pl, read_trades_polars, PolarsTradeAnalyzer
+    if pl is None:
+        print("[WARN] ⚠️ 未安装 polars，使用 pandas 引擎")
+        return None
+    with stage_timer(timings, 'read_csv'):
+        source, compression = csv_source(contents)
+        df = read_trades_polars(source, resolution.usecols, compression)
+    with stage_timer(timings, 'preprocess'):
+        return PolarsTradeAnalyzer(df)
+
+
+def analyze_csv_bytes(contents, chunk_rows=None, timings=None, state=None, engine='pandas'):
+    """解析上传的 CSV 并返回指标 JSON (参数见 load_csv_bytes，state 为 to_state() 导出的状态)"""
+    timings = {} if timings is None else timings
+    analyzer = load_csv_bytes(contents, chunk_rows, timings, load_state(state), engine=engine)
+    with stage_timer(timings, 'analysis'):
+        return analyzer.get_analysis_json()
+
+
+def analyze_csv_bytes_timed(contents, chunk_rows=None, state=None, store=None, store_key=None, engine='pandas',
+                            state_id=None):
+    """
+    进程池入口：返回 (指标 JSON, 运行信息)，一起跨进程传回。state_id 为 state 对应的上传
+    (增量分析时从它的明细缓存补上旧交易)。运行信息包括：
+    timings 各阶段耗时、state 新的聚合状态 (供下次上传做增量分析)、
+    base_trades 旧状态里已有的交易笔数 (没有可用旧状态时为 0)、frame_bytes 明细表内存占用。
+    """
+    timings = {}
+    base = load_state(state)
+    analyzer = load_csv_bytes(contents, chunk_rows, timings, base, store, store_key, engine, state_id)
+    with stage_timer(timings, 'analysis'):
+        settled, held = analyzer.get_parts()
+    # 状态只保存前缀 (见 held_mask)，要在合并末尾一组之前导出
+    with stage_timer(timings, 'state'):
+        new_state = settled.to_state()
+    with stage_timer(timings, 'analysis'):
+        data = settled.merge(held).to_json()
+    return data, {
+        "timings": timings,
+        "state": new_state,
+        "base_trades": base.trade_count if base is not None else 0,
+        "frame_bytes": analyzer.memory_bytes(),
+    }
+
+
+class StoredTradeAnalyzer(TradeAnalyzer):
+    """
+    对列式缓存里已经标准化的明细重新分析：可以换手续费率、只看某个时间窗口 (按平仓时间，
+    左闭右开)。跳过 CSV 解析和 _preprocess，明细只读不改。
+    """
+    def __init__(self, df, fee_rate=FEE_RATE, start=None, end=None):
+        self.base = None
+        self.fee_rate = fee_rate
+        # 分块写入的缓存里币种 / 方向是普通字符串，与 _preprocess 一样转回 category (类别按字典序)
+        for col in ['Symbol', 'Side']:
+            if not isinstance(df[col].dtype, pd.CategoricalDtype):
+                df[col] = df[col].astype('category')
+        if start is not None:
+            df = df[(df['Closed'] >= start).to_numpy()]
+        if end is not None:
+            df = df[(df['Closed'] < end).to_numpy()]
+        self.df = df
+
+
+def reanalyze_stored(store, key, fee_rate=FEE_RATE, start=None, end=None):
+    """
+    进程池入口：从列式缓存内存映射读取标准化明细并重新计算指标。
+    返回 (指标 JSON, 各阶段耗时)；缓存不存在时返回 None。
+    """
+    timings = {}
+    with stage_timer(timings, 'load'):
+        df = store.load(key, STORED_COLUMNS)
+    if df is None:
+        return None
+    with stage_timer(timings, 'preprocess'):
+        analyzer = StoredTradeAnalyzer(df, fee_rate, start, end)
+    with stage_timer(timings, 'analysis'):
+        data = analyzer.get_analysis_json()
+    return data, timings
+
+
+def normalize_csv_bytes(contents):
+    """
+    进程池入口 (多文件模式)：解析 + 标准化单个 CSV。
+    返回 (标准化后的明细, 交易所, 该文件单独的指标摘要, 各阶段耗时)。
+    """
+    timings = {}
+    with stage_timer(timings, 'sniff'):
+        resolution = sniff_csv(contents)
+    with stage_timer(timings, 'read_csv'):
+        source, compression = csv_source(contents)
+        df = read_trades_csv(source, resolution.usecols, compression=compression)
+    with stage_timer(timings, 'preprocess'):
+        analyzer = TradeAnalyzer(df)
+    with stage_timer(timings, 'analysis'):
+        data = analyzer.get_analysis_json()
+    summary = {"vitals": data["vitals"], "performance": data["performance"]}
+    return analyzer.df[STORED_COLUMNS], analyzer.exchange, summary, timings
+
+
+class BatchTradeAnalyzer(TradeAnalyzer):
+    """
+    多个交易所 / 多个文件的合并分析：各文件已分别标准化，
+    这里按平仓时间合并成一条时间线，整体只算一次指标，另附每个来源的分项。
+    """
+    def __init__(self, frames, sources):
+        self.base = None
+        self.fee_rate = FEE_RATE
+        self.df = pd.concat(frames, ignore_index=True).sort_values('Closed', kind='stable', ignore_index=True)
+        # 各文件的类别不同，合并后会退化成 object，重新转回 category
+        for col in ['Symbol', 'Side']:
+            self.df[col] = self.df[col].astype('category')
+        self.sources = sources
+
+    def get_analysis_json(self):
+        data = super().get_analysis_json()
+        data['sources'] = self.sources
+        return data
+
+
+def analyze_frames_timed(frames, sources):
+    """进程池入口：合并已标准化的明细并计算指标，返回 (指标 JSON, 各阶段耗时)"""
+    timings = {}
+    with stage_timer(timings, 'merge'):
+        analyzer = BatchTradeAnalyzer(frames, sources)
+    with stage_timer(timings, 'analysis'):
+        data = analyzer.get_analysis_json()
+    return data, timings
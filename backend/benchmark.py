@@ -0,0 +1,274 @@
+# backend/benchmark.py
+# 用合成交易数据测量 _preprocess / get_analysis_json / 端到端 csv_to_json / 分块流式分析 / 响应序列化 / 完整 /analyze 的耗时，
+# 结果写成 JSON 便于对比。合成数据按平仓时间排序 (与交易所导出一致)，分块流式分析不会回退到整表模式。
+# 序列化阶段同时记录响应体字节数 (未压缩 / gzip / br)，对应移动网络下实际传输的大小。
+#
+#   python benchmark.py                                   # 默认 1k,100k,1M,10M 行
+#   python benchmark.py --rows 1000,100000 --dialect chinese --dirty 0.1
+#   python benchmark.py --rows 100000 --baseline bench_results.json --output new.json
+#   python benchmark.py --rows 1000000 --engines pandas,polars      # 同时测 polars 引擎 (阶段名带 [polars])
+import os
+import io
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import subprocess
+
+# /analyze 走完整流程但不能命中结果缓存，也不能真的调用 Gemini
+os.environ["RESULT_CACHE_SIZE"] = "0"
+os.environ["REPORT_CACHE_SIZE"] = "0"
+os.environ.pop("RESULT_CACHE_DIR", None)
+os.environ.pop("REPORT_CACHE_DIR", None)
+
+import numpy as np
+import pandas as pd
+from fastapi.encoders import jsonable_encoder
+
+from analyzer import TradeAnalyzer, StreamingTradeAnalyzer, read_trades_csv, frame_bytes
+from polars_engine import pl, read_trades_polars, PolarsTradeAnalyzer
+from serialize import dumps, compress, brotli
+from schema import sniff_csv
+from synthetic import generate_csv, generate_fills, DIALECTS
+
+STUB_REPORT = "# 1. 核心诊断\n本地桩模型，不调用 Gemini。\n# 6. 确诊通知书\n{}"
+
+
+class StubResponse:
+    text = STUB_REPORT
+
+
+class StubModel:
+    """替代 Gemini 的本地桩模型，只返回固定文本"""
+
+    async def generate_content_async(self, prompt, **kwargs):
+        return StubResponse()
+
+    def generate_content(self, prompt, **kwargs):
+        return StubResponse()
+
+
+def timed(fn, repeat):
+    """执行 repeat 次，返回每次的耗时 (秒) 和最后一次的结果"""
+    seconds, result = [], None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        seconds.append(time.perf_counter() - start)
+    return seconds, result
+
+
+def bench_endpoint(raw, repeat):
+    import httpx
+    import main
+
+    main.models.use(StubModel(), "stub")
+
+    async def run():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            seconds = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                resp = await client.post("/analyze", files={"file": ("bench.csv", raw, "text/csv")})
+                seconds.append(time.perf_counter() - start)
+                body = resp.json()
+                if "error" in body:
+                    raise RuntimeError(body["error"])
+            return seconds
+
+    return asyncio.run(run())
+
+
+def bench_serialization(data, repeat):
+    """
+    /analyze 响应体的序列化：FastAPI 默认路径 (jsonable_encoder + json.dumps) 对比紧凑路径 (dumps)，
+    以及紧凑结果再压缩。返回 [(阶段, 耗时列表, 字节数)]。
+    """
+    body = {"report": STUB_REPORT, "raw_data": data, "cache": "miss", "state_id": "0" * 64}
+    stages = []
+
+    def default():
+        return json.dumps(jsonable_encoder(body), ensure_ascii=False, allow_nan=False,
+                          separators=(",", ":")).encode("utf-8")
+
+    seconds, payload = timed(default, repeat)
+    stages.append(("json_default", seconds, len(payload)))
+    seconds, payload = timed(lambda: dumps(body), repeat)
+    stages.append(("json_compact", seconds, len(payload)))
+    for encoding in ["gzip"] + (["br"] if brotli is not None else []):
+        seconds, compressed = timed(lambda: compress(payload, encoding), repeat)
+        stages.append((f"json_{encoding}", seconds, len(compressed)))
+    return stages
+
+
+def bench_polars(raw, usecols, repeat):
+    """polars 引擎的 read_csv / _preprocess / get_analysis_json / 端到端 csv_to_json，返回 [(阶段, 耗时列表)]"""
+    seconds, df = timed(lambda: read_trades_polars(io.BytesIO(raw), usecols), repeat)
+    stages = [("read_csv", seconds)]
+    seconds, analyzer = timed(lambda: PolarsTradeAnalyzer(df), repeat)
+    stages.append(("_preprocess", seconds))
+    seconds, _ = timed(analyzer.get_analysis_json, repeat)
+    stages.append(("get_analysis_json", seconds))
+    seconds, _ = timed(lambda: PolarsTradeAnalyzer(read_trades_polars(io.BytesIO(raw), usecols)).get_analysis_json(),
+                       repeat)
+    stages.append(("csv_to_json", seconds))
+    return stages
+
+
+def bench_fills(rows, args, repeat):
+    """成交明细导入：读 CSV + FIFO 重建交易 + 计算指标，返回 [(阶段, 耗时列表)]"""
+    raw = generate_fills(rows, symbols=args.symbols, seed=args.seed).to_csv(index=False).encode('utf-8')
+    usecols = sniff_csv(raw).usecols
+    seconds, df = timed(lambda: read_trades_csv(io.BytesIO(raw), usecols), repeat)
+    stages = [("fills_read_csv", seconds)]
+    seconds, analyzer = timed(lambda: TradeAnalyzer(df), repeat)
+    stages.append(("fills_fifo", seconds))
+    seconds, _ = timed(analyzer.get_analysis_json, repeat)
+    stages.append(("fills_analysis", seconds))
+    return stages
+
+
+def bench_streaming(raw, usecols, chunk_rows, repeat):
+    """分块流式分析 (读取、预处理、折叠交错进行) 的总耗时，返回 (耗时列表, 单块明细的内存峰值)"""
+    def run():
+        analyzer = StreamingTradeAnalyzer(read_trades_csv(io.BytesIO(raw), usecols, chunksize=chunk_rows))
+        analyzer.get_analysis_json()
+        return analyzer
+
+    seconds, analyzer = timed(run, repeat)
+    return seconds, analyzer.memory_bytes()
+
+
+def run_size(rows, args):
+    repeat = args.repeat if rows < 1_000_000 else 1
+    raw = generate_csv(rows, symbols=args.symbols, win_rate=args.win_rate, dialect=args.dialect,
+                       dirty_ratio=args.dirty, seed=args.seed, sort_by='Closed')
+    results = []
+
+    def record(stage, seconds, size=None):
+        best = min(seconds)
+        results.append({
+            "rows": rows,
+            "stage": stage,
+            "seconds": seconds,
+            "best": best,
+            "rows_per_sec": rows / best if best > 0 else None,
+            **({"bytes": size} if size is not None else {}),
+        })
+        suffix = f"  {size / 1024:>8.1f} KB" if size is not None else ""
+        print(f"{rows:>11,} 行  {stage:<18} {best * 1000:>10.1f} ms{suffix}")
+
+    usecols = sniff_csv(raw).usecols
+    seconds, df = timed(lambda: read_trades_csv(io.BytesIO(raw), usecols), repeat)
+    record("read_csv", seconds)
+    raw_bytes = frame_bytes(df)
+
+    # _preprocess 不修改传入的 DataFrame，可以反复在同一张表上跑
+    seconds, analyzer = timed(lambda: TradeAnalyzer(df), repeat)
+    record("_preprocess", seconds)
+    # 内存占用：读入的原始表 / 标准化后的明细表
+    print(f"{rows:>11,} 行  {'memory':<18} 读入 {raw_bytes / 1e6:,.1f} MB -> 标准化 {analyzer.memory_bytes() / 1e6:,.1f} MB")
+
+    seconds, data = timed(analyzer.get_analysis_json, repeat)
+    record("get_analysis_json", seconds)
+    # 端到端：读取 + 预处理 + 指标计算 (与 polars 引擎对比的是这一项)
+    seconds, _ = timed(lambda: TradeAnalyzer(read_trades_csv(io.BytesIO(raw), usecols)).get_analysis_json(), repeat)
+    record("csv_to_json", seconds)
+
+    seconds, peak_bytes = bench_streaming(raw, usecols, args.chunk_rows, repeat)
+    record("streaming", seconds)
+    print(f"{rows:>11,} 行  {'memory[stream]':<18} 单块峰值 {peak_bytes / 1e6:,.1f} MB (每块 {args.chunk_rows:,} 行)")
+
+    for stage, seconds, size in bench_serialization(data, repeat):
+        record(stage, seconds, size)
+
+    if "polars" in args.engines.split(","):
+        if pl is None:
+            print("[WARN] ⚠️ 未安装 polars，跳过 polars 引擎")
+        else:
+            for stage, seconds in bench_polars(raw, usecols, repeat):
+                pandas_best = next(r["best"] for r in results if r["stage"] == stage)
+                record(f"{stage}[polars]", seconds)
+                print(f"{'':>11}    {'':<18} 相对 pandas {pandas_best / min(seconds):>6.2f}x "
+                      f"({pl.thread_pool_size()} 线程)")
+
+    if args.fills:
+        for stage, seconds in bench_fills(rows, args, repeat):
+            record(stage, seconds)
+
+    if not args.skip_endpoint:
+        record("analyze_endpoint", bench_endpoint(raw, repeat))
+
+    return {"rows": rows, "csv_bytes": len(raw), "raw_frame_bytes": raw_bytes,
+            "frame_bytes": analyzer.memory_bytes()}, results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path):
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {(r["rows"], r["stage"]): r["best"] for r in json.load(f)["results"]}
+    print("-" * 60)
+    print(f"对比基线 {baseline_path}:")
+    for r in results:
+        old = baseline.get((r["rows"], r["stage"]))
+        if old:
+            print(f"{r['rows']:>11,} 行  {r['stage']:<18} {old / r['best']:>6.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TradeAnalyzer / /analyze 基准测试")
+    parser.add_argument("--rows", default="1000,100000,1000000,10000000", help="逗号分隔的行数列表")
+    parser.add_argument("--symbols", type=int, default=500, help="币种基数")
+    parser.add_argument("--win-rate", type=float, default=0.45)
+    parser.add_argument("--dialect", choices=sorted(DIALECTS), default="standard", help="表头写法")
+    parser.add_argument("--dirty", type=float, default=0.0, help="写成脏字符串的数字比例")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3, help="每项重复次数 (100 万行以上固定 1 次)")
+    parser.add_argument("--engines", default="pandas", help="逗号分隔的计算引擎 (pandas 总是会测)，如 pandas,polars")
+    parser.add_argument("--chunk-rows", type=int, default=200000, help="分块流式分析每块的行数 (同 CHUNK_ROWS)")
+    parser.add_argument("--fills", action="store_true", help="同时测成交明细导入 (同样行数的成交，FIFO 重建交易)")
+    parser.add_argument("--skip-endpoint", action="store_true", help="不测完整 /analyze")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--baseline", help="与之前输出的结果文件对比")
+    args = parser.parse_args()
+
+    sizes, results = [], []
+    for rows in (int(r) for r in args.rows.split(",")):
+        size, size_results = run_size(rows, args)
+        sizes.append(size)
+        results.extend(size_results)
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "commit": git_commit(),
+            "python": sys.version.split()[0],
+            "pandas": pd.__version__,
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "params": {k: v for k, v in vars(args).items() if k not in ("output", "baseline")},
+        },
+        "sizes": sizes,
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"结果已写入 {args.output}")
+
+    if args.baseline:
+        compare(results, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+def content_key(data: bytes) -> str:
+    """内容寻址：同样的文件字节得到同样的 key"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def _to_builtin(o):
+    # numpy 标量 (np.float64 / np.int64 ...) 转成 Python 原生类型
+    if hasattr(o, 'item'):
+        return o.item()
+    raise TypeError(f"无法序列化的类型: {type(o).__name__}")
+
+
+def payload_bytes(value):
+    """条目大小按序列化成 JSON 后的字节数估算 (与磁盘层的文件大小一致)"""
+    try:
+        return len(json.dumps(value, ensure_ascii=False, default=_to_builtin).encode('utf-8'))
+    except (TypeError, ValueError):
+        return 0
+
+
+class ResultCache:
+    """
+    结果缓存：内存层按条数和总字节数 (max_bytes，0 为不限) 做 LRU 淘汰 + TTL 过期；
+    可选的磁盘层 (每条一个 JSON 文件) 在进程重启后依然有效。
+    单条就超过 max_bytes 的条目不进内存层 (磁盘层照常保存)。
+    """
+
+    def __init__(self, max_entries=256, ttl=24 * 3600, disk_dir=None, max_disk_entries=4096, max_bytes=0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+        self.max_disk_entries = max_disk_entries
+        self._entries = OrderedDict()  # key -> (写入时间, value, 字节数)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def _expired(self, created):
+        return self.ttl > 0 and time.time() - created > self.ttl
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if not self._expired(entry[0]):
+                    self._entries.move_to_end(key)
+                    return entry[1]
+                self._pop(key)
+
+        entry = self._read_disk(key)
+        if entry is None:
+            return None
+        # 磁盘命中后提升到内存层
+        self._put_memory(key, entry[0], entry[1])
+        return entry[1]
+
+    def set(self, key, value):
+        created = time.time()
+        self._put_memory(key, created, value)
+        self._write_disk(key, created, value)
+
+    @property
+    def memory_bytes(self):
+        """内存层当前占用的字节数 (按 payload_bytes 估算)"""
+        return self._bytes
+
+    def _pop(self, key):
+        self._bytes -= self._entries.pop(key)[2]
+
+    def _put_memory(self, key, created, value):
+        size = payload_bytes(value) if self.max_bytes else 0
+        with self._lock:
+            if key in self._entries:
+                self._pop(key)
+            if self.max_bytes and size > self.max_bytes:
+                return
+            self._entries[key] = (created, value, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or (self.max_bytes and self._bytes > self.max_bytes):
+                self._pop(next(iter(self._entries)))
+
+    # --- 磁盘层 ---
+
+    def _path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def _read_disk(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                payload = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if self._expired(payload['created']):
+            self._remove(path)
+            return None
+        return payload['created'], payload['value']
+
+    def _write_disk(self, key, created, value):
+        if not self.disk_dir:
+            return
+        path = self._path(key)
+        tmp = None
+        try:
+            # 先写临时文件再原子替换，避免并发读到半个文件；临时文件名唯一，
+            # 多个 worker 进程 / 线程同时写同一个 key 时不会互相覆盖或删掉对方的临时文件
+            fd, tmp = tempfile.mkstemp(prefix=f"{key}.", suffix='.tmp', dir=self.disk_dir)
+            with open(fd, 'w', encoding='utf-8') as f:
+                json.dump({"created": created, "value": value}, f, ensure_ascii=False, default=_to_builtin)
+            os.replace(tmp, path)
+        except (OSError, TypeError, ValueError) as e:
+            print(f"[WARN] ⚠️ 缓存写入磁盘失败: {e}")
+            if tmp is not None:
+                self._remove(tmp)
+            return
+        self._prune_disk()
+
+    def _prune_disk(self):
+        files = [os.path.join(self.disk_dir, name) for name in os.listdir(self.disk_dir) if name.endswith('.json')]
+        if len(files) <= self.max_disk_entries:
+            return
+        files.sort(key=lambda p: os.path.getmtime(p) if os.path.exists(p) else 0)
+        for path in files[:len(files) - self.max_disk_entries]:
+            self._remove(path)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
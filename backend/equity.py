@@ -0,0 +1,329 @@
+import numpy as np
+import pandas as pd
+
+# 返回给前端的权益曲线最多这么多个点 (与交易笔数无关)
+CURVE_POINTS = 500
+# 折叠过程中保留的曲线点按序号分桶，桶数不超过这么多 (每桶最多留 4 个点，输出前再 LTTB 到 CURVE_POINTS)
+CURVE_BUCKETS = CURVE_POINTS // 2
+# 滚动胜率 / 期望值的窗口 (笔)
+ROLLING_WINDOW = 50
+# 浮点累加误差容忍：回到前高 (差值在此范围内) 即视为修复
+EPS = 1e-9
+
+
+def lttb(x, y, n_out):
+    """
+    Largest-Triangle-Three-Buckets 降采样，返回保留点的下标 (含首尾)。
+    每个桶里选与 "上一个选中点、下一个桶均值" 围成三角形面积最大的点，尖峰和回撤的形状都能保住。
+    循环次数是输出点数 (桶数)，桶内全部向量化，总体 O(n)。
+    """
+    n = len(x)
+    if n <= n_out or n_out < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=float) - float(x[0])  # 以首点为原点，纳秒时间戳转 float 时不丢精度
+    y = np.asarray(y, dtype=float)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    # 每个桶 "下一个桶" 的均值 (最后一个桶的下一个是末点)，用前缀和一次算完
+    bounds = np.append(edges, n)
+    cx, cy = np.concatenate([[0.0], np.cumsum(x)]), np.concatenate([[0.0], np.cumsum(y)])
+    width = bounds[2:] - bounds[1:-1]
+    avg_x = ((cx[bounds[2:]] - cx[bounds[1:-1]]) / width).tolist()
+    avg_y = ((cy[bounds[2:]] - cy[bounds[1:-1]]) / width).tolist()
+    edges = edges.tolist()
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    ax, ay = x[0], y[0]
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        xs, ys = x[lo:hi], y[lo:hi]
+        area = np.abs((ax - avg_x[i]) * (ys - ay) - (ax - xs) * (avg_y[i] - ay))
+        a = lo + int(area.argmax())
+        selected[i + 1] = a
+        ax, ay = x[a], y[a]
+    return selected
+
+
+def bucket_width(n_points):
+    """n_points 个曲线点分桶的宽度：使桶数不超过 CURVE_BUCKETS 的最小的 2 的幂，只取决于点数"""
+    width = 1
+    while -(-n_points // width) > CURVE_BUCKETS:
+        width *= 2
+    return width
+
+
+def reduce_points(index, equity, width):
+    """
+    按曲线点序号 index // width 分桶，每桶保留首点、末点、权益最低和最高的点 (并列取最早)，返回保留点的下标。
+    宽度为 2w 的桶正好由两个宽度为 w 的桶拼成，先按 w 缩减再按 2w 缩减与直接按 2w 缩减结果相同，
+    所以一次性折叠、分块折叠、从持久化状态接着折叠得到的曲线点完全一样。
+    """
+    n = len(index)
+    if width == 1 or n == 0:
+        return np.arange(n)
+    bucket = index // width
+    starts = np.flatnonzero(np.concatenate([[True], bucket[1:] != bucket[:-1]]))
+    lengths = np.diff(np.append(starts, n))
+    pos = np.arange(n)
+    lowest = np.minimum.reduceat(np.where(equity == np.repeat(np.minimum.reduceat(equity, starts), lengths), pos, n), starts)
+    highest = np.minimum.reduceat(np.where(equity == np.repeat(np.maximum.reduceat(equity, starts), lengths), pos, n), starts)
+    return np.unique(np.concatenate([starts, starts + lengths - 1, lowest, highest]))
+
+
+def _time_json(ns):
+    return None if ns is None else pd.Timestamp(int(ns)).strftime('%Y-%m-%d %H:%M:%S')
+
+
+class EquityState:
+    """
+    按平仓时间从早到晚折叠出来的权益曲线状态，大小有上限 (与交易笔数无关)，可以持久化。
+
+    同一平仓时刻的交易合成一个曲线点 (与同一时刻内的先后顺序无关)。
+    最后一个时刻的交易先不折叠 (open_times / open_pnl)：增量分析时新交易可能与它同一时刻。
+    曲线点边折叠边按 reduce_points 缩减，保留的点只取决于全部点本身、与分几批折叠无关，
+    持久化后接着折叠与一次性全量折叠得到同样的曲线。时间都是纳秒整数。
+    """
+
+    FIELDS = ['n_trades', 'n_points', 'first_time', 'last_time', 'cum', 'peak', 'peak_time',
+              'dd', 'dd_peak_time', 'dd_trough_time', 'dd_recovery_time',
+              'uw_start', 'uw_total', 'uw_longest', 'uw_longest_start', 'uw_longest_end']
+
+    def __init__(self):
+        self.n_trades = 0
+        self.n_points = 0
+        self.first_time = None
+        self.last_time = None
+        self.cum = 0.0
+        # 历史最高权益 (起点 0 也算) 及其时刻；起点的时刻记为第一笔平仓时间
+        self.peak = 0.0
+        self.peak_time = None
+        # 最大回撤：金额、前高时刻、谷底时刻、修复时刻 (尚未修复为 None)
+        self.dd = 0.0
+        self.dd_peak_time = None
+        self.dd_trough_time = None
+        self.dd_recovery_time = None
+        # 水下时间：当前这段的起点 (不在水下为 None)、已结束各段的总时长、最长一段 (结束为 None 表示仍在水下)
+        self.uw_start = None
+        self.uw_total = 0
+        self.uw_longest = 0
+        self.uw_longest_start = None
+        self.uw_longest_end = None
+        # 最近 ROLLING_WINDOW 笔已折叠交易的盈亏 (跨块计算滚动指标用)
+        self.tail = np.empty(0)
+        # 缩减后保留的曲线点：时间、权益、滚动胜率、滚动期望，以及各点在全部曲线点中的序号
+        self.points = np.empty((4, 0))
+        self.point_index = np.empty(0, dtype=np.int64)
+        # 最后一个平仓时刻尚未折叠的交易
+        self.open_times = np.empty(0, dtype=np.int64)
+        self.open_pnl = np.empty(0)
+
+    def copy(self):
+        state = EquityState()
+        state.__dict__.update(self.__dict__)
+        return state
+
+    def feed(self, times, pnl, final=False):
+        """
+        把平仓时间不早于已折叠部分的一批交易 (times 升序) 接到曲线后面，返回新状态 (不修改自身)。
+        final=True 时最后一个时刻也一并折叠 (输出结果前调用)。
+        """
+        s = self.copy()
+        times = np.concatenate([s.open_times, np.asarray(times, dtype=np.int64)])
+        pnl = np.concatenate([s.open_pnl, np.asarray(pnl, dtype=float)])
+        if len(times) == 0:
+            return s
+        # 同一时刻内按盈亏排序：滚动窗口的边界落在同一时刻中间时，结果与导出顺序 / 分块方式无关。
+        # 只重排有并列的那些行 (时间已升序，并列的行本来就挨在一起)
+        tied = np.diff(times) == 0
+        if tied.any():
+            rows = np.flatnonzero(np.concatenate([tied, [False]]) | np.concatenate([[False], tied]))
+            pnl[rows] = pnl[rows[np.lexsort((pnl[rows], times[rows]))]]
+
+        # 同一时刻的交易合成一个点
+        starts = np.concatenate([[0], np.flatnonzero(np.diff(times) != 0) + 1])
+        ends = np.append(starts[1:], len(times))
+        k = len(starts) if final else len(starts) - 1
+        s.open_times, s.open_pnl = times[ends[k - 1] if k else 0:], pnl[ends[k - 1] if k else 0:]
+        if k == 0:
+            return s
+        t = times[starts[:k]]
+        m = ends[k - 1]  # 本次折叠的交易笔数
+        if s.first_time is None:
+            s.first_time = int(t[0])
+            s.peak_time = int(t[0])
+
+        # --- 1. 权益 & 前高 ---
+        equity = s.cum + np.cumsum(np.add.reduceat(pnl[:m], starts[:k]))
+        running_peak = np.maximum.accumulate(np.concatenate([[s.peak], equity]))[1:]
+        is_high = equity >= running_peak - EPS
+        last_high = np.maximum.accumulate(np.where(is_high, np.arange(k), -1))
+        peak_time = np.where(last_high >= 0, t[np.maximum(last_high, 0)], s.peak_time)
+        high_idx = np.flatnonzero(is_high)
+
+        # --- 2. 最大回撤 (差值在 EPS 内算并列，取最早) ---
+        drawdown = running_peak - equity
+        worst = int(np.flatnonzero(drawdown >= drawdown.max() - EPS)[0])
+        if drawdown[worst] > s.dd + EPS:
+            s.dd = float(drawdown[worst])
+            s.dd_peak_time, s.dd_trough_time = int(peak_time[worst]), int(t[worst])
+            after = high_idx[high_idx > worst]
+            s.dd_recovery_time = int(t[after[0]]) if len(after) else None
+        elif s.dd > 0 and s.dd_recovery_time is None and len(high_idx):
+            # 之前的最大回撤还没修复，说明一直在同一段水下，第一个新高就是修复时刻
+            s.dd_recovery_time = int(t[high_idx[0]])
+
+        # --- 3. 水下时间：每个 "前一点在水下、本点回到前高" 的位置结束一段 ---
+        underwater = ~is_high
+        was_under = np.concatenate([[s.uw_start is not None], underwater[:-1]])
+        recovered = np.flatnonzero(is_high & was_under)
+        if len(recovered):
+            period_start = np.where(recovered > 0, peak_time[np.maximum(recovered - 1, 0)], s.uw_start or 0)
+            lengths = t[recovered] - period_start
+            s.uw_total += int(lengths.sum())
+            longest = int(np.argmax(lengths))
+            if lengths[longest] > s.uw_longest:
+                s.uw_longest = int(lengths[longest])
+                s.uw_longest_start, s.uw_longest_end = int(period_start[longest]), int(t[recovered[longest]])
+        s.uw_start = int(peak_time[-1]) if underwater[-1] else None
+
+        # --- 4. 滚动胜率 / 期望 (按笔，窗口跨块时用上一批的尾巴补齐) ---
+        extended = np.concatenate([s.tail, pnl[:m]])
+        wins = np.concatenate([[0], np.cumsum(extended > 0)])
+        sums = np.concatenate([[0.0], np.cumsum(extended)])
+        at = len(s.tail) + ends[:k]  # 每个点最后一笔交易之后的位置
+        lo = np.maximum(at - ROLLING_WINDOW, 0)
+        count = at - lo
+        win_rate = (wins[at] - wins[lo]) / count
+        expectancy = (sums[at] - sums[lo]) / count
+
+        points = np.concatenate([s.points, np.vstack([t, equity, win_rate, expectancy])], axis=1)
+        index = np.concatenate([s.point_index, s.n_points + np.arange(k)])
+        s.n_points += int(k)
+        keep = reduce_points(index, points[1], bucket_width(s.n_points))
+        s.points, s.point_index = points[:, keep], index[keep]
+        s.tail = extended[-ROLLING_WINDOW:]
+        s.n_trades += int(m)
+        s.cum = float(equity[-1])
+        s.peak, s.peak_time = float(running_peak[-1]), int(peak_time[-1])
+        s.last_time = int(t[-1])
+        return s
+
+    def to_state(self):
+        return {
+            **{name: _int_or_float(getattr(self, name)) for name in self.FIELDS},
+            "tail": self.tail.tolist(),
+            "points": self.points.tolist(),
+            "point_index": self.point_index.tolist(),
+            "open_times": self.open_times.tolist(),
+            "open_pnl": self.open_pnl.tolist(),
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        s = cls()
+        for name in cls.FIELDS:
+            setattr(s, name, state[name])
+        s.tail = np.asarray(state["tail"], dtype=float)
+        s.points = np.asarray(state["points"], dtype=float).reshape(4, -1)
+        s.point_index = np.asarray(state["point_index"], dtype=np.int64)
+        s.open_times = np.asarray(state["open_times"], dtype=np.int64)
+        s.open_pnl = np.asarray(state["open_pnl"], dtype=float)
+        return s
+
+    def to_json(self):
+        """降采样后的曲线 + 回撤 / 水下时间摘要，体积固定"""
+        keep = lttb(self.points[0], self.points[1], CURVE_POINTS)
+        time, equity, win_rate, expectancy = self.points[:, keep]
+        current = self.last_time - self.uw_start if self.uw_start is not None else 0
+        longest, longest_start, longest_end = self.uw_longest, self.uw_longest_start, self.uw_longest_end
+        if current > longest:
+            longest, longest_start, longest_end = current, self.uw_start, None
+        span = (self.last_time - self.first_time) if self.first_time is not None else 0
+        total = self.uw_total + current
+        return {
+            "points": {
+                "time": (time // 1_000_000).astype(np.int64).tolist(),  # 毫秒时间戳
+                "equity": np.round(equity, 2).tolist(),
+                "win_rate": np.round(win_rate, 4).tolist(),
+                "expectancy": np.round(expectancy, 2).tolist(),
+            },
+            "rolling_window": ROLLING_WINDOW,
+            "final": float(self.cum),
+            "peak": float(self.peak),
+            "max_drawdown": {
+                "amount": float(self.dd),
+                "peak_time": _time_json(self.dd_peak_time),
+                "trough_time": _time_json(self.dd_trough_time),
+                "recovery_time": _time_json(self.dd_recovery_time),
+            },
+            "underwater": {
+                "longest_hours": round(longest / 3.6e12, 2),
+                "longest_start": _time_json(longest_start),
+                "longest_end": _time_json(longest_end),
+                "current_hours": round(current / 3.6e12, 2),
+                "total_hours": round(total / 3.6e12, 2),
+                "ratio": round(total / span, 4) if span > 0 else 0.0,
+            },
+        }
+
+
+def _int_or_float(value):
+    if value is None:
+        return None
+    return int(value) if isinstance(value, (int, np.integer)) else float(value)
+
+
+class EquityCurve:
+    """
+    TradeAggregate 里的权益曲线部分：已折叠的前缀状态 (base) + 之后按时间顺序排列的明细段。
+    正序分块用 extend 接上后面一段并立即折叠，内存里只留大小有上限的状态；
+    倒序分块用 merge 只拼接明细段 (平仓时间 + 净盈亏两列，每笔 16 字节)，输出或持久化时再一次性折叠。
+    """
+
+    def __init__(self, base=None, segments=None):
+        self.base = base or EquityState()
+        self.segments = segments or []
+
+    @classmethod
+    def from_sorted(cls, times, pnl):
+        """times 为按平仓时间升序排列的纳秒时间戳 (不含缺失)，pnl 为对应的净盈亏"""
+        return cls(segments=[(np.asarray(times, dtype=np.int64), np.asarray(pnl, dtype=float))] if len(times) else [])
+
+    @property
+    def has_prefix(self):
+        """是否已有折叠过的前缀 (这样的曲线不能再接到别的曲线后面)"""
+        return self.base.n_trades > 0 or len(self.base.open_times) > 0
+
+    @property
+    def empty(self):
+        return not self.has_prefix and not self.segments
+
+    def merge(self, later):
+        """拼接时间上在后面的一段，返回新对象 (later 必须还没有折叠过的前缀)"""
+        if self.empty:
+            return later
+        if later.empty:
+            return self
+        return EquityCurve(self.base, self.segments + later.segments)
+
+    def extend(self, later):
+        """拼接时间上在后面的一段并立即折叠，返回新对象 (later 必须还没有折叠过的前缀)"""
+        if later.empty:
+            return self
+        return EquityCurve(self.merge(later).folded())
+
+    def folded(self, final=False):
+        if not self.segments:
+            return self.base.feed([], [], final) if final else self.base
+        times = np.concatenate([t for t, _ in self.segments])
+        pnl = np.concatenate([p for _, p in self.segments])
+        return self.base.feed(times, pnl, final)
+
+    def to_state(self):
+        return self.folded().to_state()
+
+    @classmethod
+    def from_state(cls, state):
+        return cls(EquityState.from_state(state))
+
+    def to_json(self):
+        return self.folded(final=True).to_json()
@@ -0,0 +1,218 @@
+import numpy as np
+import pandas as pd
+
+# 成交方向的写法 (小写、下划线 / 连字符换成空格后) -> (买卖方向: 1 买 / -1 卖, 持仓方向: 1 多 / -1 空 / 0 未注明)
+SIDE_CODES = {
+    'buy': (1, 0), 'b': (1, 0), 'bid': (1, 0), '买': (1, 0), '买入': (1, 0),
+    'sell': (-1, 0), 's': (-1, 0), 'ask': (-1, 0), '卖': (-1, 0), '卖出': (-1, 0),
+    'open long': (1, 1), 'close long': (-1, 1), 'open short': (-1, -1), 'close short': (1, -1),
+    'buy long': (1, 1), 'sell long': (-1, 1), 'sell short': (-1, -1), 'buy short': (1, -1),
+    '开多': (1, 1), '平多': (-1, 1), '开空': (-1, -1), '平空': (1, -1),
+}
+# 双向持仓模式的持仓方向列；BOTH / NET 为单向持仓 (买卖互相抵消)
+POSITION_SIDES = {'long': 1, 'short': -1, 'both': 0, 'net': 0, '多': 1, '空': -1, '多头': 1, '空头': -1}
+
+# 数量换成整数最小单位 (最多 8 位小数) 后再累加，FIFO 区间的端点没有浮点误差
+QTY_DECIMALS = 8
+# 累计数量的上限，超过时自动减少小数位，避免 int64 溢出
+QTY_LIMIT = 2 ** 62
+
+
+def _lookup(series, table, default):
+    """先转成 category，只对每种不同的写法规范化后查表一次；查不到 (含缺失) 的为 default"""
+    cat = series.astype('category')
+    keys = cat.cat.categories.astype(str).str.strip().str.lower().str.replace(r'[_\-]+', ' ', regex=True)
+    codes = np.array([table.get(k, default) for k in keys] + [default])
+    return codes[cat.cat.codes.to_numpy()]
+
+
+def parse_sides(side, position_side=None, qty=None):
+    """
+    解析成交方向，返回 (买卖方向, 持仓方向) 两个 int8 数组。
+    没有方向列时按数量的正负判断买卖；持仓方向列优先于方向里自带的 (开多 / 平空 ...)。
+    无法识别的方向买卖记为 0，调用方丢弃这些行。
+    """
+    if side is None:
+        buy = np.where(qty < 0, -1, 1)
+        held = np.zeros(len(qty), dtype=np.int8)
+    else:
+        codes = _lookup(side, SIDE_CODES, (0, 0))
+        buy, held = codes[:, 0], codes[:, 1]
+    if position_side is not None:
+        explicit = _lookup(position_side, POSITION_SIDES, 0)
+        held = np.where(explicit != 0, explicit, held)
+    return buy.astype(np.int8), held.astype(np.int8)
+
+
+def quantize(qty):
+    """数量换成整数最小单位，返回 (int64 数组, 每单位对应的数量)"""
+    total = float(np.abs(qty).sum())
+    decimals = QTY_DECIMALS
+    while decimals > 0 and total * 10 ** decimals >= QTY_LIMIT:
+        decimals -= 1
+    return np.rint(np.abs(qty) * 10 ** decimals).astype(np.int64), 10.0 ** -decimals
+
+
+def _group_starts(keys):
+    """按顺序排好的分组键，返回每行所在组的起始位置"""
+    new = np.ones(len(keys), dtype=bool)
+    new[1:] = keys[1:] != keys[:-1]
+    starts = np.flatnonzero(new)
+    return starts[np.cumsum(new) - 1]
+
+
+def _group_cumsum(values, starts):
+    """组内累加 (含本行)：全局累加减去组起点之前的累计"""
+    total = np.cumsum(values)
+    return total - (total - values)[starts]
+
+
+def _split_legs(symbol, buy, held, qty):
+    """
+    把成交拆成开仓 / 平仓两种"腿"。注明了持仓方向的成交 (双向持仓) 直接对应一条腿；
+    单向持仓按币种的累计净持仓判断：反向成交先平掉现有仓位，超出的部分反手开新仓 (拆成两条腿)。
+    返回 (原始行号, 持仓方向, 是否开仓, 数量)，按成交顺序排列 (同一笔成交先平后开)。
+    """
+    oneway = held == 0
+    signed = np.where(oneway, buy * qty, 0)
+    position = _group_cumsum(signed, _group_starts(symbol))
+    before = position - signed
+    closing = oneway & (before != 0) & (np.sign(signed) == -np.sign(before))
+    close_qty = np.where(closing, np.minimum(qty, np.abs(before)), 0)
+
+    # 注明方向的成交：买多 / 卖空为开仓，反之为平仓
+    explicit_open = ~oneway & (buy == held)
+    rows = np.arange(len(qty))
+    close_rows = np.flatnonzero(np.where(oneway, close_qty > 0, ~explicit_open))
+    open_qty = np.where(oneway, qty - close_qty, qty)
+    open_rows = np.flatnonzero(np.where(oneway, open_qty > 0, explicit_open))
+
+    leg_row = np.concatenate([close_rows, open_rows])
+    leg_side = np.concatenate([np.where(oneway, np.sign(before), held)[close_rows],
+                               np.where(oneway, np.sign(signed), held)[open_rows]]).astype(np.int8)
+    leg_open = np.concatenate([np.zeros(len(close_rows), dtype=bool), np.ones(len(open_rows), dtype=bool)])
+    leg_qty = np.concatenate([np.where(oneway, close_qty, qty)[close_rows], open_qty[open_rows]])
+    order = np.argsort(rows[leg_row] * 2 + leg_open, kind='stable')
+    return leg_row[order], leg_side[order], leg_open[order], leg_qty[order]
+
+
+def fifo_match(book, is_open, qty):
+    """
+    按账户 (币种 + 持仓方向) 做 FIFO 撮合，全程向量化：
+    每个账户的开仓按累计数量铺成区间 [0, 开仓总量)，平仓同样铺成区间，平仓第 x 个单位
+    对应的就是第 x 个开仓单位。把两组区间的端点合并排序后切成小段，
+    每段用 searchsorted 找到所属的开仓腿和平仓腿。
+    平仓量超过当时已开仓量的部分 (导出开始之前建的仓) 没有可匹配的开仓，直接丢弃。
+    book / is_open / qty 按账户、成交顺序排列；返回 (开仓腿下标, 平仓腿下标, 数量, 丢弃的平仓量)。
+    """
+    starts = _group_starts(book)
+    opened = _group_cumsum(np.where(is_open, qty, 0), starts)
+    closes = np.flatnonzero(~is_open)
+    open_legs = np.flatnonzero(is_open)
+
+    # 1. 平仓量截断：有效累计平仓 E_i = min(E_{i-1} + q_i, 当时的累计开仓 A_i)，
+    #    展开就是 Q_i + min(0, 组内 min_{j<=i}(A_j - Q_j))，一次分组累计最小值
+    close_book = book[closes]
+    close_first = _group_starts(close_book) == np.arange(len(closes))
+    raw = _group_cumsum(qty[closes], _group_starts(close_book))
+    slack = pd.Series(opened[closes] - raw).groupby(close_book).cummin().to_numpy()
+    effective = raw + np.minimum(slack, 0)
+    previous = np.concatenate([[0], effective[:-1]])
+    previous[close_first] = 0
+    close_last = np.concatenate([close_first[1:], [True]]) if len(closes) else close_first
+    dropped = int((raw - effective)[close_last].sum())
+
+    # 2. 各账户的区间首尾相接排到同一条数轴上 (账户偏移 = 之前所有账户的开仓总量)
+    book_last = np.ones(len(book), dtype=bool)
+    book_last[:-1] = book[1:] != book[:-1]
+    totals = np.where(book_last, opened, 0)
+    offset = (np.cumsum(totals) - totals)[starts]
+    open_end = offset[open_legs] + opened[open_legs]
+    open_start = open_end - qty[open_legs]
+    close_start = offset[closes] + previous
+    close_end = offset[closes] + effective
+
+    # 3. 合并端点切段，每段找所属的开仓腿 / 平仓腿 (落在空隙里的段两边对不上，丢弃)
+    points = np.unique(np.concatenate([open_start, open_end, close_start, close_end]))
+    seg_start, seg_qty = points[:-1], np.diff(points)
+    ci = np.searchsorted(close_end, seg_start, side='right')
+    oi = np.searchsorted(open_end, seg_start, side='right')
+    valid = (ci < len(closes)) & (oi < len(open_legs))
+    ci, oi, seg_start, seg_qty = ci[valid], oi[valid], seg_start[valid], seg_qty[valid]
+    valid = (close_start[ci] <= seg_start) & (open_start[oi] <= seg_start)
+    return open_legs[oi[valid]], closes[ci[valid]], seg_qty[valid], dropped
+
+
+def reconstruct_trades(symbol, side, position_side, price, qty, time):
+    """
+    从逐笔成交重建已平仓交易 (与仓位历史导出相同的标准列)。
+    symbol 为 Series，side / position_side 为 Series 或 None，price / qty 为 float 数组，time 为 datetime Series。
+    每次平仓 (同一账户同一时刻的多次成交合并为一次) 是一笔交易：开仓价、开仓时间来自 FIFO 匹配到的
+    开仓批次，部分平仓各自成为一笔交易，还没平掉的仓位不计入。
+    返回 (交易明细 DataFrame, 统计信息)。
+    """
+    buy, held = parse_sides(side, position_side, qty)
+    times = pd.DatetimeIndex(time)
+    tz = times.tz
+    ns, nat = times.as_unit('ns').asi8, times.isna()
+    units, unit = quantize(qty)
+    symbol = symbol.astype('category')
+    symbol_codes = symbol.cat.codes.to_numpy()
+
+    # 1. 可用的成交按 (币种, 时间, 原始顺序) 稳定排序
+    rows = np.flatnonzero((buy != 0) & ~nat & (units > 0))
+    rows = rows[np.lexsort((ns[rows], symbol_codes[rows]))]
+
+    # 2. 拆成开仓 / 平仓腿，再按账户 (币种, 持仓方向) 排好，账户内保持成交顺序
+    leg, leg_side, leg_open, leg_qty = _split_legs(symbol_codes[rows], buy[rows], held[rows], units[rows])
+    leg = rows[leg]
+    order = np.lexsort((np.arange(len(leg)), leg_side, symbol_codes[leg]))
+    leg, leg_side, leg_open, leg_qty = leg[order], leg_side[order], leg_open[order], leg_qty[order]
+    book = symbol_codes[leg].astype(np.int64) * 2 + (leg_side < 0)
+
+    # 3. FIFO 撮合
+    oi, ci, seg_qty, dropped = fifo_match(book, leg_open, leg_qty)
+
+    # 4. 同一账户、同一时刻的平仓合并成一笔交易 (撮合结果按平仓腿的顺序排列)
+    closes = np.flatnonzero(~leg_open)
+    new_trade = np.ones(len(closes), dtype=bool)
+    new_trade[1:] = (book[closes][1:] != book[closes][:-1]) | (ns[leg[closes]][1:] != ns[leg[closes]][:-1])
+    trade_of_leg = np.zeros(len(leg), dtype=np.int64)
+    trade_of_leg[closes] = np.cumsum(new_trade)
+    seg_trade = trade_of_leg[ci]
+    bounds = np.flatnonzero(np.diff(seg_trade, prepend=-1))
+
+    seg_units = seg_qty * unit
+    volume = np.add.reduceat(seg_units, bounds)
+    entry = np.add.reduceat(seg_units * price[leg[oi]], bounds)
+    exit_ = np.add.reduceat(seg_units * price[leg[ci]], bounds)
+    opened = np.minimum.reduceat(ns[leg[oi]], bounds)
+    first = ci[bounds]
+    direction = leg_side[first]
+    closed = ns[leg[first]]
+
+    # 5. 输出标准列，按平仓时间排序
+    order = np.argsort(closed, kind='stable')
+    trades = pd.DataFrame({
+        'Symbol': pd.Categorical.from_codes(symbol_codes[leg[first]][order], categories=symbol.cat.categories),
+        'Side': pd.Categorical.from_codes((direction[order] < 0).astype(np.int8), categories=['Long', 'Short']),
+        'Entry Price': (entry / volume)[order],
+        'Avg. Close Price': (exit_ / volume)[order],
+        'Closed Vol.': volume[order],
+        'Closing PNL': (direction * (exit_ - entry))[order],
+        'Opened': _to_datetime(opened[order], tz),
+        'Closed': _to_datetime(closed[order], tz),
+    })
+    stats = {
+        "fills": len(qty),
+        "skipped": len(qty) - len(rows),
+        "trades": len(trades),
+        "unmatched_qty": dropped * unit,
+        "open_qty": (int(leg_qty[leg_open].sum()) - int(seg_qty.sum())) * unit,
+    }
+    return trades, stats
+
+
+def _to_datetime(ns, tz):
+    times = pd.DatetimeIndex(ns.view('datetime64[ns]'))
+    return times.tz_localize('UTC').tz_convert(tz) if tz is not None else times
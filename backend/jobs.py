@@ -0,0 +1,154 @@
+import json
+import time
+import uuid
+import sqlite3
+import asyncio
+import threading
+
+from cache import _to_builtin
+
+
+class QueueFullError(Exception):
+    """排队中的任务已达上限"""
+
+
+class JobStore:
+    """
+    任务状态和结果存在本地 SQLite 里 (path 为 ":memory:" 时只在本进程内有效)。
+    完成 (done / failed) 超过 ttl 秒的任务会被清理；进程重启时遗留的未完成任务标记为失败。
+    """
+
+    def __init__(self, path=":memory:", ttl=3600):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                created REAL NOT NULL,
+                updated REAL NOT NULL,
+                status_code INTEGER,
+                body TEXT
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_updated ON jobs (status, updated)")
+        self._conn.execute(
+            "UPDATE jobs SET status = 'failed', status_code = 503, body = ?, updated = ? "
+            "WHERE status IN ('queued', 'running')",
+            (json.dumps({"error": "服务重启，任务已丢失，请重新上传"}, ensure_ascii=False), time.time()))
+
+    def create(self, job_id):
+        now = time.time()
+        with self._lock:
+            self._conn.execute("INSERT INTO jobs (id, status, created, updated) VALUES (?, 'queued', ?, ?)",
+                               (job_id, now, now))
+        self.prune()
+
+    def update(self, job_id, status, status_code=None, body=None):
+        payload = json.dumps(body, ensure_ascii=False, default=_to_builtin) if body is not None else None
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET status = ?, status_code = ?, body = ?, updated = ? WHERE id = ?",
+                               (status, status_code, payload, time.time(), job_id))
+
+    def get(self, job_id):
+        """返回 {"job_id", "status", "created", "status_code", "body"}，不存在或已过期返回 None"""
+        with self._lock:
+            row = self._conn.execute("SELECT status, created, updated, status_code, body FROM jobs WHERE id = ?",
+                                     (job_id,)).fetchone()
+        if row is None:
+            return None
+        status, created, updated, status_code, body = row
+        if status in ("done", "failed") and self.ttl > 0 and time.time() - updated > self.ttl:
+            return None
+        return {
+            "job_id": job_id,
+            "status": status,
+            "created": created,
+            "status_code": status_code,
+            "body": json.loads(body) if body is not None else None,
+        }
+
+    def prune(self):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._conn.execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated < ?",
+                               (time.time() - self.ttl,))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class JobQueue:
+    """
+    有界任务队列 + 固定数量的 worker 协程。
+
+    submit() 把任务放进 asyncio.Queue 立即返回任务 id，队列满时抛出 QueueFullError (接口返回 429)；
+    worker 依次取任务执行 handler(payload, 排队秒数)，handler 返回 (状态码, 响应体)，结果写入 JobStore；
+    状态码 >= 400 或响应体带 error 的任务记为 failed。
+    wait() 供长轮询使用：任务还在本进程里排队 / 执行时最多等待 timeout 秒。
+    """
+
+    def __init__(self, handler, store, max_size=100, workers=4):
+        self.handler = handler
+        self.store = store
+        self.workers = workers
+        self._queue = asyncio.Queue(maxsize=max_size)
+        self._pending = {}  # job_id -> asyncio.Event，完成时 set
+        self._tasks = []
+
+    @property
+    def depth(self):
+        return self._queue.qsize()
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+            print(f"[INFO] ✅ 任务队列已启动: {self.workers} 个 worker, 队列上限 {self._queue.maxsize}")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, payload):
+        job_id = uuid.uuid4().hex
+        try:
+            self._queue.put_nowait((job_id, payload, time.monotonic()))
+        except asyncio.QueueFull:
+            raise QueueFullError("诊断排队人数过多，请稍后再试")
+        self._pending[job_id] = asyncio.Event()
+        self.store.create(job_id)
+        return job_id
+
+    async def wait(self, job_id, timeout):
+        event = self._pending.get(job_id)
+        if event is not None and timeout > 0:
+            try:
+                await asyncio.wait_for(event.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.store.get(job_id)
+
+    async def _worker(self):
+        while True:
+            job_id, payload, enqueued = await self._queue.get()
+            try:
+                self.store.update(job_id, "running")
+                try:
+                    status_code, body = await self.handler(payload, time.monotonic() - enqueued)
+                except Exception as e:
+                    print(f"Error: 任务 {job_id} 执行失败: {e}")
+                    status_code, body = 500, {"error": str(e)}
+                failed = status_code >= 400 or (isinstance(body, dict) and "error" in body)
+                self.store.update(job_id, "failed" if failed else "done", status_code, body)
+            finally:
+                event = self._pending.pop(job_id, None)
+                if event is not None:
+                    event.set()
+                self._queue.task_done()
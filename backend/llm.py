@@ -0,0 +1,125 @@
+import time
+import asyncio
+
+from llm_router import ModelRouter
+
+
+class ModelUnavailableError(Exception):
+    """没有可用的模型 (未配置 API Key，或所有候选模型都探测失败)"""
+
+
+class ModelManager:
+    """
+    Gemini 模型的懒加载 + 后台预热。
+
+    进程启动时不导入 google.generativeai、不发任何网络请求；lifespan 里调用 start_warmup()
+    在后台并发探测所有候选模型 (get_model 查询模型元数据，不产生生成费用)，
+    探测通过的模型按候选顺序交给 ModelRouter，由它在每次请求时选择模型、熔断和对冲。
+    请求到来时 get() 等待预热完成；预热失败后，下一次 get() 会在间隔 retry_interval 秒后重新探测。
+
+    state: cold (尚未开始) / warming (探测中) / ready (可用) / failed (不可用，见 error)
+    """
+
+    def __init__(self, api_key, candidates, fallback=None, probe_timeout=10.0, retry_interval=30.0, router_options=None):
+        self.api_key = api_key
+        self.candidates = list(candidates) + ([fallback] if fallback else [])
+        self.probe_timeout = probe_timeout
+        self.retry_interval = retry_interval
+        self.router_options = router_options or {}
+        self.state = "cold"
+        self.error = None
+        self.router = None
+        self._task = None
+        self._failed_at = 0.0
+
+    @property
+    def ready(self):
+        return self.state == "ready"
+
+    @property
+    def model_name(self):
+        """当前首选的模型 (全部熔断时为 None)"""
+        return self.router.preferred if self.router is not None else None
+
+    def use(self, model, name):
+        """直接指定模型 (测试 / 基准测试用的桩模型)，跳过探测"""
+        self.use_models([(name, model)])
+
+    def use_models(self, models):
+        """直接指定一组 (名称, 模型)，按顺序路由，跳过探测 (进行中的预热作废)"""
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+        self.router = ModelRouter(models, **self.router_options)
+        self.state, self.error = "ready", None
+
+    def start_warmup(self):
+        """在后台开始预热，立即返回 (需要在事件循环里调用)"""
+        if self._task is None or self._task.done():
+            self.state = "warming"
+            self._task = asyncio.create_task(self._warmup())
+        return self._task
+
+    async def get(self):
+        """返回模型路由 (ModelRouter)；预热中则等待，不可用时抛出 ModelUnavailableError"""
+        if self.ready:
+            return self.router
+        if self.state == "failed" and time.monotonic() - self._failed_at < self.retry_interval:
+            raise ModelUnavailableError(self.error)
+        await asyncio.shield(self.start_warmup())
+        if not self.ready:
+            raise ModelUnavailableError(self.error)
+        return self.router
+
+    async def stop(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _warmup(self):
+        started = time.monotonic()
+        if not self.api_key:
+            self._fail("未找到 GEMINI_API_KEY")
+            print("❌ 严重错误: 未找到 GEMINI_API_KEY")
+            return
+        try:
+            # 导入 SDK (连带 grpc / protobuf) 比较慢，放到线程里，不阻塞事件循环
+            genai = await asyncio.to_thread(_configure, self.api_key)
+        except Exception as e:
+            self._fail(f"Gemini SDK 初始化失败: {e}")
+            print(f"[WARN] ⚠️ {self.error}")
+            return
+
+        async def probe(name):
+            try:
+                await asyncio.wait_for(asyncio.to_thread(genai.get_model, f"models/{name}"), timeout=self.probe_timeout)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[WARN] ⚠️ 无法加载 {name}: {e}")
+                return False
+            return True
+
+        # 并发探测，总耗时取决于最慢的一个，而不是所有候选之和
+        results = await asyncio.gather(*(probe(name) for name in self.candidates))
+        available = [name for name, ok in zip(self.candidates, results) if ok]
+        if not available:
+            self._fail(f"所有候选模型都不可用: {', '.join(self.candidates)}")
+            print(f"[WARN] ⚠️ {self.error}")
+            return
+
+        self.router = ModelRouter([(name, genai.GenerativeModel(name)) for name in available], **self.router_options)
+        self.state, self.error = "ready", None
+        print(f"[INFO] ✅ 模型初始化成功: {', '.join(available)} (预热 {time.monotonic() - started:.1f}s)")
+
+    def _fail(self, error):
+        self.state, self.error = "failed", error
+        self._failed_at = time.monotonic()
+
+
+def _configure(api_key):
+    import google.generativeai as genai
+    genai.configure(api_key=api_key)
+    return genai
@@ -0,0 +1,325 @@
+import time
+import asyncio
+from collections import deque
+
+
+class AllModelsFailedError(Exception):
+    """所有候选模型都熔断或调用失败"""
+
+
+class RollingStats:
+    """
+    单个模型最近 window 次调用的耗时和成败，用于估算 p50 / p95 延迟和错误率。
+    超过 horizon 秒的样本作废：被降级的模型拿不到新流量，旧样本过期后才能重新排回前面。
+    """
+
+    def __init__(self, window=100, horizon=300.0, clock=time.monotonic):
+        self.samples = deque(maxlen=window)  # (时间点, 耗时秒数, 是否成功)
+        self.horizon = horizon
+        self.clock = clock
+
+    def record(self, seconds, ok):
+        self.samples.append((self.clock(), seconds, ok))
+
+    def recent(self):
+        cutoff = self.clock() - self.horizon
+        while self.samples and self.samples[0][0] < cutoff:
+            self.samples.popleft()
+        return self.samples
+
+    def percentile(self, q):
+        latencies = sorted(s for _, s, ok in self.recent() if ok)
+        if not latencies:
+            return None
+        return latencies[min(int(q * len(latencies)), len(latencies) - 1)]
+
+    @property
+    def error_rate(self):
+        samples = self.recent()
+        if not samples:
+            return 0.0
+        return sum(1 for _, _, ok in samples if not ok) / len(samples)
+
+
+class CircuitBreaker:
+    """
+    熔断器：连续失败 threshold 次后打开，cooldown 秒内不再把请求发给这个模型；
+    冷却结束后进入半开状态，只放行一个试探请求，成功则关闭，失败则重新打开。
+    """
+
+    def __init__(self, threshold=3, cooldown=30.0, clock=time.monotonic):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if self.clock() - self.opened_at < self.cooldown:
+            return "open"
+        return "half_open"
+
+    def available(self):
+        state = self.state
+        return state == "closed" or (state == "half_open" and not self.trial_in_flight)
+
+    def acquire(self):
+        """占用一次调用机会；半开状态下只允许一个试探请求"""
+        if not self.available():
+            return False
+        if self.state == "half_open":
+            self.trial_in_flight = True
+        return True
+
+    def success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def failure(self):
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.threshold:
+            self.opened_at = self.clock()
+        self.trial_in_flight = False
+
+    def release(self):
+        """调用被取消 (对冲请求输掉)，不计成败"""
+        self.trial_in_flight = False
+
+
+class ModelRoute:
+    def __init__(self, name, model, stats, breaker):
+        self.name = name
+        self.model = model
+        self.stats = stats
+        self.breaker = breaker
+
+
+class ModelRouter:
+    """
+    按请求路由到候选模型 (列表顺序即偏好顺序)：
+
+    - 每个模型维护最近 window 次 / horizon 秒内的 p50 / p95 延迟和错误率；p95 超过 slow_p95 秒
+      或错误率超过 max_error_rate 的模型排到健康模型后面；
+    - 连续失败的模型被熔断，冷却后试探恢复；
+    - 调用失败时在剩余时间内依次换下一个模型重试；还有备选时，单次调用最多用剩余时间的 attempt_share，
+      卡住的模型超时后也能切到备选 (最后一个候选用完全部剩余时间)；
+    - hedge_after > 0 时，首选模型超过这么多秒还没返回，就同时向最快的备选模型发一份，
+      谁先成功用谁，另一个取消。
+
+    模型对象只需要实现 generate_content_async(prompt, stream=False)，测试时可以直接传桩模型。
+    observer(name, seconds, error) 在每次调用结束时回调 (error 为 None 表示成功)，用于上报指标。
+    """
+
+    def __init__(self, models, hedge_after=0.0, slow_p95=0.0, max_error_rate=0.5, window=100, horizon=300.0,
+                 failure_threshold=3, cooldown=30.0, attempt_share=0.5, observer=None, clock=time.monotonic):
+        self.routes = [ModelRoute(name, model, RollingStats(window, horizon, clock),
+                                  CircuitBreaker(failure_threshold, cooldown, clock))
+                       for name, model in models]
+        self.hedge_after = hedge_after
+        self.slow_p95 = slow_p95
+        self.max_error_rate = max_error_rate
+        self.attempt_share = attempt_share
+        self.observer = observer
+        self.clock = clock
+
+    @property
+    def preferred(self):
+        ranked = self.ranked()
+        return ranked[0].name if ranked else None
+
+    def _degraded(self, route):
+        p95 = route.stats.percentile(0.95)
+        slow = self.slow_p95 > 0 and p95 is not None and p95 > self.slow_p95
+        return slow or route.stats.error_rate > self.max_error_rate
+
+    def ranked(self):
+        """当前可用的模型：健康的按偏好顺序在前，变慢 / 错误率高的排在后面"""
+        available = [r for r in self.routes if r.breaker.available()]
+        return sorted(available, key=lambda r: self._degraded(r))
+
+    def _hedge_target(self, primary, tried):
+        # 备选里 p50 最低的 (没有数据的按偏好顺序排在有数据的后面)
+        others = [r for r in self.ranked() if r is not primary and r.name not in tried]
+        if not others:
+            return None
+        return min(others, key=lambda r: (r.stats.percentile(0.5) is None, r.stats.percentile(0.5) or 0))
+
+    def _attempt_timeout(self, remaining, tried):
+        """单次调用的超时：还有没试过的可用模型时只给剩余时间的 attempt_share，否则给全部剩余时间"""
+        if any(r.name not in tried for r in self.ranked()):
+            return remaining * self.attempt_share
+        return remaining
+
+    def _record(self, route, started, error):
+        seconds = self.clock() - started
+        route.stats.record(seconds, error is None)
+        if error is None:
+            route.breaker.success()
+        else:
+            route.breaker.failure()
+        if self.observer is not None:
+            self.observer(route.name, seconds, error)
+
+    async def _call(self, route, prompt, timeout):
+        started = self.clock()
+        try:
+            response = await asyncio.wait_for(route.model.generate_content_async(prompt), timeout=timeout)
+            text = response.text
+        except asyncio.CancelledError:
+            route.breaker.release()
+            raise
+        except Exception as e:
+            self._record(route, started, e)
+            raise
+        self._record(route, started, None)
+        return text
+
+    def _next_route(self, tried):
+        for route in self.ranked():
+            if route.name not in tried and route.breaker.acquire():
+                return route
+        return None
+
+    async def generate(self, prompt, timeout):
+        """
+        生成完整回复，返回 (文本, 实际使用的模型名)。
+        整个过程 (含重试和对冲) 不超过 timeout 秒，超时抛出 asyncio.TimeoutError；
+        单次调用超时 (见 attempt_share) 按失败处理，换下一个模型。
+        """
+        deadline = self.clock() + timeout
+        tried, last_error = set(), None
+        while True:
+            primary = self._next_route(tried)
+            if primary is None:
+                break
+            tried.add(primary.name)
+            remaining = deadline - self.clock()
+            if remaining <= 0:
+                raise asyncio.TimeoutError()
+            attempt = self._attempt_timeout(remaining, tried)
+            try:
+                return await self._generate_hedged(primary, prompt, attempt, deadline, tried)
+            except asyncio.TimeoutError as e:
+                last_error = e
+                if self.clock() < deadline:
+                    print(f"[WARN] ⚠️ 模型 {primary.name} 超过 {attempt:.1f}s 未返回，切换备选")
+            except Exception as e:
+                last_error = e
+                print(f"[WARN] ⚠️ 模型 {primary.name} 调用失败，切换备选: {e}")
+        if isinstance(last_error, asyncio.TimeoutError):
+            raise last_error
+        raise AllModelsFailedError(f"所有模型都不可用: {last_error}" if last_error else "所有模型都已熔断")
+
+    async def _generate_hedged(self, primary, prompt, timeout, deadline, tried):
+        # timeout 为首选这次调用的超时；对冲请求按整体截止时间 deadline 另算自己的超时
+        primary_task = asyncio.ensure_future(self._call(primary, prompt, timeout))
+        if not self.hedge_after or self.hedge_after >= timeout:
+            return await primary_task, primary.name
+
+        done, _ = await asyncio.wait({primary_task}, timeout=self.hedge_after)
+        if done:
+            return primary_task.result(), primary.name
+
+        hedge = self._hedge_target(primary, tried)
+        if hedge is None or not hedge.breaker.acquire():
+            return await primary_task, primary.name
+        tried.add(hedge.name)
+        print(f"[INFO] 模型 {primary.name} 超过 {self.hedge_after}s 未返回，对冲请求 {hedge.name}")
+        remaining = self._attempt_timeout(deadline - self.clock(), tried)
+        tasks = {primary_task: primary.name,
+                 asyncio.ensure_future(self._call(hedge, prompt, remaining)): hedge.name}
+        pending, error = set(tasks), None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result(), tasks[task]
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def stream(self, prompt, timeout, on_model=None):
+        """
+        流式生成，逐段产出文本。只有在收到第一段之前失败才会换下一个模型 (已经发给客户端的内容不能撤回)；
+        流式请求不做对冲；首段的等待时间与 generate 一样按 attempt_share 限制。on_model(name) 在选定模型后回调。
+        """
+        deadline = self.clock() + timeout
+        tried, last_error = set(), None
+        while True:
+            route = self._next_route(tried)
+            if route is None:
+                break
+            tried.add(route.name)
+            started = self.clock()
+            if started >= deadline:
+                raise asyncio.TimeoutError()
+            first_deadline = started + self._attempt_timeout(deadline - started, tried)
+            first, chunks = None, None
+            try:
+                response = await asyncio.wait_for(route.model.generate_content_async(prompt, stream=True),
+                                                  timeout=max(first_deadline - self.clock(), 0))
+                chunks = response.__aiter__()
+                first = await asyncio.wait_for(chunks.__anext__(), timeout=max(first_deadline - self.clock(), 0))
+            except StopAsyncIteration:
+                first = None
+            except asyncio.CancelledError:
+                route.breaker.release()
+                raise
+            except Exception as e:
+                self._record(route, started, e)
+                last_error = e
+                if isinstance(e, asyncio.TimeoutError):
+                    if self.clock() >= deadline:
+                        raise
+                    print(f"[WARN] ⚠️ 模型 {route.name} 超过 {first_deadline - started:.1f}s 没有产出，切换备选")
+                else:
+                    print(f"[WARN] ⚠️ 模型 {route.name} 调用失败，切换备选: {e}")
+                continue
+
+            if on_model is not None:
+                on_model(route.name)
+            try:
+                if first is not None:
+                    if first.text:
+                        yield first.text
+                    while True:
+                        try:
+                            chunk = await asyncio.wait_for(chunks.__anext__(), timeout=max(deadline - self.clock(), 0))
+                        except StopAsyncIteration:
+                            break
+                        if chunk.text:
+                            yield chunk.text
+            except (asyncio.CancelledError, GeneratorExit):
+                route.breaker.release()
+                raise
+            except Exception as e:
+                self._record(route, started, e)
+                raise
+            self._record(route, started, None)
+            return
+        if isinstance(last_error, asyncio.TimeoutError):
+            raise last_error
+        raise AllModelsFailedError(f"所有模型都不可用: {last_error}" if last_error else "所有模型都已熔断")
+
+    def snapshot(self):
+        """各模型当前的熔断状态、延迟和错误率 (readyz 展示用)"""
+        result = []
+        for r in self.routes:
+            p50, p95 = r.stats.percentile(0.5), r.stats.percentile(0.95)
+            result.append({
+                "model": r.name,
+                "circuit": r.breaker.state,
+                "p50": round(p50, 3) if p50 is not None else None,
+                "p95": round(p95, 3) if p95 is not None else None,
+                "error_rate": round(r.stats.error_rate, 3),
+                "samples": len(r.stats.recent()),
+            })
+        return result
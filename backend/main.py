@@ -1,20 +1,111 @@
 import os
-import io
 import random
 import json
-import pandas as pd
-from fastapi import FastAPI, UploadFile, File
+import re
+import hashlib
+import textwrap
+import asyncio
+from contextlib import asynccontextmanager
+from typing import List, Optional
+from fastapi import FastAPI, UploadFile, File, Form, Response, Query
 from fastapi.middleware.cors import CORSMiddleware
-import google.generativeai as genai
-from analyzer import TradeAnalyzer
+from fastapi.responses import StreamingResponse, PlainTextResponse
+import pandas as pd
+from pydantic import BaseModel
+from analyzer import (analyze_csv_bytes_timed, normalize_csv_bytes, analyze_frames_timed, reanalyze_stored, FEE_RATE,
+                      ENGINES)
+from cache import ResultCache, content_key
+from workers import AnalysisPool, parse_worker_count
+from trade_store import TradeStore
+from jobs import JobStore, JobQueue, QueueFullError
+from schema import sniff_csv
+from uploads import save_upload, UploadTooLargeError
+from serialize import CompactJSONResponse, CompressionMiddleware, dumps
+from llm import ModelManager, ModelUnavailableError
+from llm_router import AllModelsFailedError
+from metrics import (REGISTRY, RequestTimer, REQUESTS, ERRORS, ROWS, UPLOAD_BYTES, UPLOAD_SIZE, CACHE,
+                     LLM_CALLS, PROMPT_CHARS, RESPONSE_CHARS, FRAME_BYTES, LLM_ATTEMPTS, LLM_SECONDS,
+                     PROMPT_TOKENS, REPORT_CACHE, JOBS)
 from dotenv import load_dotenv
 
 load_dotenv()
 
-api_key = os.getenv("GEMINI_API_KEY")
-if not api_key:
-    print("❌ 严重错误: 未找到 GEMINI_API_KEY")
-genai.configure(api_key=api_key)
+# 超过该大小的上传走分块流式分析，避免整张明细表撑爆 worker 内存
+STREAMING_MIN_BYTES = int(os.getenv("STREAMING_MIN_BYTES", str(50 * 1024 * 1024)))
+# 流式模式下每块读取的行数
+CHUNK_ROWS = int(os.getenv("CHUNK_ROWS", "200000"))
+
+# 单文件分析的计算引擎 (pandas / polars)，/analyze?engine= 可以按请求覆盖。
+# polars 只加速 CSV 读取和预处理 (大文件整表分析时端到端更快)，不影响分块流式和增量分析
+ANALYSIS_ENGINE = os.getenv("ANALYSIS_ENGINE", "pandas")
+if ANALYSIS_ENGINE not in ENGINES:
+    print(f"[WARN] ⚠️ 未知的计算引擎 ANALYSIS_ENGINE={ANALYSIS_ENGINE}，使用 pandas")
+    ANALYSIS_ENGINE = "pandas"
+
+# 上传大小上限 (字节，0 为不限)：超过直接 413。压缩包 (.csv.gz / .zip) 另外按实际解压出的大小限制 (边解压边计数)
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(200 * 1024 * 1024)))
+MAX_CSV_BYTES = int(os.getenv("MAX_CSV_BYTES", str(1024 * 1024 * 1024)))
+# 上传文件落盘的目录 (默认系统临时目录)，解析直接读文件，分析结束即删除
+UPLOAD_DIR = os.getenv("UPLOAD_DIR") or None
+# 小于这个字节数的响应不压缩
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+
+# 结果缓存：同一份 CSV 重复上传时直接返回上次的指标和报告，不再调用 Gemini
+# 各缓存的内存层除了条数上限，还按 *_MAX_BYTES 限制总字节数 (0 为不限)，几份超大报告不会把内存撑爆
+result_cache = ResultCache(
+    max_entries=int(os.getenv("RESULT_CACHE_SIZE", "256")),
+    max_bytes=int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+    ttl=int(os.getenv("RESULT_CACHE_TTL", str(24 * 3600))),
+    disk_dir=os.getenv("RESULT_CACHE_DIR") or None,
+)
+
+# 报告缓存：按 Prompt 指纹 (规范化的指标) 缓存 Gemini 的回复，不同文件只要指标相同也不再重复调用
+report_cache = ResultCache(
+    max_entries=int(os.getenv("REPORT_CACHE_SIZE", "1024")),
+    max_bytes=int(os.getenv("REPORT_CACHE_MAX_BYTES", str(32 * 1024 * 1024))),
+    ttl=int(os.getenv("REPORT_CACHE_TTL", str(7 * 24 * 3600))),
+    disk_dir=os.getenv("REPORT_CACHE_DIR") or None,
+)
+
+# 聚合状态存储：每次分析后按文件哈希保存紧凑的聚合状态 (state_id)，
+# 下次上传新导出时带上 state_id，只处理新增的交易
+state_store = ResultCache(
+    max_entries=int(os.getenv("STATE_CACHE_SIZE", "1024")),
+    max_bytes=int(os.getenv("STATE_CACHE_MAX_BYTES", str(128 * 1024 * 1024))),
+    ttl=int(os.getenv("STATE_TTL", str(90 * 24 * 3600))),
+    disk_dir=os.getenv("STATE_DIR") or None,
+)
+
+# 标准化明细的列式缓存 (Arrow，需要 pyarrow)：换手续费率 / 时间窗口重新分析时不再解析 CSV
+trade_store = TradeStore(
+    directory=os.getenv("TRADE_STORE_DIR") or None,
+    max_entries=int(os.getenv("TRADE_STORE_SIZE", "256")),
+    ttl=int(os.getenv("TRADE_STORE_TTL", str(7 * 24 * 3600))),
+)
+
+# 任务模式：/analyze?mode=job (或 ANALYZE_MODE=job 设为默认) 校验后入队，立即返回 job_id，
+# 客户端轮询 /jobs/{job_id}。队列满时返回 429；结果在 SQLite (JOB_DB，默认只在内存) 里保留 JOB_TTL 秒
+ANALYZE_MODE = os.getenv("ANALYZE_MODE", "sync")
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "100"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+# 长轮询单次最多等待的秒数
+JOB_MAX_WAIT = float(os.getenv("JOB_MAX_WAIT", "30"))
+job_store = JobStore(path=os.getenv("JOB_DB", ":memory:"), ttl=int(os.getenv("JOB_TTL", "3600")))
+
+# 多文件合并分析一次最多接收的文件数
+MAX_BATCH_FILES = int(os.getenv("MAX_BATCH_FILES", "10"))
+
+# LLM 调用控制：单次超时 (秒)、全局并发上限、排队等待上限 (秒，超过即拒绝)
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "120"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "30"))
+llm_slots = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+
+# CSV 解析 + 指标计算的进程池：ANALYZE_WORKERS 为进程数 ('auto' = CPU 核数，0 = 不开进程)
+analysis_pool = AnalysisPool(
+    max_workers=parse_worker_count(os.getenv("ANALYZE_WORKERS", "0")),
+    max_tasks_per_child=int(os.getenv("ANALYZE_MAX_TASKS_PER_CHILD", "0")),
+)
 
 # ============================================================
 # 1. 标签库 (保留您扩充后的版本)
@@ -92,87 +183,87 @@ ADVICE_LIBRARY = [
 # ============================================================
 # 3. 辅助函数：手续费现实映照 (保留您的详细逻辑)
 # ============================================================
-def calculate_luxury_equivalent(fees):
+def calculate_luxury_equivalent(fees, rng=random):
     fees = abs(fees)
-    if fees < 10: return random.choice([
+    if fees < 10: return rng.choice([
             "够买一杯瑞幸酱香拿铁，还能加个蛋",
             "刚好够以太坊主网不拥堵时的一笔 Gas",
             "也就够在这个月开个最基础的 Netflix 会员",
             "这点钱够买根韭菜，我说的是菜市场那种",
             "够在微信群里发个像样的红包听个响"
         ])
-    if fees < 60: return random.choice([
+    if fees < 60: return rng.choice([
             "够请群友吃顿肯德基疯狂星期四 (V me $50)",
             "够买一份《黑神话：悟空》",
             "这就是你不设止损，一分钟内亏掉的钱",
             "够充值一个月 OnlyFans 支持玩偶姐姐",
             "够买个硬件钱包，虽然你里面也没多少资产"
         ])
-    if fees < 300: return random.choice([
+    if fees < 300: return rng.choice([
             "够买一双 Nike AJ1 倒钩，走路带风",
             "够买半股特斯拉股票，跟马斯克混",
             "也就是群友玩合约爆仓时收到的一条短信费",
             "够请全群兄弟吃顿沙县大酒店",
             "够买个 Switch 玩塞尔达，别炒币了去海拉鲁吧"
         ])
-    if fees < 1200: return random.choice([
+    if fees < 1200: return rng.choice([
             "够买台 iPhone 16 Pro,记得买钛金属色的",
             "够买 0.3 个以太坊 (ETH)，那是通往自由的门票",
             "刚毕业大学生一个月的窝囊费 (税后)",
             "够去曼谷玩一周帝王级享受，别问我怎么知道的",
             "够买 1000 个土狗币 (Meme) 当彩票刮"
         ])
-    if fees < 20000: return random.choice([
+    if fees < 20000: return rng.choice([
             "够买块劳力士迪通拿，虽然现在二级市场崩了",
             "够去马尔代夫包个岛躺平一周,逃离K线图",
             "够买 100 股英伟达,比炒币稳多了",
         ])
-    if fees < 40000:return random.choice([
+    if fees < 40000:return rng.choice([
             "够提一辆小米 SU7 Max 顶配，敢的话",
             "够买块劳力士“绿水鬼”戴戴，虽然现在跌了",
             "这是一个大厂程序员被裁员给的 N+1 赔偿金",
             "植发整容加医美，二级做不好还做不好三级？"
         ])
-    if fees < 100000:return random.choice([
+    if fees < 100000:return rng.choice([
             "够买一辆保时捷 718 Boxster",
             "恭喜，这大概就是 1 枚比特币 (BTC) ",
             "够买一辆特斯拉 Cybertruck 三电机野兽版，防弹的那种",
             "够支付美国常青藤名校一年的学费，知识就是力量",
             "这只是一个小土狗项目 (Meme Coin) 池子里的所有流动性"
         ])
-    if fees < 150000: return random.choice([
+    if fees < 150000: return rng.choice([
             "够买一辆保时捷 911",
             "够买个无聊猿 (BAYC) 头像装大佬",
             "够在拉斯维加斯豪赌三天三夜不睡觉",
             "也就是CZ睡觉时一分钟的被动收入",
             "够供你孩子去美国常青藤读完硕士"
         ])
-    if fees < 200000: return random.choice([
+    if fees < 200000: return rng.choice([
             "够凑齐 32 个 ETH,恭喜你成为尊贵的以太坊验证节点",
             "够买一辆保时捷 911",
             "硅谷 Google L5 级别工程师一年的税后工资也就这点",
             "够买个爱马仕喜马拉雅鳄鱼皮包，还得看柜姐脸色",
         ])
-    if fees < 300000: return random.choice([
+    if fees < 300000: return rng.choice([
             "够全款买辆法拉利 Roma,声浪比你的币价好听",
             "够在美国德克萨斯州买套大 House,带泳池的那种",
             "这是二线交易所的上币费起步价，还不包涨",
         ])
-    if fees < 500000: return random.choice([
+    if fees < 500000: return rng.choice([
             "够买一辆兰博基尼大牛 (Revuelto)，币圈致富的标准结局",
             "够在上海/新加坡付个像样的首付,背上30年房贷",
             "够买一块理查德·米勒 (RM) 手表，亿万富翁的入场券",
             "这是黑客攻击一次 DeFi 协议拿到漏洞赏金的平均数",
             "这点钱在澳门赌场 VIP 厅，只够推几把牌九"
         ])
-    if fees < 600000: return random.choice([
+    if fees < 600000: return rng.choice([
             "够在上海内环付个首付，从此当光荣的房奴",
             "够买一辆兰博基尼大牛，这就是币圈人的终极梦想",
             "这是一次标准的“Rug Pull”卷走的平均金额",
             "够巴菲特那顿慈善午餐的入场费",
         ])
     # 默认保底
-    return random.choice([
+    return rng.choice([
             "够马斯克发一枚火箭上火星听个响",
              "这手续费高到可以帮 FTX 还债了",
              "够买个太平洋小岛宣布建国，自己发币当央行行长",
@@ -255,156 +346,774 @@ def format_metrics_for_llm(data):
     - 单笔最大亏损: {s['max_loss']['amount']:.2f} U
     """
 
-def init_model():
-    # ============================================================
-    # 4. 模型配置 (严格保留您的版本)
-    # ============================================================
-    candidates = [
-        'gemini-3-pro-preview',   # 最新一代：推理能力最强
-        'gemini-2.5-pro',         # 次新旗舰：非常稳定
-        'gemini-2.5-flash',       # 次新高速：速度快，成本低
-        'gemini-2.0-flash',       # 旧版高速：广泛兼容
-        'gemini-1.5-pro-latest'   # 最后的兜底
-    ]
-    
-    for m in candidates:
+# 提示词版本：修改下面的静态前缀或动态部分格式时加一，旧的报告缓存随之失效
+PROMPT_VERSION = 2
+
+# 静态前缀：角色设定和章节要求，与患者数据无关，所有请求逐字相同 (便于模型侧做前缀缓存)。
+# 需要引用的数值放在动态部分的【诊断参数】里，这里按名称引用
+PROMPT_PREFIX = textwrap.dedent("""
+    【角色设定】
+    你是一位拥有 20 年经验的华尔街顶级交易员和心理学博士，也是"币圈精神科急诊室"的主治医生。
+    风格:混合了《大空头》Mark Baum 的犀利和《华尔街之狼》Jordan Belfort 的毒舌。
+    核心任务：阅读后面的【当前患者数据】，生成诊断报告。严格输出 Markdown,严禁 markdown 代码块包裹。
+
+    【模式判定】
+    根据【患者状态】判定：
+    如果是净利润为正的用户：态度专业、尊重但傲娇（同行切磋），提醒黑天鹅风险。
+    如果是净利润为负的用户：态度极度毒舌，恨铁不成钢，用数据打脸，拒绝废话。
+
+    请严格按照以下 6 个章节标题输出内容（标题文字严禁修改，前端据此切片）：
+
+    # 1. 核心诊断
+    ## 病理切片解读
+    (分析【诊断参数】中最大单笔盈利与最大单笔亏损的倍数关系。结合持仓效率。像病理切片一样分析他是否有开单恶习或高压无效劳动。100字内)
+    ## 初诊报告
+    (全页总结。重点提及总手续费。如果是亏损用户,重点打击。200字以内)
+
+    # 2. 人体扫描室
+    ## 持仓画像
+    (根据[4. 持仓分布]数据,深度分析他的持仓规律.200字左右)
+    ## 周度节律
+    (根据最佳/最差交易日和黄金/垃圾时间,分析他的情绪节律。50-100字)
+
+    # 3. 解剖台
+    ## [请生成一个警示性短标题，如'温水煮青蛙']
+    (针对最大连败次数进行深度侧写。100-200字)
+    ## 有毒资产
+    (总结碎钞机 Top5 资产。深度侧写150字以内)
+    ## 深度解剖
+    (第一刀-心态：分析数据背后的贪婪/恐惧；第二刀-技术：分析开平仓问题；第三刀-策略:分析宏观错误,400字内)
+
+    # 4. 废墟下的黄金
+    (语气转折：变得温暖、惜才、激励。寻找废墟中的黄金。)
+    ## 高光时刻
+    (基于盈利数据、连胜或某个高胜率区间,挖掘他的盈利舒适区。鼓励他。200字左右)
+
+    # 5. 抢救处方
+    ## 警告
+    (针对当前状态的严重警告。50字)
+    ## 康复计划
+    (制定分阶段计划。必须引用【诊断参数】中的返佣节省金额：如果你在一个有返佣的渠道(省下40%手续费），你现在的账户应该多出这么多 U。300字以内)
+    ## 严禁事项
+    (200字以内)
+    ## 总结
+    (300字以内)
+
+    # 6. 确诊通知书
+    (必须输出纯 JSON 格式，不要包含 ```json 标记。按【确诊通知书模板】填写，已给定的字段原样保留)
+""").strip()
+
+CJK_CHARS = re.compile(r'[\u3000-\u303f\u3400-\u9fff\uff00-\uffef]')
+
+
+def estimate_tokens(text):
+    """粗略估算 token 数：中文字符 (含全角标点) 约 1 个 token，其余约 4 个字符 1 个 token"""
+    cjk = len(CJK_CHARS.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def prompt_payload(data):
+    """
+    Prompt 的动态部分 (不含随机元数据)：患者数据 + 状态 + 章节里引用的数值。
+    数值按展示精度格式化，浮点误差级别的差异不会产生不同的指纹。
+    """
+    v, p, s = data['vitals'], data['performance'], data['streaks']
+    user_type = "盈利用户 (高手)" if v['net_pnl'] > 0 else "亏损用户 (韭菜)"
+    payload = f"""
+        【当前患者数据】
+        {format_metrics_for_llm(data)}
+
+        【患者状态】
+        {user_type}
+
+        【诊断参数】
+        - 最大单笔盈利: {s['max_win']['amount']:.2f} U
+        - 最大单笔亏损: {s['max_loss']['amount']:.2f} U
+        - 持仓效率: {p['avg_efficiency']:.4f} U/min
+        - 总手续费: {v['total_fees']:.2f} U
+        - 最大连败: {s['max_loss']['count']} 次
+        - 返佣节省金额: {v['total_fees'] * 0.4:.2f} U
+    """
+    # 去掉每行的缩进和多余空行，省 token
+    lines = [line.strip() for line in payload.strip().splitlines()]
+    return "\n".join(line for i, line in enumerate(lines) if line or (i > 0 and lines[i - 1]))
+
+
+def prompt_fingerprint(payload):
+    """Prompt 输入的规范指纹：相同的指标 (哪怕来自不同文件) 得到相同的指纹"""
+    return hashlib.sha256(f"v{PROMPT_VERSION}\n{payload}".encode('utf-8')).hexdigest()
+
+
+def build_prompt(data):
+    """
+    生成元数据 (写入 data['meta']) 并组装发给 Gemini 的完整 Prompt，返回 (prompt, 指纹)。
+
+    Prompt = 静态前缀 + 动态部分。随机元数据 (病历号 / 标签 / 医嘱 / 手续费映照) 以指纹为种子生成，
+    同样的指标总是得到逐字相同的 Prompt，报告缓存可以直接按指纹命中。
+    """
+    payload = prompt_payload(data)
+    fingerprint = prompt_fingerprint(payload)
+    rng = random.Random(int(fingerprint[:16], 16))
+
+    # 2. 生成元数据
+    rand_head = ''.join(rng.choices('0123456789ABCDEF', k=4))
+    rand_tail = ''.join(rng.choices('0123456789ABCDEF', k=4))
+    patient_id = f"0x{rand_head}****{rand_tail}"
+
+    selected_tags = rng.sample(TAGS_LIBRARY, 3)
+    selected_advice = rng.choice(ADVICE_LIBRARY)
+
+    # 🚨 计算手续费现实映照 (调用您的详细函数)
+    luxury_item = calculate_luxury_equivalent(data['vitals']['total_fees'], rng)
+
+    # 补充到 meta 字段，前端直接读
+    data['meta'] = {
+        "patient_id": patient_id,
+        "tags": selected_tags,
+        "advice": selected_advice,
+        "luxury_item": luxury_item
+    }
+
+    diagnosis_template = json.dumps({
+        "id": patient_id,
+        "title": "请根据数据生成一个4-6字的搞笑确诊病症",
+        "badges": selected_tags,
+        "content": selected_advice,
+        "fee_reality_check": f"你的手续费 {data['vitals']['total_fees']:.1f} U {luxury_item}。",
+        "ai_job_recommendation": f"根据你的交易风格(频率{data['vitals']['frequency']:.1f}单/天, 熬夜程度等)，生成一个赛博/现实兼职推荐(如美团骑手、守夜人)。并给出一句扎心的推荐理由。",
+    }, ensure_ascii=False, indent=4)
+
+    system_prompt = f"{PROMPT_PREFIX}\n\n{payload}\n\n【确诊通知书模板】\n{diagnosis_template}\n"
+    PROMPT_TOKENS.observe(estimate_tokens(PROMPT_PREFIX), part="prefix")
+    PROMPT_TOKENS.observe(estimate_tokens(system_prompt) - estimate_tokens(PROMPT_PREFIX), part="payload")
+    return system_prompt, fingerprint
+
+# ============================================================
+# 4. 模型配置 (严格保留您的版本)
+# ============================================================
+MODEL_CANDIDATES = [
+    'gemini-3-pro-preview',   # 最新一代：推理能力最强
+    'gemini-2.5-pro',         # 次新旗舰：非常稳定
+    'gemini-2.5-flash',       # 次新高速：速度快，成本低
+    'gemini-2.0-flash',       # 旧版高速：广泛兼容
+    'gemini-1.5-pro-latest'   # 最后的兜底
+]
+FALLBACK_MODEL = 'gemini-1.5-flash'
+
+
+def observe_llm_attempt(name, seconds, error):
+    """每次模型调用 (含失败切换和对冲) 结束时上报指标"""
+    LLM_ATTEMPTS.inc(model=name, outcome="ok" if error is None else type(error).__name__)
+    LLM_SECONDS.observe(seconds, model=name)
+
+
+# 启动时不初始化模型：lifespan 里后台预热，探测通过的候选模型交给路由，按请求选择
+models = ModelManager(
+    api_key=os.getenv("GEMINI_API_KEY"),
+    candidates=MODEL_CANDIDATES,
+    fallback=FALLBACK_MODEL,
+    probe_timeout=float(os.getenv("MODEL_PROBE_TIMEOUT", "10")),
+    retry_interval=float(os.getenv("MODEL_RETRY_INTERVAL", "30")),
+    router_options={
+        # 首选模型超过这么多秒未返回，就向最快的备选模型再发一份 (0 为关闭，会多消耗一次调用)
+        "hedge_after": float(os.getenv("LLM_HEDGE_AFTER", "0")),
+        # 还有备选模型时，单次调用最多占用剩余时间的比例，超时换下一个 (1 为首选用完全部时间)
+        "attempt_share": float(os.getenv("LLM_ATTEMPT_SHARE", "0.5")),
+        # 最近 p95 延迟超过该秒数的模型降级到健康模型之后 (0 为不按延迟降级)
+        "slow_p95": float(os.getenv("LLM_SLOW_P95", "0")),
+        "max_error_rate": float(os.getenv("LLM_MAX_ERROR_RATE", "0.5")),
+        "window": int(os.getenv("LLM_STATS_WINDOW", "100")),
+        "horizon": float(os.getenv("LLM_STATS_HORIZON", "300")),
+        # 连续失败多少次熔断，熔断后多少秒再试探
+        "failure_threshold": int(os.getenv("LLM_BREAKER_THRESHOLD", "3")),
+        "cooldown": float(os.getenv("LLM_BREAKER_COOLDOWN", "30")),
+        "observer": observe_llm_attempt,
+    },
+)
+
+
+class LLMBusyError(Exception):
+    """并发中的 LLM 调用已达上限，且排队超时"""
+
+
+@asynccontextmanager
+async def llm_slot():
+    """
+    占用一个 LLM 并发名额。超过并发上限的请求先排队，
+    排队超过 LLM_QUEUE_TIMEOUT 直接拒绝。
+    """
+    try:
+        await asyncio.wait_for(llm_slots.acquire(), timeout=LLM_QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise LLMBusyError("诊断排队人数过多，请稍后再试")
+    try:
+        yield
+    finally:
+        llm_slots.release()
+
+
+def cached_report(fingerprint):
+    """按 Prompt 指纹查报告缓存，未命中返回 None"""
+    report = report_cache.get(fingerprint)
+    REPORT_CACHE.inc(result="hit" if report is not None else "miss")
+    return report
+
+
+async def generate_report(prompt):
+    """
+    异步调用 Gemini，不阻塞事件循环。模型由路由按延迟 / 熔断状态选择，失败自动切换备选。
+    整个生成 (含重试) 超过 LLM_TIMEOUT 抛出 asyncio.TimeoutError。
+    """
+    router = await models.get()
+    async with llm_slot():
+        text, name = await router.generate(prompt, timeout=LLM_TIMEOUT)
+    LLM_CALLS.inc(model=name)
+    PROMPT_CHARS.observe(len(prompt), model=name)
+    RESPONSE_CHARS.observe(len(text), model=name)
+    return text
+
+
+async def stream_report(prompt):
+    """
+    流式调用 Gemini，边生成边产出文本片段。整段生成共用 LLM_TIMEOUT 的时间预算；
+    第一段返回之前失败会切换备选模型。
+    """
+    router = await models.get()
+    served = []
+    total = 0
+    async with llm_slot():
+        async for text in router.stream(prompt, timeout=LLM_TIMEOUT, on_model=served.append):
+            total += len(text)
+            yield text
+    LLM_CALLS.inc(model=served[0])
+    PROMPT_CHARS.observe(len(prompt), model=served[0])
+    RESPONSE_CHARS.observe(total, model=served[0])
+
+
+# 报告第 6 章 (确诊通知书) 是一段 JSON，流式输出时单独作为一个事件发送
+DIAGNOSIS_HEADING = re.compile(r'#+\s*6[.、．]?\s*确诊通知书')
+# 未匹配到标题前，末尾保留的字符数，防止标题被切在两个片段之间
+HEADING_HOLDBACK = 32
+
+
+def parse_diagnosis(text):
+    """从第 6 章文本中取出 JSON 对象，解析失败返回 None"""
+    start, end = text.find('{'), text.rfind('}')
+    if start < 0 or end <= start:
+        return None
+    try:
+        return json.loads(text[start:end + 1])
+    except ValueError:
+        return None
+
+
+def report_events(report):
+    """把一份完整报告拆成 report + diagnosis 两个事件 (缓存命中时用)"""
+    match = DIAGNOSIS_HEADING.search(report)
+    body, diagnosis = (report[:match.start()], report[match.end():]) if match else (report, "")
+    yield sse_event("report", {"text": body})
+    yield sse_event("diagnosis", {"data": parse_diagnosis(diagnosis), "raw": diagnosis})
+
+
+def sse_event(event, payload):
+    # 与普通 JSON 响应相同的紧凑序列化 (浮点数同样保留 4 位小数)
+    return f"event: {event}\ndata: {dumps(payload).decode('utf-8')}\n\n"
+
+
+# state_id / dataset_id 就是文件的 sha256，会拼进缓存文件路径，只接受这种格式
+DATASET_ID = re.compile(r'[0-9a-f]{64}')
+JOB_ID = re.compile(r'[0-9a-f]{32}')
+
+
+def valid_id(value):
+    return bool(value) and DATASET_ID.fullmatch(value) is not None
+
+
+def result_key(upload, state_id, engine):
+    """
+    /analyze 结果缓存的 key：文件内容哈希 + 影响计算方式的参数 (计算引擎、增量分析引用的旧状态)。
+    返回给前端的 state_id 仍是文件哈希本身 (聚合状态和明细缓存都按它保存)。
+    """
+    return content_key(json.dumps([upload.key, engine, state_id if valid_id(state_id) else None]).encode())
+
+
+def upload_ids(upload):
+    """
+    响应里带回的 id：state_id 供下次增量分析引用，同时也是 /reanalyze 的 dataset_id；
+    stored 表示标准化明细已在列式缓存里 (为 false 时 /reanalyze 不可用，例如增量分析时旧明细已过期)。
+    """
+    return {"state_id": upload.key, "stored": trade_store.exists(upload.key)}
+
+
+async def run_analysis(upload, timer, state_id=None, engine=ANALYSIS_ENGINE):
+    """
+    在进程池中解析上传的 CSV (按落盘路径读取) 并计算指标，事件循环继续服务其它请求。
+    state_id 指向之前保存的聚合状态时只处理新增交易；本次的状态以文件哈希为 id 保存。
+    engine 为计算引擎 (polars 引擎整表处理，不分块)。
+    """
+    # 大文件 (压缩包按实际解压出的大小) 分块流式处理
+    chunk_rows = CHUNK_ROWS if upload.csv_size >= STREAMING_MIN_BYTES else None
+    state = state_store.get(state_id) if valid_id(state_id) else None
+    key = upload.key
+    store = trade_store if trade_store.enabled else None
+    data, info = await analysis_pool.run(analyze_csv_bytes_timed, upload.path, chunk_rows, state, store, key, engine,
+                                         state_id if state is not None else None)
+    timer.record(info["timings"])
+    ROWS.inc(data["vitals"]["trade_count"] - info["base_trades"])
+    FRAME_BYTES.observe(info["frame_bytes"])
+    state_store.set(key, info["state"])
+    return data
+
+
+async def run_batch_analysis(uploads, timer):
+    """
+    多文件合并分析：每个文件在进程池里并行解析 + 标准化 (总耗时取决于最大的文件)，
+    再合并成一条时间线整体计算指标。uploads 为 [(文件名, SavedUpload)]。
+    """
+    async def normalize(name, upload):
         try:
-            model = genai.GenerativeModel(m)
-            # 简单的测试调用，确保模型真的可用
-            print(f"[INFO] ✅ 模型初始化成功: {m}")
-            return model, m
+            return await analysis_pool.run(normalize_csv_bytes, upload.path)
         except Exception as e:
-            print(f"[WARN] ⚠️ 无法加载 {m}: {e}")
-            continue
-    
-    fallback_model = 'gemini-1.5-flash'
-    print(f"[WARN] ⚠️ 所有候选模型都失败，回退到保底模型: {fallback_model}")
-    return genai.GenerativeModel(fallback_model), fallback_model
+            raise ValueError(f"{name}: {e}") from e
+
+    with timer.stage("parse"):
+        parsed = await asyncio.gather(*(normalize(name, upload) for name, upload in uploads))
+
+    frames, sources = [], []
+    for (name, _), (df, exchange, summary, _) in zip(uploads, parsed):
+        frames.append(df)
+        sources.append({"source": name, "exchange": exchange, **summary})
+
+    data, timings = await analysis_pool.run(analyze_frames_timed, frames, sources)
+    timer.record(timings)
+    ROWS.inc(data["vitals"]["trade_count"])
+    return data
+
+
+async def receive_upload(file, timer):
+    """上传文件落盘 (分块拷贝 + 计算哈希)，超过大小上限抛出 UploadTooLargeError"""
+    with timer.stage("upload_read"):
+        upload = await save_upload(file, UPLOAD_DIR, MAX_UPLOAD_BYTES, MAX_CSV_BYTES)
+    UPLOAD_BYTES.inc(upload.size)
+    UPLOAD_SIZE.observe(upload.size)
+    return upload
+
+
+def record_outcome(endpoint, timer, error=None):
+    """请求结束：阶段耗时写入直方图，按结果计数"""
+    timer.observe()
+    REQUESTS.inc(endpoint=endpoint, status="error" if error else "ok")
+    if error:
+        ERRORS.inc(type=type(error).__name__)
+
+
+def json_response(body, timer, status_code=200, headers=None):
+    """结果直接序列化成紧凑 JSON (跳过 jsonable_encoder)，耗时记入 serialize 阶段"""
+    with timer.stage("serialize"):
+        response = CompactJSONResponse(status_code=status_code, content=body, headers=headers)
+    response.headers["Server-Timing"] = timer.header()
+    return response
+
+
+async def analyze_upload(upload, timer, state_id=None, engine=ANALYSIS_ENGINE):
+    """
+    单文件完整流程：查缓存 -> 计算 -> 组装 Prompt -> 调用 LLM，返回响应体。
+    同步的 /analyze 和任务队列共用。
+    """
+    # 0. 查缓存 (按文件内容哈希 + 计算引擎 + 旧状态)
+    with timer.stage("cache"):
+        cache_key = result_key(upload, state_id, engine)
+        cached = result_cache.get(cache_key)
+    CACHE.inc(result="hit" if cached is not None else "miss")
+    if cached is not None:
+        return {**cached, "cache": "hit", **upload_ids(upload)}
+
+    # 1. 计算 (进程池)
+    data = await run_analysis(upload, timer, state_id, engine)
+
+    # 2. 生成元数据 & 组装 Prompt
+    with timer.stage("prompt"):
+        system_prompt, fingerprint = build_prompt(data)
+
+    # 3. 调用 LLM (指标相同的报告直接复用)
+    report, cache_state = cached_report(fingerprint), "report"
+    if report is None:
+        with timer.stage("llm"):
+            report = await generate_report(system_prompt)
+        report_cache.set(fingerprint, report)
+        cache_state = "miss"
+
+    result = {"report": report, "raw_data": data}
+    result_cache.set(cache_key, result)
+
+    return {**result, "cache": cache_state, **upload_ids(upload)}
+
+
+def error_response(e):
+    """分析流程里的异常 -> (状态码, 响应体)"""
+    if isinstance(e, UploadTooLargeError):
+        print(f"Error: {str(e)}")
+        return 413, {"error": str(e)}
+    if isinstance(e, (LLMBusyError, ModelUnavailableError, AllModelsFailedError)):
+        print(f"Error: {str(e)}")
+        return 503, {"error": str(e)}
+    if isinstance(e, asyncio.TimeoutError):
+        print(f"Error: LLM 生成超时 ({LLM_TIMEOUT}s)")
+        return 504, {"error": "AI 医生诊断超时，请稍后再试"}
+    print(f"Error: {str(e)}")
+    return 200, {"error": str(e)}
 
-model, current_model_name = init_model()
 
-app = FastAPI()
+async def run_analyze_job(payload, queued_seconds):
+    """任务队列的 worker：跑完整流程，返回 (状态码, 响应体)。上传的临时文件在这里删除"""
+    upload, state_id, engine = payload
+    timer = RequestTimer()
+    timer.record({"queue": queued_seconds})
+    error = None
+    try:
+        return 200, await analyze_upload(upload, timer, state_id, engine)
+    except Exception as e:
+        error = e
+        return error_response(e)
+    finally:
+        upload.remove()
+        record_outcome("analyze_job", timer, error)
+        JOBS.inc(event="failed" if error else "done")
+
+
+job_queue = JobQueue(run_analyze_job, job_store, max_size=JOB_QUEUE_SIZE, workers=JOB_WORKERS)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    analysis_pool.start()
+    job_queue.start()
+    # 模型在后台预热，不阻塞启动；预热期间 /readyz 返回 503
+    models.start_warmup()
+    yield
+    await job_queue.stop()
+    await models.stop()
+    # 等正在跑的分析任务完成后再退出
+    analysis_pool.shutdown(wait=True)
 
+
+app = FastAPI(lifespan=lifespan, default_response_class=CompactJSONResponse)
+
+@app.middleware("http")
+async def limit_upload_size(request, call_next):
+    """按 Content-Length 提前拒绝超大上传，不等请求体传完、也不落盘"""
+    length = request.headers.get("content-length")
+    if MAX_UPLOAD_BYTES and request.method == "POST" and request.url.path.startswith("/analyze") and length:
+        files = MAX_BATCH_FILES if request.url.path == "/analyze/batch" else 1
+        # 多出来的 64KB 留给 multipart 的边界和表单字段
+        if length.isdigit() and int(length) > MAX_UPLOAD_BYTES * files + 64 * 1024:
+            return CompactJSONResponse(status_code=413, content={"error": f"文件超过 {MAX_UPLOAD_BYTES / (1024 * 1024):g}MB 上限"})
+    return await call_next(request)
+
+# JSON 响应按 Accept-Encoding 压缩 (br / gzip)，SSE 流式响应不压缩
+app.add_middleware(CompressionMiddleware, minimum_size=COMPRESS_MIN_BYTES)
+
+# CORS 最后添加 (最外层)，上面的 413 也带跨域头，前端能读到错误信息
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # 让前端 (跨域) 也能读到各阶段耗时
+    expose_headers=["Server-Timing"],
 )
 
 @app.get("/")
 async def root():
-    return {"status": "online", "model": current_model_name}
+    return {"status": "online", "model": models.model_name}
+
+@app.get("/healthz")
+async def healthz():
+    """存活探针：进程能响应即可，不依赖模型"""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    """就绪探针：模型预热完成才算就绪，预热中 / 不可用时返回 503"""
+    body = {"status": models.state, "model": models.model_name}
+    if models.router is not None:
+        body["routes"] = models.router.snapshot()
+    if not models.ready:
+        if models.state == "failed" and models.error:
+            body["error"] = models.error
+        return CompactJSONResponse(status_code=503, content=body)
+    return body
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus 抓取端点"""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
 
 @app.post("/analyze")
-async def analyze_csv(file: UploadFile = File(...)):
+async def analyze_csv(response: Response, file: UploadFile = File(...), state_id: Optional[str] = Form(None),
+                      mode: str = Query(ANALYZE_MODE), engine: str = Query(ANALYSIS_ENGINE)):
+    """
+    state_id (可选)：上一次分析返回的 state_id。新上传的导出包含旧历史时，
+    只有新增的交易会被处理，结果与全量重算一致。
+
+    mode=job：校验表头后入队，立即返回 202 和 job_id (结果已缓存时直接返回结果)，
+    之后轮询 GET /jobs/{job_id} 取结果；队列满时返回 429。
+
+    engine：计算引擎 pandas / polars (默认 ANALYSIS_ENGINE)，两者结果一致。
+    """
+    timer = RequestTimer()
+    error = None
+    upload = None
     try:
-        contents = await file.read()
-        df = pd.read_csv(io.BytesIO(contents))
-        
-        # 1. 计算
-        analyzer = TradeAnalyzer(df)
-        data = analyzer.get_analysis_json()
-        
-        # 2. 生成元数据
-        rand_head = ''.join(random.choices('0123456789ABCDEF', k=4))
-        rand_tail = ''.join(random.choices('0123456789ABCDEF', k=4))
-        patient_id = f"0x{rand_head}****{rand_tail}"
-        
-        selected_tags = random.sample(TAGS_LIBRARY, 3)
-        selected_advice = random.choice(ADVICE_LIBRARY)
-        
-        # 🚨 计算手续费现实映照 (调用您的详细函数)
-        luxury_item = calculate_luxury_equivalent(data['vitals']['total_fees'])
-        
-        # 补充到 meta 字段，前端直接读
-        data['meta'] = {
-            "patient_id": patient_id,
-            "tags": selected_tags,
-            "advice": selected_advice,
-            "luxury_item": luxury_item
-        }
-
-        # 3. 准备 Prompt 数据
-        metrics_text = format_metrics_for_llm(data)
-        
-        user_type = "盈利用户 (高手)" if data['vitals']['net_pnl'] > 0 else "亏损用户 (韭菜)"
-
-        # ==========================================
-        # 5. 终极 Prompt 注入 (严格按照您的要求)
-        # ==========================================
-        system_prompt = f"""
-        【角色设定】
-        你是一位拥有 20 年经验的华尔街顶级交易员和心理学博士，也是"币圈精神科急诊室"的主治医生。
-        风格:混合了《大空头》Mark Baum 的犀利和《华尔街之狼》Jordan Belfort 的毒舌。
-        核心任务：阅读数据，生成诊断报告。严格输出 Markdown,严禁 markdown 代码块包裹。
+        if engine not in ENGINES:
+            return CompactJSONResponse(status_code=400, content={"error": f"未知的计算引擎: {engine}"})
+        upload = await receive_upload(file, timer)
 
-        【当前患者数据】
-        {metrics_text}
-
-        【当前模式判定】
-        患者状态：{user_type}
-        如果是净利润为正的用户：态度专业、尊重但傲娇（同行切磋），提醒黑天鹅风险。
-        如果是净利润为负的用户：态度极度毒舌，恨铁不成钢，用数据打脸，拒绝废话。
-
-        请严格按照以下 6 个章节标题输出内容（标题文字严禁修改，前端据此切片）：
-
-        # 1. 核心诊断
-        ## 病理切片解读
-        (分析最大单笔盈利 {data['streaks']['max_win']['amount']} U 与最大单笔亏损 {data['streaks']['max_loss']['amount']} U 的倍数关系。结合持仓效率 {data['performance']['avg_efficiency']:.4f} U/min。像病理切片一样分析他是否有开单恶习或高压无效劳动。100字内)
-        ## 初诊报告
-        (全页总结。重点提及总手续费 {data['vitals']['total_fees']} U。如果是亏损用户,重点打击。200字以内)
-
-        # 2. 人体扫描室
-        ## 持仓画像
-        (根据[4. 持仓分布]数据,深度分析他的持仓规律.200字左右)
-        ## 周度节律
-        (根据最佳/最差交易日和黄金/垃圾时间,分析他的情绪节律。50-100字)
-
-        # 3. 解剖台
-        ## [请生成一个警示性短标题，如'温水煮青蛙']
-        (针对最大连败 {data['streaks']['max_loss']['count']} 次进行深度侧写。100-200字)
-        ## 有毒资产
-        (总结碎钞机 Top5 资产。深度侧写150字以内)
-        ## 深度解剖
-        (第一刀-心态：分析数据背后的贪婪/恐惧；第二刀-技术：分析开平仓问题；第三刀-策略:分析宏观错误,400字内)
-
-        # 4. 废墟下的黄金
-        (语气转折：变得温暖、惜才、激励。寻找废墟中的黄金。)
-        ## 高光时刻
-        (基于盈利数据、连胜或某个高胜率区间,挖掘他的盈利舒适区。鼓励他。200字左右)
-
-        # 5. 抢救处方
-        ## 警告
-        (针对当前状态的严重警告。50字)
-        ## 康复计划
-        (制定分阶段计划。必须计算：如果你在一个有返佣的渠道(省下40%手续费），你现在的账户应该多出 {data['vitals']['total_fees'] * 0.4:.2f} U。300字以内)
-        ## 严禁事项
-        (200字以内)
-        ## 总结
-        (300字以内)
-
-        # 6. 确诊通知书
-        (必须输出纯 JSON 格式，不要包含 ```json 标记)
-        {{
-            "id": "{patient_id}",
-            "title": "请根据数据生成一个4-6字的搞笑确诊病症",
-            "badges": {json.dumps(selected_tags, ensure_ascii=False)},
-            "content": "{selected_advice}",
-            "fee_reality_check": "你的手续费 {data['vitals']['total_fees']:.1f} U {luxury_item}。",
-            "ai_job_recommendation": "根据你的交易风格(频率{data['vitals']['frequency']:.1f}单/天, 熬夜程度等)，生成一个赛博/现实兼职推荐(如美团骑手、守夜人)。并给出一句扎心的推荐理由。"
-        }}
-        """
-
-        # 6. 调用 LLM
-        response = model.generate_content(system_prompt)
-        
-        return {"report": response.text, "raw_data": data}
+        if mode != "job":
+            return json_response(await analyze_upload(upload, timer, state_id, engine), timer)
+
+        with timer.stage("cache"):
+            cached = result_cache.get(result_key(upload, state_id, engine))
+        CACHE.inc(result="hit" if cached is not None else "miss")
+        if cached is not None:
+            return json_response({**cached, "cache": "hit", **upload_ids(upload)}, timer)
+
+        # 入队前先校验表头，格式错误的文件不占队列
+        with timer.stage("validate"):
+            sniff_csv(upload.path)
+        try:
+            job_id = job_queue.submit((upload, state_id, engine))
+            upload = None  # 临时文件交给任务删除
+        except QueueFullError as e:
+            error = e
+            JOBS.inc(event="rejected")
+            return CompactJSONResponse(status_code=429, content={"error": str(e)},
+                                       headers={"Retry-After": "10", "Server-Timing": timer.header()})
+        JOBS.inc(event="submitted")
+        return CompactJSONResponse(status_code=202,
+                                   content={"job_id": job_id, "status": "queued", "poll": f"/jobs/{job_id}"},
+                                   headers={"Server-Timing": timer.header()})
+
+    except Exception as e:
+        error = e
+        status_code, body = error_response(e)
+        if status_code != 200:
+            return CompactJSONResponse(status_code=status_code, content=body, headers={"Server-Timing": timer.header()})
+        return body
+    finally:
+        if upload is not None:
+            upload.remove()
+        record_outcome("analyze", timer, error)
+        response.headers["Server-Timing"] = timer.header()
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, wait: float = 0):
+    """
+    查询任务：queued / running 时只返回状态；done 时返回与同步 /analyze 相同的结果；
+    failed 时返回 error。wait > 0 时长轮询，任务未完成最多等待 wait 秒 (上限 JOB_MAX_WAIT)。
+    """
+    if not JOB_ID.fullmatch(job_id):
+        return CompactJSONResponse(status_code=400, content={"error": "无效的 job_id"})
+    job = await job_queue.wait(job_id, min(max(wait, 0), JOB_MAX_WAIT))
+    if job is None:
+        return CompactJSONResponse(status_code=404, content={"error": "任务不存在或已过期"})
+    result = {"job_id": job_id, "status": job["status"]}
+    if job["body"] is not None:
+        result.update(job["body"])
+    if job["status"] == "failed" and job["status_code"] >= 400:
+        return CompactJSONResponse(status_code=job["status_code"], content=result)
+    return CompactJSONResponse(result)
+
+class ReanalyzeRequest(BaseModel):
+    dataset_id: str
+    fee_rate: float = FEE_RATE
+    start: Optional[str] = None
+    end: Optional[str] = None
+
+
+@app.post("/reanalyze")
+async def reanalyze(request: ReanalyzeRequest, response: Response):
+    """
+    对之前上传过的数据换参数重新计算指标 (不调用 LLM)：
+    dataset_id 为 /analyze 返回的 state_id；fee_rate 为估算手续费率；
+    start / end 为平仓时间窗口 (左闭右开，任意 pandas 能解析的时间格式)。
+    """
+    timer = RequestTimer()
+    error = None
+    try:
+        if not trade_store.enabled:
+            return CompactJSONResponse(status_code=404, content={"error": "未启用明细缓存 (TRADE_STORE_DIR / pyarrow)"})
+        if not valid_id(request.dataset_id):
+            return CompactJSONResponse(status_code=400, content={"error": "dataset_id 格式不正确"})
+        if request.fee_rate < 0:
+            return CompactJSONResponse(status_code=400, content={"error": "fee_rate 不能为负数"})
+        start = pd.Timestamp(request.start) if request.start else None
+        end = pd.Timestamp(request.end) if request.end else None
+
+        result = await analysis_pool.run(reanalyze_stored, trade_store, request.dataset_id, request.fee_rate, start, end)
+        if result is None:
+            return CompactJSONResponse(status_code=404, content={"error": "没有这份数据的明细缓存 (已过期，或上传时未保存)，请重新上传 CSV"})
+        data, timings = result
+        timer.record(timings)
+        if data["vitals"]["trade_count"] == 0:
+            return CompactJSONResponse(status_code=404, content={"error": "该时间窗口内没有交易"})
+        return json_response({"raw_data": data, "params": request.model_dump()}, timer)
 
     except Exception as e:
+        error = e
         print(f"Error: {str(e)}")
         return {"error": str(e)}
+    finally:
+        record_outcome("reanalyze", timer, error)
+        response.headers["Server-Timing"] = timer.header()
+
+@app.post("/analyze/batch")
+async def analyze_csv_batch(response: Response, files: List[UploadFile] = File(...)):
+    """
+    一次上传多个交易所的 CSV (表头格式可以各不相同)，合并成一份报告，只调用一次 LLM。
+    raw_data 额外包含 sources：每个文件单独的 vitals / performance。
+    """
+    timer = RequestTimer()
+    error = None
+    uploads = []
+    try:
+        if len(files) > MAX_BATCH_FILES:
+            return CompactJSONResponse(status_code=400, content={"error": f"一次最多上传 {MAX_BATCH_FILES} 个文件"})
+
+        for i, file in enumerate(files):
+            uploads.append((file.filename or f"file_{i + 1}", await receive_upload(file, timer)))
+
+        # 0. 查缓存 (按文件名 + 各文件内容哈希，文件顺序不影响结果)
+        with timer.stage("cache"):
+            cache_key = content_key(json.dumps(sorted(
+                (name, upload.key) for name, upload in uploads)).encode())
+            cached = result_cache.get(cache_key)
+        CACHE.inc(result="hit" if cached is not None else "miss")
+        if cached is not None:
+            return json_response({**cached, "cache": "hit"}, timer)
+
+        # 1. 并行解析 + 合并计算 (进程池)
+        data = await run_batch_analysis(uploads, timer)
+
+        # 2. 生成元数据 & 组装 Prompt
+        with timer.stage("prompt"):
+            system_prompt, fingerprint = build_prompt(data)
+
+        # 3. 调用 LLM (整批只调用一次，指标相同的报告直接复用)
+        report, cache_state = cached_report(fingerprint), "report"
+        if report is None:
+            with timer.stage("llm"):
+                report = await generate_report(system_prompt)
+            report_cache.set(fingerprint, report)
+            cache_state = "miss"
+
+        result = {"report": report, "raw_data": data}
+        result_cache.set(cache_key, result)
+
+        return json_response({**result, "cache": cache_state}, timer)
+
+    except Exception as e:
+        error = e
+        status_code, body = error_response(e)
+        if status_code != 200:
+            return CompactJSONResponse(status_code=status_code, content=body, headers={"Server-Timing": timer.header()})
+        return body
+    finally:
+        for _, upload in uploads:
+            upload.remove()
+        record_outcome("analyze_batch", timer, error)
+        response.headers["Server-Timing"] = timer.header()
+
+@app.post("/analyze/stream")
+async def analyze_csv_stream(file: UploadFile = File(...), state_id: Optional[str] = Form(None),
+                             engine: str = Query(ANALYSIS_ENGINE)):
+    """
+    Server-Sent Events 版本的 /analyze，依次推送：
+    raw_data (指标算完立即发送) -> report (报告正文，逐段) -> diagnosis (确诊通知书 JSON) -> done (含 state_id / stored)。
+    出错时推送 error 事件。
+    """
+    timer = RequestTimer()
+    if engine not in ENGINES:
+        return CompactJSONResponse(status_code=400, content={"error": f"未知的计算引擎: {engine}"})
+    try:
+        upload = await receive_upload(file, timer)
+    except ValueError as e:
+        # 超过大小上限 (413) 或压缩包无法解压
+        record_outcome("analyze_stream", timer, e)
+        status, body = error_response(e)
+        return CompactJSONResponse(status_code=status, content=body)
+
+    async def events():
+        error = None
+        try:
+            with timer.stage("cache"):
+                cache_key = result_key(upload, state_id, engine)
+                cached = result_cache.get(cache_key)
+            CACHE.inc(result="hit" if cached is not None else "miss")
+            if cached is not None:
+                yield sse_event("raw_data", cached["raw_data"])
+                for event in report_events(cached["report"]):
+                    yield event
+                yield sse_event("done", {"cache": "hit", **upload_ids(upload)})
+                return
+
+            data = await run_analysis(upload, timer, state_id, engine)
+            with timer.stage("prompt"):
+                system_prompt, fingerprint = build_prompt(data)
+            yield sse_event("raw_data", data)
+
+            # 指标相同的报告已经生成过：整段发送，不再调用 Gemini
+            report = cached_report(fingerprint)
+            if report is not None:
+                for event in report_events(report):
+                    yield event
+                result_cache.set(cache_key, {"report": report, "raw_data": data})
+                yield sse_event("done", {"cache": "report", **upload_ids(upload)})
+                return
+
+            report, pending, diagnosis = "", "", None
+            loop = asyncio.get_running_loop()
+            llm_start = loop.time()
+            async for text in stream_report(system_prompt):
+                report += text
+                if diagnosis is not None:
+                    diagnosis += text
+                    continue
+                pending += text
+                match = DIAGNOSIS_HEADING.search(pending)
+                if match:
+                    if match.start() > 0:
+                        yield sse_event("report", {"text": pending[:match.start()]})
+                    diagnosis = pending[match.end():]
+                elif len(pending) > HEADING_HOLDBACK:
+                    yield sse_event("report", {"text": pending[:-HEADING_HOLDBACK]})
+                    pending = pending[-HEADING_HOLDBACK:]
+            if diagnosis is None:
+                if pending:
+                    yield sse_event("report", {"text": pending})
+                diagnosis = ""
+            # llm 包含把片段推给客户端的时间，流式响应没法在响应头里带 Server-Timing
+            timer.record({"llm": loop.time() - llm_start})
+            yield sse_event("diagnosis", {"data": parse_diagnosis(diagnosis), "raw": diagnosis})
+
+            report_cache.set(fingerprint, report)
+            result_cache.set(cache_key, {"report": report, "raw_data": data})
+            yield sse_event("done", {"cache": "miss", **upload_ids(upload)})
+
+        except asyncio.TimeoutError as e:
+            error = e
+            print(f"Error: LLM 生成超时 ({LLM_TIMEOUT}s)")
+            yield sse_event("error", {"error": "AI 医生诊断超时，请稍后再试"})
+        except Exception as e:
+            error = e
+            print(f"Error: {str(e)}")
+            yield sse_event("error", {"error": str(e)})
+        finally:
+            upload.remove()
+            record_outcome("analyze_stream", timer, error)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,172 @@
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+# 阶段耗时直方图的分桶 (秒)：覆盖毫秒级的小文件到分钟级的 LLM 生成
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+# 字节 / 字符数类直方图的分桶
+SIZE_BUCKETS = (1e3, 1e4, 1e5, 1e6, 1e7, 1e8)
+
+
+def _format_labels(labelnames, values):
+    if not labelnames:
+        return ""
+    pairs = []
+    for name, value in zip(labelnames, values):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """只增不减的计数器 (Prometheus counter)"""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """分桶直方图 (Prometheus histogram)，用于耗时和大小分布"""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._values = {}  # key -> [各桶计数, 总和, 总数]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets, counts):
+                    cumulative += n
+                    labels = _format_labels(self.labelnames + ("le",), key + (_format_value(bound),))
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+                lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Prometheus 文本格式 (text/plain; version=0.0.4)"""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "analyze_stage_seconds", "Latency of each /analyze stage in seconds", ["stage"]))
+REQUESTS = REGISTRY.register(Counter(
+    "analyze_requests_total", "Analyze requests by endpoint and outcome", ["endpoint", "status"]))
+ERRORS = REGISTRY.register(Counter(
+    "analyze_errors_total", "Analyze errors by exception type", ["type"]))
+ROWS = REGISTRY.register(Counter(
+    "analyze_rows_total", "Trade rows processed"))
+UPLOAD_BYTES = REGISTRY.register(Counter(
+    "analyze_upload_bytes_total", "Uploaded CSV bytes"))
+UPLOAD_SIZE = REGISTRY.register(Histogram(
+    "analyze_upload_bytes", "Uploaded CSV size in bytes", buckets=SIZE_BUCKETS))
+FRAME_BYTES = REGISTRY.register(Histogram(
+    "analyze_frame_bytes", "Memory footprint of the normalized trade frame in bytes (peak chunk when streaming)",
+    buckets=SIZE_BUCKETS + (1e9,)))
+CACHE = REGISTRY.register(Counter(
+    "analyze_cache_total", "Result cache lookups", ["result"]))
+LLM_CALLS = REGISTRY.register(Counter(
+    "llm_requests_total", "LLM calls by model", ["model"]))
+PROMPT_CHARS = REGISTRY.register(Histogram(
+    "llm_prompt_chars", "Prompt size in characters", ["model"], buckets=SIZE_BUCKETS))
+RESPONSE_CHARS = REGISTRY.register(Histogram(
+    "llm_response_chars", "LLM response size in characters", ["model"], buckets=SIZE_BUCKETS))
+PROMPT_TOKENS = REGISTRY.register(Histogram(
+    "llm_prompt_tokens", "Estimated prompt tokens by part (static prefix / dynamic payload)", ["part"],
+    buckets=(100, 250, 500, 1000, 2000, 4000, 8000, 16000)))
+REPORT_CACHE = REGISTRY.register(Counter(
+    "llm_report_cache_total", "LLM report cache lookups by prompt fingerprint", ["result"]))
+JOBS = REGISTRY.register(Counter(
+    "analyze_jobs_total", "Queued analyze jobs by event (submitted / rejected / done / failed)", ["event"]))
+LLM_ATTEMPTS = REGISTRY.register(Counter(
+    "llm_attempts_total", "Individual model attempts (including failover and hedged requests) by outcome",
+    ["model", "outcome"]))
+LLM_SECONDS = REGISTRY.register(Histogram(
+    "llm_attempt_seconds", "Latency of individual model attempts in seconds", ["model"]))
+
+
+@contextmanager
+def stage_timer(timings, name):
+    """把代码块的耗时 (秒) 累加到 timings[name]，分块处理时同名阶段会累加"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+
+
+class RequestTimer:
+    """单个请求的各阶段耗时：写入直方图，并生成 Server-Timing 响应头"""
+
+    def __init__(self):
+        self.timings = {}
+
+    def stage(self, name):
+        return stage_timer(self.timings, name)
+
+    def record(self, timings):
+        """合并在进程池里测得的阶段耗时"""
+        for name, seconds in timings.items():
+            self.timings[name] = self.timings.get(name, 0.0) + seconds
+
+    def observe(self):
+        for name, seconds in self.timings.items():
+            STAGE_SECONDS.observe(seconds, stage=name)
+
+    def header(self):
+        return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.timings.items())
@@ -0,0 +1,149 @@
+import re
+import zipfile
+
+import numpy as np
+import pandas as pd
+from pandas.tseries.api import guess_datetime_format
+from pandas._libs.parsers import STR_NA_VALUES
+
+from analyzer import TradeAnalyzer, FEE_RATE, STORED_COLUMNS
+from schema import resolve_columns, check_resolution, clean_headers, TIME_FORMATS, USED_COLUMNS
+
+try:
+    import polars as pl
+except ImportError:  # polars 是可选依赖，没装时只能用 pandas 引擎
+    pl = None
+
+# 可以直接交给 polars (chrono) 解析、且与 pandas 结果一致的时间格式：只含年月日时分秒和常见分隔符。
+# 其它格式 (时区、毫秒、月份名……) 整列交给 pandas 的 _parse_time_column
+SAFE_TIME_FORMAT = re.compile(r'^(?:%[YmdHMS]|[-/ :T.])+$')
+
+# 时间戳数量级 -> 乘到纳秒的倍数 (与 _parse_time_column 的 s / ms / us / ns 判断一致)
+EPOCH_FACTORS = ((1e11, 1_000_000_000), (1e14, 1_000_000), (1e17, 1_000))
+
+
+def read_trades_polars(source, columns=None, compression=None):
+    """
+    用 polars 多线程读取交易 CSV。所有列先按字符串读入 (不做类型推断，脏数字不会让整列读失败)，
+    数字和时间在 _preprocess 里按与 pandas 引擎相同的规则转换。
+    columns 为需要的列名 (去空格后)，其余列不读。zip 包先解压出包内的 CSV。
+    """
+    if compression == 'zip':
+        with zipfile.ZipFile(source) as archive:
+            source = archive.read(archive.namelist()[0])
+    elif hasattr(source, 'seek'):
+        source = source.read()
+    headers = pl.read_csv(source, n_rows=0, infer_schema=False).columns
+    wanted = None if columns is None else [h for h in headers if h.strip() in set(columns)]
+    # 缺失值的写法与 pandas.read_csv 默认的一致 ('NA'、'null'、'N/A' ……)
+    return pl.read_csv(source, columns=wanted, infer_schema=False, null_values=sorted(STR_NA_VALUES))
+
+
+class PolarsTradeAnalyzer(TradeAnalyzer):
+    """
+    polars 引擎：用 polars (多线程) 读 CSV、清洗数字、解析时间，规则与 TradeAnalyzer._preprocess 相同；
+    清洗好的明细一次转成与 pandas 引擎相同列和类型的 DataFrame，之后的指标计算完全共用 pandas 引擎的代码，
+    结果逐位一致。加速只来自读取和预处理 (CSV 越大、核数越多越明显)，指标计算本身与 pandas 引擎一样快。
+    只用于整表分析 (增量分析只处理新增的几笔，仍走 pandas)。
+    """
+
+    def __init__(self, df, fee_rate=FEE_RATE):
+        self.base = None
+        self.fee_rate = fee_rate
+        self.df = _to_pandas(self._preprocess(df))
+
+    def _clean_numeric(self, name, series):
+        # 与 _clean_numeric_column 相同：先整列转数字，失败的值去掉千分位逗号再转一次，最后补 0
+        text = series.str.strip_chars()
+        numeric = text.cast(pl.Float64, strict=False)
+        dirty = numeric.is_null() & series.is_not_null()
+        if dirty.any():
+            cleaned = text.str.replace_all(',', '', literal=True).cast(pl.Float64, strict=False)
+            numeric = pl.select(pl.when(dirty).then(cleaned).otherwise(numeric)).to_series()
+        return numeric.fill_null(0.0).alias(name)
+
+    def _parse_time(self, name, series, time_format=None):
+        """与 _parse_time_column 的规则相同；polars 处理不了 (或结果可能不同) 的情况整列交给 pandas"""
+        if series.dtype.is_temporal():
+            return series.cast(pl.Datetime('ns')).alias(name)
+        sample = series.drop_nulls()
+        sample = sample[0] if len(sample) else None
+        if sample is None:
+            return pl.Series(name, [None] * len(series), dtype=pl.Datetime('ns'))
+
+        if sample.strip().isdigit():
+            text = series.str.strip_chars()
+            numbers = text.cast(pl.Int64, strict=False)
+            # 有小数的时间戳 pandas 按浮点换算，这里不重复实现
+            if numbers.null_count() == text.cast(pl.Float64, strict=False).null_count():
+                magnitude = numbers.abs().max()
+                factor = next((f for limit, f in EPOCH_FACTORS if magnitude < limit), 1)
+                return (numbers * factor).cast(pl.Datetime('ns')).alias(name)
+            return self._parse_time_pandas(name, series, time_format)
+
+        if time_format is None:
+            time_format = guess_datetime_format(sample.strip())
+        if time_format and SAFE_TIME_FORMAT.match(time_format):
+            parsed = series.str.strptime(pl.Datetime('ns'), time_format, strict=False)
+            if parsed.null_count() < len(parsed):
+                return parsed.alias(name)
+        return self._parse_time_pandas(name, series, time_format)
+
+    def _parse_time_pandas(self, name, series, time_format):
+        parsed = self._parse_time_column(series.to_pandas(), time_format)
+        return pl.from_pandas(parsed).alias(name)
+
+    def _preprocess(self, df):
+        """规则同 TradeAnalyzer._preprocess (列名解析、容错、清洗)，结果仍是 polars 表"""
+        # 1-3. 清洗列名、解析映射、重命名，丢掉用不到的列
+        headers = clean_headers(df.columns)
+        resolution = resolve_columns(headers)
+        check_resolution(resolution, headers)
+        self.exchange = resolution.exchange
+        df = df.rename(dict(zip(df.columns, headers))).rename(resolution.rename, strict=False)
+        df = df.select([c for c in df.columns if c in USED_COLUMNS])
+
+        # 4. 容错 & 清洗
+        if 'Closed Vol.' not in df.columns and 'Size' in df.columns:
+            df = df.with_columns(pl.col('Size').alias('Closed Vol.'))
+        columns = {}
+        for c in ['Entry Price', 'Avg. Close Price', 'Closed Vol.', 'Closing PNL']:
+            columns[c] = self._clean_numeric(c, df[c]) if c in df.columns else pl.Series(c, [0.0] * len(df))
+        time_format = TIME_FORMATS.get(resolution.exchange)
+        for c in ['Opened', 'Closed']:
+            if c in df.columns:
+                columns[c] = self._parse_time(c, df[c], time_format)
+        if 'Closed' not in columns:
+            columns['Closed'] = columns['Opened'].alias('Closed')
+        for c, default in (('Side', 'Long'), ('Symbol', 'Unknown')):
+            series = df[c] if c in df.columns else pl.Series(c, [default] * len(df))
+            columns[c] = series.cast(pl.Categorical)
+        return pl.DataFrame(list(columns.values()))
+
+
+def _to_pandas(df):
+    """清洗后的 polars 明细转成 pandas 引擎 _preprocess 输出的列和类型 (数值、时间列直接转换)"""
+    return pd.DataFrame({
+        'Symbol': _lexical_categorical(df['Symbol']),
+        'Side': _lexical_categorical(df['Side']),
+        **{c: df[c].to_numpy() for c in ['Entry Price', 'Avg. Close Price', 'Closed Vol.', 'Closing PNL']},
+        'Opened': df['Opened'].to_pandas(),
+        'Closed': df['Closed'].to_pandas(),
+    })[STORED_COLUMNS]
+
+
+def _lexical_categorical(series):
+    """
+    polars 的 Categorical 列转成 pandas Categorical，类别按字典序排列 (与 pandas 引擎的 astype('category') 相同)。
+    polars 的物理编码是出现顺序，不是字典序：只对去重后的类别 (很少) 按字符串排序，再查表换算整列编码。
+    """
+    present = series.drop_nulls().unique()
+    names = present.cast(pl.String).to_numpy().astype(object)
+    order = np.argsort(names, kind='stable')
+    physical = present.to_physical().to_numpy()
+    # 查找表最后一格留给缺失值 (编码 -1)
+    size = int(physical.max()) + 1 if len(physical) else 0
+    lookup = np.full(size + 1, -1, dtype=np.int32)
+    lookup[physical[order]] = np.arange(len(order), dtype=np.int32)
+    codes = lookup[series.to_physical().fill_null(size).to_numpy()]
+    return pd.Categorical.from_codes(codes, categories=pd.Index(names[order], dtype=object))
@@ -0,0 +1,195 @@
+import io
+from functools import lru_cache
+from collections import namedtuple
+
+import pandas as pd
+
+# 列名映射字典 (兼容中文、英文、拼写错误)
+# 顺序有意义：按标准列依次匹配，每个标准列取第一个命中的别名
+COLUMN_MAPPING = {
+    'Symbol': ['Symbol', 'symbol', 'Instrument', 'Pair', 'Contract', '币种', '交易对', 'Market'],
+    'Side': ['Side', 'Direction', 'Type', '方向', '买卖', 'BS', 'Position Side'],
+    'Size': ['Size', 'Amount', 'Quantity', 'Qty', 'Vol', '数量', '张数', 'Exec Qty', 'Max Open Interest'],
+    'Entry Price': ['Entry Price', 'Avg. Open Price', 'Avg Entry Price', 'Open Price', '开仓均价', '开仓价', 'EntryPrice'],
+    # 🚨 包含您 CSV 里的特殊拼写错误 'Pirce' 以及常见的变体
+    'Avg. Close Price': [
+        'Avg. Close Pirce',
+        'Avg. Close Price', 'Close Price', 'Exit Price', 'Avg Price',
+        '平仓均价', '平仓价', '成交均价', 'Price', 'Fill Price'
+    ],
+    'Closed Vol.': ['Closed Vol.', 'Closed Volume', 'Size', 'Qty', 'Amount', '成交量', '平仓数量'],
+    'Closing PNL': ['Closing PNL', 'Realized PNL', 'PnL', 'Profit', 'Net Profit', '已实现盈亏', '盈亏', 'Realized Profit'],
+    'Opened': ['Opened', 'Open Time', 'Date', 'Time', 'Created Time', '开仓时间', '时间', 'Create Time'],
+    'Closed': ['Closed', 'Close Time', 'Update Time', 'Finished Time', '平仓时间', '更新时间']
+}
+
+# 成交明细 (逐笔成交 / 订单历史) 导出的列名映射：每行是一次成交，由 fills.py 按 FIFO 重建成交易
+FILL_COLUMN_MAPPING = {
+    'Symbol': ['Symbol', 'Contracts', 'Instrument', 'Pair', 'Contract', 'Market', 'Futures', '币种', '交易对', '合约'],
+    'Side': ['Side', 'Direction', 'Order Side', 'Type', '方向', '买卖', 'BS'],
+    'Position Side': ['Position Side', 'PositionSide', 'posSide', '持仓方向'],
+    'Price': ['Price', 'Fill Price', 'Exec Price', 'Filled Price', 'Trade Price', 'Avg Price', '成交价', '成交价格', '成交均价'],
+    'Quantity': ['Quantity', 'Qty', 'Exec Qty', 'Filled Qty', 'Fill Size', 'Executed', 'Filled', 'Size', '成交数量', '数量'],
+    'Time': ['Time', 'Date(UTC)', 'Date', 'Trade Time', 'Exec Time', 'Fill Time', 'Create Time', 'Created Time',
+             '成交时间', '时间'],
+}
+FILL_REQUIRED_COLUMNS = ['Price', 'Quantity', 'Time']
+# 只有成交明细才有的列 (逐笔成交的编号)：没有这类列时，能按仓位历史解析的表头 (有盈亏列) 仍按仓位历史处理
+FILL_ONLY_COLUMNS = ['Trade ID', 'TradeId', 'Trade No', 'Fill ID', 'FillId', 'Exec ID', 'ExecId', 'Execution ID',
+                     'Transaction ID', '成交ID', '成交编号', '成交单号']
+FILL_ONLY_INDEX = {a.lower() for a in FILL_ONLY_COLUMNS}
+# 仓位历史才有的列：表头解析出其中任何一个就按仓位历史 (每行一笔已平仓交易) 处理
+POSITION_ONLY_COLUMNS = ['Entry Price', 'Closed']
+
+# 预先转成小写的别名索引，匹配时不用反复 lower()
+ALIAS_INDEX = [(standard, [a.lower() for a in aliases]) for standard, aliases in COLUMN_MAPPING.items()]
+FILL_ALIAS_INDEX = [(standard, [a.lower() for a in aliases]) for standard, aliases in FILL_COLUMN_MAPPING.items()]
+
+# 缺了就没法分析的列：没有开仓时间算不了持仓时长，没有盈亏整份报告都是 0
+REQUIRED_COLUMNS = ['Opened', 'Closing PNL']
+
+# 分析会用到的标准列；导出文件里的其它列读 CSV 时直接跳过，不占内存
+USED_COLUMNS = ['Symbol', 'Side', 'Size', 'Entry Price', 'Avg. Close Price', 'Closed Vol.', 'Closing PNL',
+                'Opened', 'Closed']
+
+# 常见交易所 "仓位历史" 导出的表头指纹：表头包含某个 profile 的全部列即视为命中，
+# 这些列直接用 profile 里的映射；其余列 (方向等，各导出写法不一) 和未命中的文件仍走 COLUMN_MAPPING 别名匹配。
+EXCHANGE_PROFILES = {
+    'binance': {
+        'Symbol': 'Symbol', 'Entry Price': 'Entry Price', 'Avg. Close Price': 'Avg. Close Price',
+        'Closed Vol.': 'Closed Vol.', 'Closing PNL': 'Closing PNL', 'Opened': 'Opened', 'Closed': 'Closed',
+        'Max Open Interest': 'Size',
+    },
+    'binance_pirce': {
+        'Symbol': 'Symbol', 'Entry Price': 'Entry Price', 'Avg. Close Pirce': 'Avg. Close Price',
+        'Closed Vol.': 'Closed Vol.', 'Closing PNL': 'Closing PNL', 'Opened': 'Opened', 'Closed': 'Closed',
+    },
+    'bybit': {
+        'Contracts': 'Symbol', 'Qty': 'Closed Vol.', 'Entry Price': 'Entry Price', 'Exit Price': 'Avg. Close Price',
+        'Closed P&L': 'Closing PNL', 'Create Time': 'Opened', 'Trade Time': 'Closed',
+    },
+    'okx': {
+        'Instrument': 'Symbol', 'Avg. open price': 'Entry Price', 'Avg. close price': 'Avg. Close Price',
+        'Closed amount': 'Closed Vol.', 'Realized PnL': 'Closing PNL', 'Open time': 'Opened', 'Close time': 'Closed',
+    },
+    'bitget': {
+        'Futures': 'Symbol', 'Average opening price': 'Entry Price', 'Average closing price': 'Avg. Close Price',
+        'Closed amount': 'Closed Vol.', 'Realized PnL': 'Closing PNL', 'Opening time': 'Opened', 'Closed time': 'Closed',
+    },
+}
+
+# 已知交易所的时间格式，解析时跳过格式推断
+TIME_FORMATS = {
+    'binance': '%Y-%m-%d %H:%M:%S',
+    'binance_pirce': '%Y-%m-%d %H:%M:%S',
+    'bybit': '%Y-%m-%d %H:%M:%S',
+}
+
+# 解析结果：命中的交易所 (未命中为 None)、原列名 -> 标准列名、缺失的必需列、需要读取的原列名、
+# 文件类型 (positions 仓位历史 / fills 成交明细)
+ColumnResolution = namedtuple('ColumnResolution', ['exchange', 'rename', 'missing', 'usecols', 'kind'])
+
+
+def _match_aliases(headers, alias_index=ALIAS_INDEX):
+    """
+    按 COLUMN_MAPPING (成交明细为 FILL_COLUMN_MAPPING) 的顺序逐个标准列匹配别名 (忽略大小写)，
+    规则与逐列 rename 完全一致 (包括 'Size' 被后面的 'Closed Vol.' 再次借走的情况)，
+    只是在表头上模拟，不碰数据。
+    """
+    cols = list(headers)
+    for standard, aliases in alias_index:
+        # 如果标准名已经存在，跳过
+        if standard in cols:
+            continue
+        first = {}
+        for i, c in enumerate(cols):
+            first.setdefault(c.lower(), i)
+        for alias in aliases:
+            i = first.get(alias)
+            if i is not None:
+                cols[i] = standard
+                break
+    return {h: c for h, c in zip(headers, cols) if h != c}
+
+
+@lru_cache(maxsize=256)
+def resolve_columns(headers):
+    """
+    根据表头 (已去空格的 tuple，同时作为缓存指纹) 解析列名映射。
+    同一种导出格式只在第一次出现时计算，之后直接命中缓存。
+    """
+    header_set = set(headers)
+    exchange, rename = None, None
+    for name, profile in EXCHANGE_PROFILES.items():
+        if header_set.issuperset(profile):
+            exchange = name
+            rename = {src: dst for src, dst in profile.items() if src != dst}
+            # profile 没有覆盖的列 (方向 'Direction' / 'Position Side' 等) 仍按别名补上，
+            # profile 已映射的列不参与
+            mapped = [profile.get(h, h) for h in headers]
+            extra = _match_aliases(mapped)
+            rename.update({h: extra[h] for h in headers if h not in profile and h in extra})
+            break
+    if rename is None:
+        rename = _match_aliases(headers)
+
+    resolved = {rename.get(h, h) for h in headers}
+    missing = [c for c in REQUIRED_COLUMNS if c not in resolved]
+    # 既没有开仓价也没有平仓时间，并且有成交编号列、或者按仓位历史缺必需列 (如没有盈亏列)：
+    # 是成交明细，按成交明细的别名再解析一次。只有 币种/方向/数量/价格/时间/盈亏 的简易仓位历史不会被当成成交明细
+    fill_only = any(h.lower() in FILL_ONLY_INDEX for h in headers)
+    if exchange is None and resolved.isdisjoint(POSITION_ONLY_COLUMNS) and (missing or fill_only):
+        fill_rename = _match_aliases(headers, FILL_ALIAS_INDEX)
+        fill_resolved = {fill_rename.get(h, h) for h in headers}
+        if all(c in fill_resolved for c in FILL_REQUIRED_COLUMNS):
+            usecols = tuple(h for h in headers if fill_rename.get(h, h) in FILL_COLUMN_MAPPING)
+            return ColumnResolution(None, fill_rename, [], usecols, 'fills')
+    usecols = tuple(h for h in headers if rename.get(h, h) in USED_COLUMNS)
+    return ColumnResolution(exchange, rename, missing, usecols, 'positions')
+
+
+def clean_headers(columns):
+    # 清洗列名 (去前后空格)
+    return tuple(c.strip() for c in columns)
+
+
+def check_resolution(resolution, headers):
+    if resolution.missing:
+        # 抛出异常，前端会显示这个错误信息
+        raise ValueError(f"缺少关键列: {resolution.missing}。CSV里实际有的列名是: {list(headers)}")
+
+
+GZIP_MAGIC = b'\x1f\x8b'
+ZIP_MAGIC = b'PK\x03\x04'
+
+
+def detect_compression(head):
+    """按文件头识别交易所导出的压缩格式 (.csv.gz / .zip)，未压缩返回 None"""
+    if head.startswith(GZIP_MAGIC):
+        return 'gzip'
+    if head.startswith(ZIP_MAGIC):
+        return 'zip'
+    return None
+
+
+def csv_source(contents):
+    """
+    CSV 输入：contents 为字节串，或上传落盘后的文件路径 (直接从文件解析，不在内存里再留一份)。
+    返回 (read_csv 的输入, compression)，压缩包在解析时边读边解压。
+    """
+    if isinstance(contents, (bytes, bytearray)):
+        return io.BytesIO(contents), detect_compression(bytes(contents[:4]))
+    with open(contents, 'rb') as f:
+        head = f.read(4)
+    return contents, detect_compression(head)
+
+
+def sniff_csv(contents):
+    """
+    只读表头行就完成列名解析；缺少必需列时在读取数据体之前直接报错。
+    """
+    source, compression = csv_source(contents)
+    headers = clean_headers(pd.read_csv(source, nrows=0, compression=compression).columns)
+    resolution = resolve_columns(headers)
+    check_resolution(resolution, headers)
+    return resolution
@@ -0,0 +1,157 @@
+import gzip
+import json
+import math
+
+import numpy as np
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import JSONResponse
+
+from cache import _to_builtin
+
+try:
+    import orjson
+except ImportError:  # orjson 是可选依赖，没装时用标准库 json (结果相同，只是慢一些)
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # brotli 是可选依赖，没装时只协商 gzip
+    brotli = None
+
+# 响应里的浮点数保留的小数位 (金额、胜率、效率都够用)；缓存和 Prompt 里仍是全精度
+FLOAT_DIGITS = 4
+# 小于这个字节数的响应不压缩 (压缩头的开销比省下的还多)
+COMPRESS_MIN_BYTES = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+# 值得压缩的响应类型；text/event-stream 是流式响应，不经过这里
+COMPRESSIBLE_TYPES = ("application/json", "text/plain", "text/html", "text/markdown")
+
+
+def round_floats(obj, digits=FLOAT_DIGITS):
+    """
+    递归复制响应体：浮点数按 digits 位小数四舍五入，NaN / Inf 换成 None (标准 JSON 里没有)，
+    numpy 标量和数组转成 Python 原生类型。响应体大小固定 (与交易笔数无关)，遍历开销可以忽略。
+    """
+    if isinstance(obj, dict):
+        return {_key(k): round_floats(v, digits) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [round_floats(v, digits) for v in obj]
+    if isinstance(obj, np.ndarray):
+        return round_floats(obj.tolist(), digits)
+    if isinstance(obj, np.generic):
+        obj = obj.item()
+    if isinstance(obj, float):
+        return round(obj, digits) if math.isfinite(obj) else None
+    return obj
+
+
+def _key(k):
+    # hourly_pnl 的键可能是 numpy 整数
+    return k.item() if isinstance(k, np.generic) else k
+
+
+def dumps(content, digits=FLOAT_DIGITS):
+    """紧凑 JSON (无多余空格、中文不转义)，返回 bytes。装了 orjson 时走 orjson"""
+    content = round_floats(content, digits)
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS,
+                            default=_to_builtin)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":"),
+                      default=_to_builtin).encode("utf-8")
+
+
+class CompactJSONResponse(JSONResponse):
+    """
+    用 dumps() 序列化的 JSONResponse。接口直接返回它可以跳过 FastAPI 的 jsonable_encoder
+    (对整个响应体再递归转换一遍)。
+    """
+
+    def render(self, content):
+        return dumps(content)
+
+
+def negotiate_encoding(accept_encoding):
+    """
+    按 Accept-Encoding 选压缩算法：q 值最高的优先，并列时 br 优先于 gzip；都不接受返回 None。
+    没装 brotli 时只考虑 gzip。
+    """
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.partition(";")
+        q = 1.0
+        params = params.strip().replace(" ", "")
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if name.strip():
+            accepted[name.strip().lower()] = q
+    candidates = (["br"] if brotli is not None else []) + ["gzip"]
+    best, best_q = None, 0.0
+    for encoding in candidates:
+        q = accepted.get(encoding, accepted.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compress(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+class CompressionMiddleware:
+    """
+    按 Accept-Encoding 协商 br / gzip 压缩 JSON / 文本响应：响应体收齐后一次性压缩。
+    text/event-stream (SSE) 等其它类型原样透传，不影响逐段推送。
+    """
+
+    def __init__(self, app, minimum_size=COMPRESS_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        chunks = []
+        passthrough = False
+
+        async def send_compressed(message):
+            nonlocal start, passthrough
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                start = message
+                passthrough = ("content-encoding" in headers
+                               or not headers.get("content-type", "").startswith(COMPRESSIBLE_TYPES))
+                if passthrough:
+                    await send(message)
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            # BaseHTTPMiddleware 会把响应体拆成多段转发，这里先收齐
+            chunks.append(message.get("body", b""))
+            if message.get("more_body", False):
+                return
+            body = b"".join(chunks)
+            if len(body) >= self.minimum_size:
+                body = compress(body, encoding)
+                headers = MutableHeaders(raw=start["headers"])
+                headers["Content-Encoding"] = encoding
+                headers["Content-Length"] = str(len(body))
+                headers.add_vary_header("Accept-Encoding")
+            await send(start)
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_compressed)
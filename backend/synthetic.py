@@ -0,0 +1,131 @@
+import numpy as np
+import pandas as pd
+
+# 不同导出格式的表头 (标准列 -> 文件里的列名)，覆盖别名匹配里的各种写法
+DIALECTS = {
+    # 仓位历史标准格式
+    'standard': {
+        'Symbol': 'Symbol', 'Side': 'Side', 'Entry Price': 'Entry Price', 'Avg. Close Price': 'Avg. Close Price',
+        'Closed Vol.': 'Closed Vol.', 'Closing PNL': 'Closing PNL', 'Opened': 'Opened', 'Closed': 'Closed',
+    },
+    # 带 'Pirce' 拼写错误的版本
+    'pirce': {
+        'Symbol': 'Symbol', 'Side': 'Side', 'Entry Price': 'Entry Price', 'Avg. Close Price': 'Avg. Close Pirce',
+        'Closed Vol.': 'Closed Vol.', 'Closing PNL': 'Closing PNL', 'Opened': 'Opened', 'Closed': 'Closed',
+    },
+    # 中文表头
+    'chinese': {
+        'Symbol': '币种', 'Side': '方向', 'Entry Price': '开仓均价', 'Avg. Close Price': '平仓均价',
+        'Closed Vol.': '平仓数量', 'Closing PNL': '已实现盈亏', 'Opened': '开仓时间', 'Closed': '平仓时间',
+    },
+    # 需要走别名匹配的通用英文表头
+    'generic': {
+        'Symbol': 'Instrument', 'Side': 'Direction', 'Entry Price': 'Open Price', 'Avg. Close Price': 'Exit Price',
+        'Closed Vol.': 'Qty', 'Closing PNL': 'Realized PNL', 'Opened': 'Open Time', 'Closed': 'Close Time',
+    },
+}
+
+
+def _dirty_numbers(values, mask, rng):
+    """把一部分数字写成 ' 1,234.56 ' 这种带千分位逗号和空格的脏字符串"""
+    out = values.astype(object)
+    if mask.any():
+        formatted = pd.Series(values[mask]).map('{:,.4f}'.format)
+        pad = np.where(rng.random(mask.sum()) < 0.5, ' ', '')
+        out[mask] = (pad + formatted.to_numpy(dtype=object) + pad)
+    return out
+
+
+def generate_trades(rows, symbols=200, win_rate=0.5, dialect='standard', dirty_ratio=0.0,
+                    time_format='%Y-%m-%d %H:%M:%S', seed=0, sort_by='Opened'):
+    """
+    生成可复现的合成交易历史 (每行一笔已平仓交易)。
+
+    rows / symbols 控制行数和币种基数；win_rate 为毛盈亏为正的比例；
+    dialect 选择表头写法 (见 DIALECTS)；dirty_ratio 为写成脏字符串的数字比例；
+    time_format 为 None 时时间列输出毫秒时间戳；sort_by='Closed' 时按平仓时间排序
+    (交易所的仓位历史通常这样导出，分块流式分析要求这种顺序)。同一个 seed 结果完全一致。
+    """
+    rng = np.random.default_rng(seed)
+
+    # 币种：长尾分布，少数主流币占大部分成交
+    names = np.array([f"COIN{i}USDT" for i in range(symbols)])
+    weights = 1.0 / np.arange(1, symbols + 1)
+    symbol = names[rng.choice(symbols, size=rows, p=weights / weights.sum())]
+    side = np.where(rng.random(rows) < 0.5, 'Long', 'Short')
+
+    # 开仓时间递增，持仓时长对数正态 (秒级剥头皮到数天长线都有)
+    start = np.datetime64('2023-01-01T00:00:00', 'ms')
+    gaps = rng.exponential(60_000, size=rows).astype(np.int64)
+    opened = start + np.cumsum(gaps).astype('timedelta64[ms]')
+    hold = (rng.lognormal(mean=3.0, sigma=1.6, size=rows) * 60_000).astype(np.int64)
+    closed = opened + hold.astype('timedelta64[ms]')
+
+    entry = np.round(rng.lognormal(mean=2.0, sigma=2.0, size=rows), 6)
+    volume = np.round(rng.lognormal(mean=1.0, sigma=1.0, size=rows), 3)
+    win = rng.random(rows) < win_rate
+    move = rng.exponential(0.01, size=rows) * np.where(win, 1, -1)
+    direction = np.where(side == 'Long', 1, -1)
+    exit_price = np.round(entry * (1 + move * direction), 6)
+    pnl = np.round((exit_price - entry) * volume * direction, 4)
+
+    if sort_by == 'Closed':
+        order = np.argsort(closed, kind='stable')
+        symbol, side, opened, closed = symbol[order], side[order], opened[order], closed[order]
+        entry, exit_price, volume, pnl = entry[order], exit_price[order], volume[order], pnl[order]
+
+    df = pd.DataFrame({
+        'Symbol': symbol,
+        'Side': side,
+        'Entry Price': entry,
+        'Avg. Close Price': exit_price,
+        'Closed Vol.': volume,
+        'Closing PNL': pnl,
+    })
+    if dirty_ratio > 0:
+        for col in ['Entry Price', 'Avg. Close Price', 'Closed Vol.', 'Closing PNL']:
+            df[col] = _dirty_numbers(df[col].to_numpy(), rng.random(rows) < dirty_ratio, rng)
+
+    if time_format is None:
+        df['Opened'] = opened.astype(np.int64)
+        df['Closed'] = closed.astype(np.int64)
+    else:
+        df['Opened'] = pd.DatetimeIndex(opened).strftime(time_format)
+        df['Closed'] = pd.DatetimeIndex(closed).strftime(time_format)
+
+    return df.rename(columns=DIALECTS[dialect])
+
+
+def generate_fills(rows, symbols=50, hedge=False, time_format='%Y-%m-%d %H:%M:%S', seed=0):
+    """
+    生成可复现的合成成交明细 (每行一次成交，表头同币安合约的成交历史导出)。
+    单向持仓时买卖方向随机，会出现加仓、部分平仓和反手；hedge=True 时带持仓方向列 (双向持仓)。
+    """
+    rng = np.random.default_rng(seed)
+    names = np.array([f"COIN{i}USDT" for i in range(symbols)])
+    weights = 1.0 / np.arange(1, symbols + 1)
+    code = rng.choice(symbols, size=rows, p=weights / weights.sum())
+
+    start = np.datetime64('2023-01-01T00:00:00', 'ms')
+    filled = start + np.cumsum(rng.exponential(20_000, size=rows).astype(np.int64)).astype('timedelta64[ms]')
+    base = np.round(rng.lognormal(mean=2.0, sigma=2.0, size=symbols), 6)
+    price = np.round(base[code] * np.exp(rng.normal(0, 0.01, size=rows)), 6)
+    qty = np.round(rng.lognormal(mean=0.0, sigma=1.0, size=rows), 3) + 0.001
+
+    df = pd.DataFrame({
+        'Date(UTC)': pd.DatetimeIndex(filled).strftime(time_format),
+        'Symbol': names[code],
+        'Side': np.where(rng.random(rows) < 0.5, 'BUY', 'SELL'),
+        'Price': price,
+        'Quantity': qty,
+        'Amount': np.round(price * qty, 4),
+        'Fee': np.round(price * qty * 0.0004, 6),
+    })
+    if hedge:
+        df.insert(3, 'Position Side', np.where(rng.random(rows) < 0.5, 'LONG', 'SHORT'))
+    return df
+
+
+def generate_csv(rows, **kwargs):
+    """生成合成交易历史并编码成上传用的 CSV 字节"""
+    return generate_trades(rows, **kwargs).to_csv(index=False).encode('utf-8')
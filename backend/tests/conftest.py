@@ -0,0 +1,7 @@
+import os
+import sys
+
+# 后端模块是平铺的 (main.py 里直接 import analyzer)，测试同样从 backend 目录导入
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
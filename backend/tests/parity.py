@@ -0,0 +1,28 @@
+import math
+
+# 分块 / 增量分析里浮点合计的累加顺序与整表不同，只在末位上有差别
+FLOAT_REL = 1e-9
+
+
+def json_diff(expected, actual, rel=FLOAT_REL, path=''):
+    """逐项比较两份指标 JSON：浮点数按相对误差 rel 比较 (rel=0 为逐位相等)，其余值 (笔数、币种列表、顺序) 必须完全一致"""
+    if isinstance(expected, dict):
+        if not isinstance(actual, dict) or list(expected) != list(actual):
+            return [(path, expected, actual)]
+        return [d for k in expected for d in json_diff(expected[k], actual[k], rel, f'{path}/{k}')]
+    if isinstance(expected, (list, tuple)):
+        if not isinstance(actual, (list, tuple)) or len(expected) != len(actual):
+            return [(path, expected, actual)]
+        return [d for i, (x, y) in enumerate(zip(expected, actual)) for d in json_diff(x, y, rel, f'{path}[{i}]')]
+    if isinstance(expected, float) and isinstance(actual, float):
+        if math.isnan(expected) and math.isnan(actual):
+            return []
+        if expected == actual or (rel and math.isclose(expected, actual, rel_tol=rel, abs_tol=rel)):
+            return []
+        return [(path, expected, actual)]
+    return [] if expected == actual else [(path, expected, actual)]
+
+
+def assert_same_json(expected, actual, rel=FLOAT_REL):
+    diffs = json_diff(expected, actual, rel)
+    assert not diffs, diffs[:5]
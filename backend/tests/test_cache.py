@@ -0,0 +1,132 @@
+import os
+import threading
+import time
+
+import pytest
+
+os.environ.setdefault('GEMINI_API_KEY', 'test')
+
+from cache import ResultCache, payload_bytes
+
+
+def blob(n):
+    return {"report": "x" * n}
+
+
+def test_byte_budget_evicts_least_recently_used():
+    size = payload_bytes(blob(100))
+    cache = ResultCache(max_entries=100, max_bytes=size * 3)
+    for key in 'abc':
+        cache.set(key, blob(100))
+    assert cache.get('a') is not None      # a 变成最近使用
+    cache.set('d', blob(100))
+    assert cache.get('b') is None
+    assert [cache.get(key) is not None for key in 'acd'] == [True, True, True]
+    assert cache.memory_bytes == size * 3
+
+
+def test_oversize_entry_skips_memory_but_reaches_disk(tmp_path):
+    cache = ResultCache(max_entries=100, max_bytes=500, disk_dir=str(tmp_path))
+    cache.set('small', blob(10))
+    cache.set('big', blob(1000))
+    assert cache.memory_bytes == payload_bytes(blob(10))
+    assert 'big' not in cache._entries
+    assert cache.get('big') == blob(1000)   # 磁盘层命中，仍不提升到内存层
+    assert 'big' not in cache._entries
+    assert cache.get('small') == blob(10)
+
+
+def test_overwrite_and_expiry_release_bytes():
+    cache = ResultCache(max_entries=10, max_bytes=10_000, ttl=1)
+    cache.set('a', blob(500))
+    cache.set('a', blob(50))
+    assert cache.memory_bytes == payload_bytes(blob(50))
+    cache._entries['a'] = (time.time() - 5,) + cache._entries['a'][1:]
+    assert cache.get('a') is None
+    assert cache.memory_bytes == 0
+
+
+def test_count_limit_still_applies():
+    cache = ResultCache(max_entries=2, max_bytes=10_000)
+    for key in 'abc':
+        cache.set(key, blob(1))
+    assert cache.get('a') is None and cache.get('c') is not None
+
+
+def test_unlimited_by_default():
+    cache = ResultCache(max_entries=10)
+    cache.set('a', blob(100_000))
+    assert cache.get('a') is not None
+
+
+def test_concurrent_disk_writes_of_the_same_key(tmp_path, capsys):
+    # 多个写入方同时写同一个 key：各自的临时文件不冲突，最后留下一份完整的 JSON
+    caches = [ResultCache(max_entries=1, disk_dir=str(tmp_path)) for _ in range(8)]
+    errors = []
+
+    def write(cache, i):
+        for _ in range(20):
+            try:
+                cache._write_disk('k', time.time(), blob(20_000 + i))
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=write, args=(cache, i)) for i, cache in enumerate(caches)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    assert '缓存写入磁盘失败' not in capsys.readouterr().out
+    assert os.listdir(tmp_path) == ['k.json']
+    assert ResultCache(disk_dir=str(tmp_path)).get('k')['report'].startswith('x' * 20_000)
+
+
+def test_write_does_not_touch_another_writers_temp_file(tmp_path):
+    # 另一个进程正在写 k 的临时文件 (旧版本固定用 k.json.tmp)
+    other = tmp_path / 'k.json.tmp'
+    other.write_text('{"partial')
+    ResultCache(disk_dir=str(tmp_path)).set('k', blob(10))
+    assert other.read_text() == '{"partial'
+    assert ResultCache(disk_dir=str(tmp_path)).get('k') == blob(10)
+
+
+def test_failed_disk_write_leaves_no_temp_file(tmp_path):
+    cache = ResultCache(disk_dir=str(tmp_path))
+    cache.set('k', {"bad": object()})
+    assert os.listdir(tmp_path) == []
+
+
+@pytest.fixture
+def client(monkeypatch):
+    pytest.importorskip('fastapi.testclient')
+    import main
+    from benchmark import StubModel
+    from fastapi.testclient import TestClient
+    monkeypatch.setattr(main, 'result_cache', ResultCache(max_entries=16))
+    monkeypatch.setattr(main, 'report_cache', ResultCache(max_entries=16))
+    with TestClient(main.app) as c:
+        main.models.use(StubModel(), 'stub')
+        yield c
+
+
+def test_result_cache_key_covers_engine_and_state(client):
+    pytest.importorskip('polars')
+    from synthetic import generate_trades
+    old = generate_trades(300, symbols=5, seed=1).to_csv(index=False).encode()
+    new = generate_trades(600, symbols=5, seed=1).to_csv(index=False).encode()
+
+    def post(raw, state_id=None, **params):
+        data = {'state_id': state_id} if state_id else {}
+        return client.post('/analyze', params=params, data=data, files={'file': ('t.csv', raw, 'text/csv')}).json()
+
+    base = post(old)
+    assert post(old)['cache'] == 'hit'
+    assert post(old, engine='polars')['cache'] != 'hit'
+
+    full = post(new)
+    incremental = post(new, state_id=base['state_id'])
+    assert incremental['cache'] != 'hit'
+    # 返回的 state_id 始终是文件内容哈希，下一次增量分析可以直接引用
+    assert incremental['state_id'] == full['state_id']
+    assert post(new, state_id=base['state_id'])['cache'] == 'hit'
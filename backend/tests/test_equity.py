@@ -0,0 +1,96 @@
+import io
+import json
+
+import numpy as np
+import pytest
+
+from analyzer import analyze_csv_bytes, analyze_csv_bytes_timed, read_trades_csv, StreamingTradeAnalyzer
+from equity import CURVE_BUCKETS, CURVE_POINTS, EquityState, bucket_width, reduce_points
+from synthetic import generate_trades
+from parity import assert_same_json
+
+
+def history(n, seed=0, tie_every=3):
+    """升序的平仓时间 (约三分之一与前一笔同一时刻) + 整数盈亏 (累加没有舍入误差，可以逐位比较)"""
+    rng = np.random.default_rng(seed)
+    steps = np.where(rng.random(n) < 1 / tie_every, 0, rng.integers(1, 600, n)) * 1_000_000_000
+    times = 1_700_000_000_000_000_000 + np.cumsum(steps)
+    pnl = rng.integers(-50, 51, n).astype(float)
+    return times, pnl
+
+
+def fold(times, pnl, cuts=(), through_state=False):
+    state = EquityState()
+    for lo, hi in zip((0,) + tuple(cuts), tuple(cuts) + (len(times),)):
+        state = state.feed(times[lo:hi], pnl[lo:hi])
+        if through_state:
+            state = EquityState.from_state(json.loads(json.dumps(state.to_state())))
+    return state.feed([], [], final=True)
+
+
+def test_bucket_width_depends_only_on_point_count():
+    assert bucket_width(0) == 1
+    assert bucket_width(CURVE_BUCKETS) == 1
+    assert bucket_width(CURVE_BUCKETS + 1) == 2
+    assert bucket_width(CURVE_BUCKETS * 8) == 8
+    assert bucket_width(CURVE_BUCKETS * 8 + 1) == 16
+
+
+def test_reduce_points_keeps_extremes_and_ends():
+    rng = np.random.default_rng(1)
+    equity = np.cumsum(rng.normal(size=5000))
+    keep = reduce_points(np.arange(5000), equity, bucket_width(5000))
+    assert keep[0] == 0 and keep[-1] == 4999
+    assert equity.argmin() in keep and equity.argmax() in keep
+    assert len(keep) <= 4 * CURVE_BUCKETS
+
+
+def test_reducing_twice_equals_reducing_once():
+    rng = np.random.default_rng(2)
+    equity = rng.integers(0, 20, 4000).astype(float)  # 大量并列的极值
+    index = np.arange(4000)
+    once = reduce_points(index, equity, 32)
+    step = reduce_points(index, equity, 8)
+    twice = step[reduce_points(index[step], equity[step], 32)]
+    assert once.tolist() == twice.tolist()
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_batched_fold_matches_single_fold(seed):
+    times, pnl = history(20000, seed)
+    rng = np.random.default_rng(seed)
+    cuts = np.sort(rng.choice(np.arange(1, len(times)), size=25, replace=False))
+    whole = fold(times, pnl)
+    assert whole.points.shape[1] <= 4 * CURVE_BUCKETS
+    for state in (fold(times, pnl, cuts), fold(times, pnl, cuts, through_state=True)):
+        assert state.n_points == whole.n_points
+        assert state.point_index.tolist() == whole.point_index.tolist()
+        assert np.array_equal(state.points, whole.points)
+        assert state.to_json() == whole.to_json()
+
+
+def test_output_is_bounded():
+    times, pnl = history(50000, seed=9)
+    out = fold(times, pnl).to_json()['points']
+    assert len(out['time']) == CURVE_POINTS
+
+
+def test_forward_streaming_folds_as_it_goes():
+    raw = generate_trades(20000, symbols=10, seed=4, sort_by='Closed').to_csv(index=False).encode()
+    analyzer = StreamingTradeAnalyzer(read_trades_csv(io.BytesIO(raw), chunksize=1000))
+    equity = analyzer.aggregate.equity
+    # 正序分块不保留明细段，只有大小有上限的折叠状态
+    assert equity.segments == []
+    assert equity.base.points.shape[1] <= 4 * CURVE_BUCKETS
+    assert equity.base.n_trades + len(equity.base.open_times) + analyzer.held.trade_count == 20000
+    assert_same_json(analyze_csv_bytes(raw), analyzer.get_analysis_json())
+
+
+def test_incremental_curve_matches_full_recompute():
+    df = generate_trades(12000, symbols=10, seed=5, sort_by='Closed')
+    full = df.to_csv(index=False).encode()
+    _, info = analyze_csv_bytes_timed(df.iloc[:7000].to_csv(index=False).encode())
+    state = json.loads(json.dumps(info['state']))
+    assert len(state['equity']['point_index']) <= 4 * CURVE_BUCKETS
+    incremental, _ = analyze_csv_bytes_timed(full, state=state)
+    assert_same_json(analyze_csv_bytes(full)['equity'], incremental['equity'])
@@ -0,0 +1,182 @@
+from collections import defaultdict, deque
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from fills import fifo_match, reconstruct_trades, _split_legs
+
+T0 = pd.Timestamp('2024-01-01 00:00:00')
+
+
+def at(minutes):
+    return T0 + pd.Timedelta(minutes=minutes)
+
+
+def rebuild(fills):
+    """fills: [(币种, 方向, 持仓方向或 None, 价格, 数量, 分钟)]"""
+    symbol, side, position, price, qty, minutes = zip(*fills)
+    position = None if all(p is None for p in position) else pd.Series(position)
+    return reconstruct_trades(pd.Series(symbol), pd.Series(side), position, np.array(price, dtype=float),
+                              np.array(qty, dtype=float), pd.Series([at(m) for m in minutes]))
+
+
+COLUMNS = ['Symbol', 'Side', 'Entry Price', 'Avg. Close Price', 'Closed Vol.', 'Closing PNL', 'Opened', 'Closed']
+
+
+def rows(trades):
+    return list(zip(*(trades[c].tolist() for c in COLUMNS)))
+
+
+def reference(fills):
+    """
+    逐笔模拟的参考实现：成交按 (币种, 时间, 文件顺序) 排序；单向持仓反向成交先平后开，
+    双向持仓按持仓方向开平；各账户 FIFO，没有可匹配开仓的平仓量丢弃；同一账户同一时刻的平仓合并为一笔。
+    """
+    order = sorted(range(len(fills)), key=lambda i: (fills[i][0], fills[i][5], i))
+    net = defaultdict(float)
+    lots = defaultdict(deque)
+    trades = {}
+    dropped = 0.0
+    for i in order:
+        symbol, side, position, price, qty, minutes = fills[i]
+        buy = 1 if side == 'BUY' else -1
+        if position is not None:
+            held = 1 if position == 'LONG' else -1
+            legs = [(held, buy == held, qty)]
+        else:
+            legs, left, current = [], qty, net[symbol]
+            if current != 0 and np.sign(current) != buy:
+                legs.append((int(np.sign(current)), False, min(left, abs(current))))
+                left -= legs[-1][2]
+            if left > 0:
+                legs.append((buy, True, left))
+            net[symbol] += buy * qty
+        for held, is_open, q in legs:
+            book = lots[(symbol, held)]
+            if is_open:
+                book.append([q, price, minutes])
+                continue
+            while q > 0 and book:
+                take = min(q, book[0][0])
+                trade = trades.setdefault((symbol, held, minutes), [0.0, 0.0, 0.0, minutes])
+                trade[0] += take
+                trade[1] += take * book[0][1]
+                trade[2] += take * price
+                trade[3] = min(trade[3], book[0][2])
+                book[0][0] -= take
+                q -= take
+                if book[0][0] == 0:
+                    book.popleft()
+            dropped += q
+    out = [(symbol, 'Long' if held > 0 else 'Short', entry / vol, exit_ / vol, vol, held * (exit_ - entry),
+            at(opened), at(closed))
+           for (symbol, held, closed), (vol, entry, exit_, opened) in trades.items()]
+    return sorted(out, key=lambda t: (t[7], t[0], t[1])), dropped
+
+
+def assert_matches_reference(fills):
+    trades, stats = rebuild(fills)
+    expected, dropped = reference(fills)
+    actual = sorted(rows(trades), key=lambda t: (t[7], t[0], t[1]))
+    assert len(actual) == len(expected)
+    for got, want in zip(actual, expected):
+        assert got[:2] == want[:2] and got[6:] == want[6:]
+        assert got[2:6] == pytest.approx(want[2:6], rel=1e-12, abs=1e-9)
+    assert stats['unmatched_qty'] == pytest.approx(dropped)
+    return trades, stats
+
+
+def test_partial_closes():
+    trades, _ = assert_matches_reference([
+        ('BTC', 'BUY', None, 100.0, 2.0, 0),
+        ('BTC', 'SELL', None, 110.0, 0.5, 1),
+        ('BTC', 'SELL', None, 90.0, 1.5, 2),
+    ])
+    assert rows(trades) == [
+        ('BTC', 'Long', 100.0, 110.0, 0.5, 5.0, at(0), at(1)),
+        ('BTC', 'Long', 100.0, 90.0, 1.5, -15.0, at(0), at(2)),
+    ]
+
+
+def test_flip_through_zero():
+    trades, stats = assert_matches_reference([
+        ('BTC', 'BUY', None, 100.0, 1.0, 0),
+        ('BTC', 'SELL', None, 110.0, 3.0, 1),   # 平多 1，反手开空 2
+        ('BTC', 'BUY', None, 100.0, 2.0, 2),
+    ])
+    assert rows(trades) == [
+        ('BTC', 'Long', 100.0, 110.0, 1.0, 10.0, at(0), at(1)),
+        ('BTC', 'Short', 110.0, 100.0, 2.0, 20.0, at(1), at(2)),
+    ]
+    assert stats['open_qty'] == 0
+
+
+def test_hedge_mode_keeps_long_and_short_books_apart():
+    trades, _ = assert_matches_reference([
+        ('BTC', 'BUY', 'LONG', 100.0, 1.0, 0),
+        ('BTC', 'SELL', 'SHORT', 100.0, 1.0, 1),
+        ('BTC', 'SELL', 'LONG', 105.0, 1.0, 2),
+        ('BTC', 'BUY', 'SHORT', 95.0, 1.0, 3),
+    ])
+    assert [(t[1], t[5]) for t in rows(trades)] == [('Long', 5.0), ('Short', 5.0)]
+
+
+def test_close_without_matching_open_is_dropped():
+    trades, stats = assert_matches_reference([
+        ('BTC', 'SELL', 'LONG', 100.0, 1.0, 0),    # 导出之前建的仓，整笔对不上
+        ('BTC', 'BUY', 'LONG', 100.0, 1.0, 1),
+        ('BTC', 'SELL', 'LONG', 104.0, 3.0, 2),    # 只有 1 可以匹配
+    ])
+    assert rows(trades) == [('BTC', 'Long', 100.0, 104.0, 1.0, 4.0, at(1), at(2))]
+    assert stats['unmatched_qty'] == pytest.approx(3.0)
+
+
+def test_fills_at_the_same_timestamp():
+    trades, _ = assert_matches_reference([
+        ('BTC', 'BUY', None, 100.0, 1.0, 0),
+        ('BTC', 'BUY', None, 102.0, 1.0, 1),
+        ('BTC', 'SELL', None, 110.0, 1.0, 2),
+        ('BTC', 'SELL', None, 111.0, 1.0, 2),     # 同一时刻的两次平仓合并成一笔
+        ('ETH', 'BUY', None, 10.0, 1.0, 3),
+        ('ETH', 'SELL', None, 12.0, 1.0, 3),      # 同一时刻先开后平，按文件顺序
+    ])
+    assert rows(trades) == [
+        ('BTC', 'Long', 101.0, 110.5, 2.0, 19.0, at(0), at(2)),
+        ('ETH', 'Long', 10.0, 12.0, 1.0, 2.0, at(3), at(3)),
+    ]
+
+
+@pytest.mark.parametrize('hedge', [False, True])
+@pytest.mark.parametrize('seed', range(5))
+def test_random_fills_match_reference(seed, hedge):
+    rng = np.random.default_rng(seed)
+    n = 400
+    fills = [(f'S{rng.integers(3)}', 'BUY' if rng.random() < 0.5 else 'SELL',
+              ('LONG' if rng.random() < 0.5 else 'SHORT') if hedge else None,
+              float(rng.integers(90, 110)), float(rng.integers(1, 9)) / 2, int(rng.integers(0, 150)))
+             for _ in range(n)]
+    assert_matches_reference(fills)
+
+
+def test_split_legs():
+    symbol = np.array([0, 0, 0, 1], dtype=np.int64)
+    buy = np.array([1, -1, 1, -1], dtype=np.int8)
+    held = np.array([0, 0, 0, -1], dtype=np.int8)
+    qty = np.array([2, 5, 3, 4], dtype=np.int64)
+    row, side, is_open, legs = _split_legs(symbol, buy, held, qty)
+    # 第 2 行：平多 2 + 开空 3；第 3 行：平空 3；第 4 行：注明空头的卖出是开仓
+    assert row.tolist() == [0, 1, 1, 2, 3]
+    assert side.tolist() == [1, 1, -1, -1, -1]
+    assert is_open.tolist() == [True, False, True, False, True]
+    assert legs.tolist() == [2, 2, 3, 3, 4]
+
+
+def test_fifo_match():
+    book = np.array([0, 0, 0, 0, 1, 1])
+    is_open = np.array([True, True, False, False, False, True])
+    qty = np.array([3, 2, 4, 3, 5, 1])
+    oi, ci, seg, dropped = fifo_match(book, is_open, qty)
+    assert list(zip(oi.tolist(), ci.tolist(), seg.tolist())) == [(0, 2, 3), (1, 2, 1), (1, 3, 1)]
+    # 账户 0 多平了 2，账户 1 的平仓在开仓之前，5 全部对不上
+    assert dropped == 7
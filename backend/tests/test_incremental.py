@@ -0,0 +1,110 @@
+import json
+
+import pandas as pd
+import pytest
+
+from analyzer import analyze_csv_bytes, analyze_csv_bytes_timed
+from synthetic import generate_fills, generate_trades
+from parity import assert_same_json
+
+
+def csv(df):
+    return df.to_csv(index=False).encode()
+
+
+def incremental(old, new, chunk_rows=None):
+    """先分析旧导出，带着 (经过 JSON 往返的) 状态分析新导出"""
+    _, info = analyze_csv_bytes_timed(csv(old), chunk_rows=chunk_rows)
+    data, info = analyze_csv_bytes_timed(csv(new), chunk_rows=chunk_rows, state=json.loads(json.dumps(info['state'])))
+    assert info['base_trades'] > 0
+    return data
+
+
+def assert_matches_full(old, new, chunk_rows=None):
+    full = analyze_csv_bytes(csv(new))
+    data = incremental(old, new, chunk_rows)
+    assert_same_json(full, data)
+    # 浮点合计只有末位差别，笔数和连胜连败必须完全相同
+    assert data['vitals']['trade_count'] == full['vitals']['trade_count']
+    for key in ('max_win', 'max_loss'):
+        assert data['streaks'][key]['count'] == full['streaks'][key]['count']
+    return data
+
+
+def tied_trades(rows=4000, freq='6h', seed=0):
+    df = generate_trades(rows, symbols=5, seed=seed, sort_by='Closed')
+    df['Closed'] = pd.to_datetime(df['Closed']).dt.floor(freq).dt.strftime('%Y-%m-%d %H:%M:%S')
+    return df
+
+
+def trades(pnl, closed):
+    n = len(pnl)
+    return pd.DataFrame({
+        'Symbol': [f'S{i}' for i in range(n)],
+        'Side': ['Long'] * n,
+        'Entry Price': [1.0] * n,
+        'Avg. Close Price': [1.0] * n,
+        'Closed Vol.': [0.0] * n,
+        'Closing PNL': pnl,
+        'Opened': ['2024-01-01 00:00:00'] * n,
+        'Closed': closed,
+    })
+
+
+def test_descending_export_with_new_trades_at_the_old_last_close_time():
+    # 新导出是倒序的：与旧导出末笔同一时刻的新交易排在旧交易前面 (稳定排序后也在前面)
+    days = ['2024-01-01', '2024-01-02', '2024-01-02', '2024-01-02', '2024-01-03', '2024-01-04']
+    df = trades([5.0, -1.0, 2.0, -1.0, -1.0, -1.0], [d + ' 00:00:00' for d in days])
+    old, new = df.iloc[:3].iloc[::-1], df.iloc[::-1]
+    data = assert_matches_full(old, new)
+    # 全量：+5, -1(新), +2, -1, -1, -1 → 最长连败 3 笔
+    assert data['streaks']['max_loss']['count'] == 3
+
+
+def test_exchange_orders_ties_by_symbol():
+    # 同一时刻的交易按币种排列，新交易插在旧交易中间
+    df = trades([-1.0, -2.0, 3.0, -4.0, -5.0], ['2024-01-01 00:00:00'] + ['2024-01-02 00:00:00'] * 4)
+    df['Symbol'] = ['A', 'A', 'C', 'B', 'D']
+    old = df.iloc[[0, 1, 2]]
+    new = df.iloc[[0, 1, 3, 2, 4]]
+    data = assert_matches_full(old, new)
+    assert data['streaks']['max_loss']['count'] == 3
+
+
+def test_missing_close_times_added_on_top():
+    df = trades([2.0, 1.0, -1.0, -2.0, 3.0, -3.0],
+                ['2023-12-31 00:00:00', '2024-01-01 00:00:00', None, None, '2024-01-02 00:00:00', None])
+    old = df.iloc[[2, 3, 1, 0]]
+    new = df.iloc[[5, 4, 2, 3, 1, 0]]
+    assert_matches_full(old, new)
+
+
+@pytest.mark.parametrize('descending', [False, True])
+@pytest.mark.parametrize('chunk_rows', [None, 300])
+@pytest.mark.parametrize('seed', range(3))
+def test_random_tied_histories(seed, chunk_rows, descending):
+    df = tied_trades(seed=seed)
+    for cut in (900, 2500):
+        old, new = df.iloc[:cut], df
+        if descending:
+            old, new = old.iloc[::-1], new.iloc[::-1]
+        assert_matches_full(old, new, chunk_rows)
+
+
+def test_state_chain_over_growing_exports():
+    df = tied_trades(rows=3000, freq='1h', seed=5)
+    state = None
+    for cut in (700, 1400, 2100, 3000):
+        export = csv(df.iloc[:cut].iloc[::-1])
+        data, info = analyze_csv_bytes_timed(export, chunk_rows=250, state=state)
+        state = json.loads(json.dumps(info['state']))
+        assert_same_json(analyze_csv_bytes(export), data)
+
+
+@pytest.mark.parametrize('freq', [None, '1h'])
+def test_growing_fills_export(freq):
+    fills = generate_fills(20000, symbols=10, seed=3)
+    if freq:
+        fills['Date(UTC)'] = pd.to_datetime(fills['Date(UTC)']).dt.floor(freq).dt.strftime('%Y-%m-%d %H:%M:%S')
+    for cut in (5000, 12000, 17001):
+        assert_matches_full(fills.iloc[:cut], fills)
@@ -0,0 +1,244 @@
+import asyncio
+import time
+
+import pytest
+
+from llm_router import AllModelsFailedError, CircuitBreaker, ModelRouter
+
+
+class Text:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeModel:
+    """
+    桩模型：前 fail 次调用抛错，每次调用先等 delay 秒；
+    流式调用逐段产出 chunks，fail_after 不为 None 时产出这么多段后抛错。
+    """
+
+    def __init__(self, text='ok', fail=0, delay=0.0, chunks=('a', 'b'), fail_after=None):
+        self.text = text
+        self.fail = fail
+        self.delay = delay
+        self.chunks = chunks
+        self.fail_after = fail_after
+        self.calls = 0
+        self.cancelled = 0
+
+    async def generate_content_async(self, prompt, stream=False):
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if self.fail:
+            self.fail -= 1
+            raise RuntimeError('boom')
+        return self._stream() if stream else Text(self.text)
+
+    async def _stream(self):
+        for i, chunk in enumerate(self.chunks):
+            if self.fail_after is not None and i >= self.fail_after:
+                raise RuntimeError('stream broken')
+            yield Text(chunk)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def collect(router, timeout=5.0, **kwargs):
+    return [chunk async for chunk in router.stream('p', timeout, **kwargs)]
+
+
+def test_fails_over_to_next_model():
+    events = []
+    a, b = FakeModel('from a', fail=1), FakeModel('from b')
+    router = ModelRouter([('a', a), ('b', b)], observer=lambda name, seconds, error: events.append((name, error is None)))
+    assert run(router.generate('p', 5.0)) == ('from b', 'b')
+    assert events == [('a', False), ('b', True)]
+    assert router.routes[0].breaker.failures == 1
+
+
+def test_all_models_failing():
+    router = ModelRouter([('a', FakeModel(fail=1)), ('b', FakeModel(fail=1))])
+    with pytest.raises(AllModelsFailedError):
+        run(router.generate('p', 5.0))
+
+
+def test_stalled_primary_fails_over_without_hedging():
+    # 不开对冲：首选卡住，单次调用只占剩余时间的一半，超时后还来得及换备选
+    a, b = FakeModel(delay=10), FakeModel('from b', delay=0.01)
+    router = ModelRouter([('a', a), ('b', b)])
+    started = time.monotonic()
+    assert run(router.generate('p', 0.4)) == ('from b', 'b')
+    assert 0.2 <= time.monotonic() - started < 0.4
+    assert a.cancelled == 1
+    assert router.routes[0].stats.error_rate == 1.0
+
+
+def test_last_candidate_gets_the_whole_remaining_time():
+    a, b = FakeModel(delay=10), FakeModel('from b', delay=0.25)
+    router = ModelRouter([('a', a), ('b', b)], attempt_share=0.25)
+    # a 用掉 0.1s，b 拿到剩下的 0.3s，足够返回
+    assert run(router.generate('p', 0.4)) == ('from b', 'b')
+
+
+def test_all_candidates_stalled_times_out():
+    a, b = FakeModel(delay=10), FakeModel(delay=10)
+    router = ModelRouter([('a', a), ('b', b)])
+    started = time.monotonic()
+    with pytest.raises(asyncio.TimeoutError):
+        run(router.generate('p', 0.1))
+    assert time.monotonic() - started < 0.3
+    assert a.calls == b.calls == 1
+
+
+def test_breaker_opens_and_recovers_half_open():
+    clock = FakeClock()
+    a, b = FakeModel('from a', fail=2), FakeModel('from b')
+    # max_error_rate=1 关掉按错误率降级，单独看熔断器
+    router = ModelRouter([('a', a), ('b', b)], failure_threshold=2, cooldown=30.0, max_error_rate=1.0, clock=clock)
+    breaker = router.routes[0].breaker
+
+    assert run(router.generate('p', 5.0)) == ('from b', 'b')
+    assert breaker.state == 'closed'
+    assert run(router.generate('p', 5.0)) == ('from b', 'b')
+    assert breaker.state == 'open'
+
+    # 熔断期间不再调用 a
+    assert run(router.generate('p', 5.0)) == ('from b', 'b')
+    assert a.calls == 2
+    assert router.preferred == 'b'
+
+    # 冷却结束进入半开，试探请求成功后关闭
+    clock.now += 31
+    assert breaker.state == 'half_open'
+    assert run(router.generate('p', 5.0)) == ('from a', 'a')
+    assert breaker.state == 'closed' and breaker.failures == 0
+
+
+def test_failing_model_is_ranked_last_until_samples_expire():
+    clock = FakeClock()
+    a, b = FakeModel('from a', fail=1), FakeModel('from b')
+    router = ModelRouter([('a', a), ('b', b)], horizon=300.0, clock=clock)
+    assert run(router.generate('p', 5.0)) == ('from b', 'b')
+    assert run(router.generate('p', 5.0)) == ('from b', 'b')
+    assert a.calls == 1
+    clock.now += 301
+    assert run(router.generate('p', 5.0)) == ('from a', 'a')
+
+
+def test_half_open_trial_failure_reopens():
+    clock = FakeClock()
+    a = FakeModel(fail=2)
+    router = ModelRouter([('a', a), ('b', FakeModel('from b'))], failure_threshold=1, cooldown=30.0, clock=clock)
+    breaker = router.routes[0].breaker
+    run(router.generate('p', 5.0))
+    assert breaker.state == 'open'
+    clock.now += 301
+    assert breaker.state == 'half_open'
+    assert run(router.generate('p', 5.0)) == ('from b', 'b')
+    assert a.calls == 2
+    assert breaker.state == 'open'
+
+
+def test_half_open_allows_a_single_trial():
+    clock = FakeClock()
+    breaker = CircuitBreaker(threshold=1, cooldown=10.0, clock=clock)
+    breaker.failure()
+    assert not breaker.acquire()
+    clock.now += 11
+    assert breaker.acquire()
+    assert not breaker.acquire()
+    breaker.release()
+    assert breaker.acquire()
+
+
+def test_hedge_waits_for_the_delay():
+    # 首选在 hedge_after 之内返回：不发对冲请求
+    a, b = FakeModel('from a', delay=0.01), FakeModel('from b')
+    router = ModelRouter([('a', a), ('b', b)], hedge_after=0.2)
+    assert run(router.generate('p', 5.0)) == ('from a', 'a')
+    assert b.calls == 0
+
+
+def test_hedge_wins_and_cancels_the_primary():
+    a, b = FakeModel('from a', delay=5), FakeModel('from b', delay=0.01)
+    router = ModelRouter([('a', a), ('b', b)], hedge_after=0.05)
+    started = time.monotonic()
+    assert run(router.generate('p', 10.0)) == ('from b', 'b')
+    assert time.monotonic() - started < 1.0
+    assert a.cancelled == 1
+    # 被取消的首选不计成败，也不占着半开试探名额
+    primary = router.routes[0]
+    assert len(primary.stats.samples) == 0 and primary.breaker.failures == 0
+    assert not primary.breaker.trial_in_flight
+
+
+def test_hedge_falls_back_to_primary_when_hedge_fails():
+    a, b = FakeModel('from a', delay=0.1), FakeModel(fail=1)
+    router = ModelRouter([('a', a), ('b', b)], hedge_after=0.02)
+    assert run(router.generate('p', 5.0)) == ('from a', 'a')
+    assert b.calls == 1 and router.routes[1].breaker.failures == 1
+
+
+def test_slow_model_is_ranked_after_healthy_ones():
+    clock = FakeClock()
+    router = ModelRouter([('a', FakeModel()), ('b', FakeModel())], slow_p95=2.0, clock=clock)
+    router.routes[0].stats.record(5.0, True)
+    assert router.preferred == 'b'
+
+
+def test_stream_fails_over_before_first_chunk():
+    picked = []
+    a, b = FakeModel(fail=1), FakeModel(chunks=('x', 'y'))
+    router = ModelRouter([('a', a), ('b', b)])
+    assert run(collect(router, on_model=picked.append)) == ['x', 'y']
+    assert picked == ['b']
+    assert router.routes[0].breaker.failures == 1
+
+
+def test_stream_failing_on_first_chunk_fails_over():
+    a, b = FakeModel(fail_after=0), FakeModel(chunks=('x',))
+    router = ModelRouter([('a', a), ('b', b)])
+    assert run(collect(router)) == ['x']
+
+
+def test_stream_does_not_fail_over_after_first_chunk():
+    received = []
+    a, b = FakeModel(chunks=('x', 'y', 'z'), fail_after=1), FakeModel()
+
+    async def consume(router):
+        async for chunk in router.stream('p', 5.0):
+            received.append(chunk)
+
+    router = ModelRouter([('a', a), ('b', b)])
+    with pytest.raises(RuntimeError, match='stream broken'):
+        run(consume(router))
+    assert received == ['x']
+    assert b.calls == 0
+    assert router.routes[0].breaker.failures == 1
+
+
+def test_stream_stall_before_first_chunk_fails_over():
+    a, b = FakeModel(delay=10), FakeModel(chunks=('x',))
+    router = ModelRouter([('a', a), ('b', b)])
+    assert run(collect(router, timeout=0.2)) == ['x']
+    assert router.routes[0].breaker.failures == 1
+
+
+def test_stream_stall_of_the_last_candidate_times_out():
+    router = ModelRouter([('a', FakeModel(delay=10)), ('b', FakeModel(delay=10))])
+    with pytest.raises(asyncio.TimeoutError):
+        run(collect(router, timeout=0.1))
@@ -0,0 +1,91 @@
+import io
+
+import pandas as pd
+import pytest
+
+from analyzer import analyze_csv_bytes
+from schema import EXCHANGE_PROFILES, resolve_columns
+
+# 各交易所导出里方向列的写法 (profile 本身不含方向列)
+SIDE_HEADERS = {
+    'binance': ('Position Side', ['LONG', 'SHORT', 'SHORT', 'LONG', 'SHORT']),
+    'binance_pirce': ('Side', ['Long', 'Short', 'Short', 'Long', 'Short']),
+    'bybit': ('Side', ['Buy', 'Sell', 'Sell', 'Buy', 'Sell']),
+    'okx': ('Direction', ['long', 'short', 'short', 'long', 'short']),
+    'bitget': ('Direction', ['Long', 'Short', 'Short', 'Long', 'Short']),
+}
+
+STANDARD_VALUES = {
+    'Symbol': ['BTCUSDT', 'ETHUSDT', 'BTCUSDT', 'SOLUSDT', 'ETHUSDT'],
+    'Size': [1.0, 2.0, 1.0, 3.0, 2.0],
+    'Entry Price': [100.0, 50.0, 110.0, 20.0, 55.0],
+    'Avg. Close Price': [105.0, 48.0, 100.0, 21.0, 56.0],
+    'Closed Vol.': [1.0, 2.0, 1.0, 3.0, 2.0],
+    'Closing PNL': [5.0, 4.0, 10.0, 3.0, -2.0],
+    'Opened': ['2024-01-01 00:00:00', '2024-01-01 01:00:00', '2024-01-01 02:00:00',
+               '2024-01-01 03:00:00', '2024-01-01 04:00:00'],
+    'Closed': ['2024-01-01 00:30:00', '2024-01-01 01:30:00', '2024-01-01 02:30:00',
+               '2024-01-01 03:30:00', '2024-01-01 04:30:00'],
+}
+
+
+def profile_export(name):
+    header, sides = SIDE_HEADERS[name]
+    df = pd.DataFrame({src: STANDARD_VALUES[dst] for src, dst in EXCHANGE_PROFILES[name].items()})
+    df.insert(1, header, sides)
+    df['Leverage'] = 10
+    return df.to_csv(index=False).encode()
+
+
+@pytest.mark.parametrize('name', list(EXCHANGE_PROFILES))
+def test_profile_keeps_the_side_column(name):
+    header, _ = SIDE_HEADERS[name]
+    raw = profile_export(name)
+    resolution = resolve_columns(tuple(pd.read_csv(io.BytesIO(raw), nrows=0).columns))
+    assert resolution.exchange == name
+    assert resolution.rename.get(header, header) == 'Side'
+    direction = analyze_csv_bytes(raw)['direction']
+    assert direction['long']['count'] == 2
+    assert direction['short']['count'] == 3
+
+
+@pytest.mark.parametrize('name', list(EXCHANGE_PROFILES))
+def test_profile_side_with_polars_engine(name):
+    pytest.importorskip('polars')
+    raw = profile_export(name)
+    assert analyze_csv_bytes(raw, engine='polars') == analyze_csv_bytes(raw)
+
+
+def test_profile_columns_are_not_remapped_by_aliases():
+    # bybit 的 'Qty' 已由 profile 映射为平仓数量，不会再被别名匹配借走当作 Size
+    headers = tuple(EXCHANGE_PROFILES['bybit']) + ('Direction', 'Size')
+    rename = resolve_columns(headers).rename
+    assert rename['Qty'] == 'Closed Vol.'
+    assert 'Size' not in rename
+
+
+@pytest.mark.parametrize('headers, kind', [
+    # 简易仓位历史：没有开仓价 / 平仓时间，但有盈亏列，不能当成交明细
+    (('Symbol', 'Side', 'Size', 'Price', 'Time', 'PnL'), 'positions'),
+    (('Time', 'Symbol', 'Side', 'Price', 'Qty', 'Realized PnL'), 'positions'),
+    # 有成交编号，或没有盈亏列：成交明细
+    (('Symbol', 'Side', 'Size', 'Price', 'Time', 'PnL', 'Trade ID'), 'fills'),
+    (('Date(UTC)', 'Symbol', 'Side', 'Price', 'Quantity', 'Amount', 'Fee'), 'fills'),
+    (('Date(UTC)', 'Symbol', 'Side', 'Price', 'Quantity', 'Amount', 'Fee', 'Realized Profit'), 'fills'),
+])
+def test_fill_detection(headers, kind):
+    assert resolve_columns(headers).kind == kind
+
+
+def test_minimal_position_export_keeps_its_own_pnl():
+    df = pd.DataFrame({
+        'Symbol': ['BTC', 'BTC', 'ETH'],
+        'Side': ['Long', 'Short', 'Long'],
+        'Size': [1.0, 2.0, 3.0],
+        'Price': [100.0, 200.0, 10.0],
+        'Time': ['2024-01-01 00:00:00', '2024-01-01 01:00:00', '2024-01-01 02:00:00'],
+        'PnL': [10.0, -4.0, 7.0],
+    })
+    vitals = analyze_csv_bytes(df.to_csv(index=False).encode())['vitals']
+    assert vitals['trade_count'] == 3
+    assert vitals['gross_pnl'] == pytest.approx(13.0)
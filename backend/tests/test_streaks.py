@@ -0,0 +1,151 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from aggregates import TradeAggregate, run_lengths, longest_run
+
+
+def make_frame(pnl, symbols=None, closed=None):
+    """标准化后的明细 (手续费率按 0 算，净盈亏就是 Closing PNL)；closed 缺省为逐笔递增的时间"""
+    n = len(pnl)
+    symbols = ['BTC'] * n if symbols is None else symbols
+    if closed is None:
+        closed = pd.Timestamp('2024-01-01') + pd.to_timedelta(np.arange(n), unit='min')
+    closed = pd.Series(pd.to_datetime(closed), dtype='datetime64[ns]')
+    return pd.DataFrame({
+        'Symbol': pd.Categorical(symbols),
+        'Side': pd.Categorical(['Long'] * n),
+        'Entry Price': np.zeros(n),
+        'Avg. Close Price': np.zeros(n),
+        'Closed Vol.': np.zeros(n),
+        'Closing PNL': np.asarray(pnl, dtype=float),
+        'Opened': closed - pd.Timedelta(minutes=3),
+        'Closed': closed,
+    })
+
+
+def legacy_streaks(df):
+    """改写前 get_analysis_json 里的逐组循环实现 (原样保留，作为对照)"""
+    df = df.assign(**{'Net PnL': df['Closing PNL']})
+    df['Symbol'] = df['Symbol'].astype(object)
+    max_loss_streak = 0
+    max_loss_amount = 0
+    loss_culprits = []
+    max_win_streak = 0
+    max_win_amount = 0
+    win_heroes = []
+
+    if len(df) > 0:
+        df_sorted = df.sort_values('Closed')
+        df_sorted['result_sign'] = np.sign(df_sorted['Net PnL'])
+        df_sorted['group_id'] = (df_sorted['result_sign'] != df_sorted['result_sign'].shift()).cumsum()
+        streak_groups = df_sorted.groupby(['group_id', 'result_sign'])
+
+        for (gid, sign), group in streak_groups:
+            if sign == -1:
+                if len(group) > max_loss_streak:
+                    max_loss_streak = len(group)
+                    max_loss_amount = group['Net PnL'].sum()
+                    loss_culprits = group.groupby('Symbol')['Net PnL'].sum().sort_values().head(3).index.tolist()
+            elif sign == 1:
+                if len(group) > max_win_streak:
+                    max_win_streak = len(group)
+                    max_win_amount = group['Net PnL'].sum()
+                    win_heroes = group.groupby('Symbol')['Net PnL'].sum().sort_values(ascending=False).head(3).index.tolist()
+
+    return {
+        "max_win": {"count": int(max_win_streak), "amount": float(max_win_amount), "heroes": win_heroes},
+        "max_loss": {"count": int(max_loss_streak), "amount": float(max_loss_amount), "culprits": loss_culprits},
+    }
+
+
+def vectorized_streaks(df):
+    return TradeAggregate.from_frame(df, fee_rate=0.0).to_json()['streaks']
+
+
+def assert_same(df):
+    expected, actual = legacy_streaks(df), vectorized_streaks(df)
+    for key, names in (('max_win', 'heroes'), ('max_loss', 'culprits')):
+        assert actual[key]['count'] == expected[key]['count']
+        assert actual[key]['amount'] == pytest.approx(expected[key]['amount'], rel=1e-12, abs=1e-12)
+        assert actual[key][names] == expected[key][names]
+    return actual
+
+
+def test_empty_frame():
+    actual = assert_same(make_frame([]))
+    assert actual['max_win'] == {"count": 0, "amount": 0.0, "heroes": []}
+    assert actual['max_loss'] == {"count": 0, "amount": 0.0, "culprits": []}
+
+
+@pytest.mark.parametrize('pnl', [[5.0], [-5.0], [0.0]])
+def test_single_row(pnl):
+    assert_same(make_frame(pnl))
+
+
+def test_all_wins():
+    actual = assert_same(make_frame([1, 2, 3, 4], ['A', 'B', 'A', 'C']))
+    assert actual['max_win']['count'] == 4
+    assert actual['max_win']['heroes'] == ['A', 'C', 'B']
+    assert actual['max_loss']['count'] == 0
+
+
+def test_all_losses():
+    actual = assert_same(make_frame([-1, -2, -3], ['A', 'B', 'B']))
+    assert actual['max_loss']['count'] == 3
+    assert actual['max_loss']['culprits'] == ['B', 'A']
+    assert actual['max_win']['count'] == 0
+
+
+def test_equal_length_runs_keep_the_earliest():
+    # 两段连胜 / 两段连败一样长，取时间上最早的一段
+    actual = assert_same(make_frame([1, 1, -1, -1, 2, 2, -2, -2], ['A', 'A', 'B', 'B', 'C', 'C', 'D', 'D']))
+    assert actual['max_win'] == {"count": 2, "amount": 2.0, "heroes": ['A']}
+    assert actual['max_loss'] == {"count": 2, "amount": -2.0, "culprits": ['B']}
+
+
+def test_zero_pnl_breaks_runs():
+    # 盈亏为 0 的交易既不算胜也不算负，但会打断连胜 / 连败
+    actual = assert_same(make_frame([1, 1, 0, 1, 1, 1, 0, 0, -1, 0, -1, -1]))
+    assert actual['max_win']['count'] == 3
+    assert actual['max_loss']['count'] == 2
+
+
+def test_all_zero():
+    actual = assert_same(make_frame([0, 0, 0]))
+    assert actual['max_win']['count'] == 0 and actual['max_loss']['count'] == 0
+
+
+def test_unsorted_rows_are_ordered_by_close_time():
+    closed = pd.to_datetime(['2024-01-03', '2024-01-01', '2024-01-02', '2024-01-04'])
+    actual = assert_same(make_frame([-1, 1, 1, -1], closed=closed))
+    assert actual['max_win']['count'] == 2
+
+
+def test_missing_close_time_sorts_last():
+    closed = pd.to_datetime(['2024-01-02', None, '2024-01-01'])
+    assert_same(make_frame([1, -1, 1], closed=closed))
+
+
+@pytest.mark.parametrize('seed', range(30))
+def test_random_histories(seed):
+    rng = np.random.default_rng(seed)
+    n = int(rng.integers(1, 400))
+    # 小整数盈亏：大量等长的区间和 0 盈亏；再混一些浮点数
+    pnl = rng.choice([-2.0, -1.0, 0.0, 1.0, 2.0], size=n)
+    pnl[rng.random(n) < 0.3] *= rng.random() * 10
+    symbols = rng.choice(['BTC', 'ETH', 'SOL', 'DOGE'], size=n)
+    closed = pd.Timestamp('2024-01-01') + pd.to_timedelta(rng.permutation(n), unit='min')
+    assert_same(make_frame(pnl, symbols, closed))
+
+
+def test_run_lengths_kernel():
+    starts, lengths, signs = run_lengths(np.sign([1.0, 2.0, 0.0, -1.0, -3.0, -1.0, 4.0]))
+    assert starts.tolist() == [0, 2, 3, 6]
+    assert lengths.tolist() == [2, 1, 3, 1]
+    assert signs.tolist() == [1, 0, -1, 1]
+    assert longest_run(starts, lengths, signs, -1) == (3, 6)
+    assert longest_run(starts, lengths, signs, 1) == (0, 2)
+    empty = run_lengths(np.empty(0))
+    assert all(len(part) == 0 for part in empty)
+    assert longest_run(*empty, 1) is None
@@ -0,0 +1,84 @@
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from analyzer import analyze_csv_bytes, read_trades_csv, StreamingTradeAnalyzer
+from aggregates import UnorderedStreamError
+from synthetic import generate_trades
+from parity import assert_same_json
+
+
+def tied_csv(rows=6000, freq='10min', descending=False, seed=1):
+    """按平仓时间排序的合成交易，平仓时间取整到 freq，大量交易平仓时间相同"""
+    df = generate_trades(rows, symbols=20, seed=seed, sort_by='Closed')
+    closed = pd.to_datetime(df['Closed']).dt.floor(freq)
+    df['Closed'] = closed.dt.strftime('%Y-%m-%d %H:%M:%S')
+    if descending:
+        df = df.iloc[::-1]
+    return df.to_csv(index=False).encode()
+
+
+@pytest.mark.parametrize('descending', [False, True])
+@pytest.mark.parametrize('chunk_rows', [97, 1000, 4000])
+def test_chunked_matches_whole_with_tied_close_times(descending, chunk_rows):
+    raw = tied_csv(descending=descending)
+    assert_same_json(analyze_csv_bytes(raw), analyze_csv_bytes(raw, chunk_rows=chunk_rows))
+
+
+def test_descending_tie_split_across_chunks():
+    # 倒序导出，t=2 的两笔并列交易被分在两块里：整表稳定排序时按文件顺序 (先亏后赚) 排列
+    raw = pd.DataFrame({
+        'Symbol': ['C', 'X', 'B', 'A'],
+        'Side': ['Long'] * 4,
+        'Entry Price': [1.0] * 4,
+        'Avg. Close Price': [1.0] * 4,
+        'Closed Vol.': [0.0] * 4,
+        'Closing PNL': [4.0, -1.0, 2.0, 1.0],
+        'Opened': ['2024-01-01 00:00:00'] * 4,
+        'Closed': ['2024-01-03 00:00:00', '2024-01-02 00:00:00', '2024-01-02 00:00:00', '2024-01-01 00:00:00'],
+    }).to_csv(index=False).encode()
+    whole = analyze_csv_bytes(raw)
+    assert whole['streaks']['max_win'] == {"count": 2, "amount": 6.0, "heroes": ['C', 'B']}
+    assert_same_json(whole, analyze_csv_bytes(raw, chunk_rows=2))
+
+
+def test_tie_group_longer_than_a_chunk():
+    # 一整天的交易都按同一个平仓时刻导出，并列的一组比块大得多
+    raw = tied_csv(rows=3000, freq='1D')
+    assert_same_json(analyze_csv_bytes(raw), analyze_csv_bytes(raw, chunk_rows=50))
+
+
+def test_missing_close_times():
+    df = generate_trades(3000, symbols=10, seed=2, sort_by='Closed')
+    df['Closed'] = pd.to_datetime(df['Closed']).dt.floor('30min').dt.strftime('%Y-%m-%d %H:%M:%S')
+    df.loc[df.index[::37], 'Closed'] = None
+    raw = df.to_csv(index=False).encode()
+    assert_same_json(analyze_csv_bytes(raw), analyze_csv_bytes(raw, chunk_rows=200))
+
+
+def test_streaming_does_not_fall_back_on_sorted_exports():
+    raw = tied_csv(rows=2000)
+    chunks = read_trades_csv(io.BytesIO(raw), chunksize=300)
+    analyzer = StreamingTradeAnalyzer(chunks)
+    assert analyzer.get_aggregate().trade_count == 2000
+
+
+def test_unsorted_export_falls_back_to_whole_table():
+    raw = generate_trades(3000, symbols=10, seed=3).to_csv(index=False).encode()
+    with pytest.raises(UnorderedStreamError):
+        StreamingTradeAnalyzer(read_trades_csv(io.BytesIO(raw), chunksize=500))
+    assert_same_json(analyze_csv_bytes(raw), analyze_csv_bytes(raw, chunk_rows=500))
+
+
+def test_streak_counts_are_exact():
+    # 浮点合计只有末位差别，连胜连败的笔数、金额来源的币种必须完全相同
+    raw = tied_csv(rows=8000, freq='10min', seed=7)
+    whole = analyze_csv_bytes(raw)['streaks']
+    for chunk_rows in (333, 2500):
+        streamed = analyze_csv_bytes(raw, chunk_rows=chunk_rows)['streaks']
+        for key in ('max_win', 'max_loss'):
+            assert streamed[key]['count'] == whole[key]['count']
+        assert streamed['max_win']['heroes'] == whole['max_win']['heroes']
+        assert streamed['max_loss']['culprits'] == whole['max_loss']['culprits']
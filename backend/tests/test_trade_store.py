@@ -0,0 +1,174 @@
+import json
+import os
+import time
+
+import pandas as pd
+import pytest
+
+pytest.importorskip('pyarrow')
+
+from analyzer import STORED_COLUMNS, analyze_csv_bytes, analyze_csv_bytes_timed, reanalyze_stored
+from synthetic import generate_trades
+from trade_store import TradeStore
+from parity import assert_same_json
+
+KEY = 'a' * 64
+OTHER = 'b' * 64
+
+
+def csv(df):
+    return df.to_csv(index=False).encode()
+
+
+def frame(symbols, start=0):
+    n = len(symbols)
+    closed = pd.date_range('2024-01-01', periods=n, freq='h') + pd.Timedelta(hours=start)
+    return pd.DataFrame({
+        'Symbol': pd.Categorical(symbols),
+        'Side': pd.Categorical(['Long', 'Short'] * (n // 2) + ['Long'] * (n % 2)),
+        'Entry Price': [1.0] * n,
+        'Avg. Close Price': [1.5] * n,
+        'Closed Vol.': [2.0] * n,
+        'Closing PNL': [float(i) - 1 for i in range(n)],
+        'Opened': closed - pd.Timedelta(minutes=5),
+        'Closed': closed,
+    })
+
+
+@pytest.fixture
+def store(tmp_path):
+    return TradeStore(str(tmp_path), max_entries=3)
+
+
+def files(store, suffix):
+    return sorted(name for name in os.listdir(store.directory) if name.endswith(suffix))
+
+
+def test_save_and_load(store):
+    df = frame(['BTC', 'ETH', 'BTC'])
+    store.save(KEY, df)
+    assert store.exists(KEY)
+    pd.testing.assert_frame_equal(store.load(KEY), df)
+    assert list(store.load(KEY, ['Closed', 'Symbol']).columns) == ['Closed', 'Symbol']
+    assert store.load(OTHER) is None
+    assert files(store, '.tmp') == []
+
+
+def test_expired_entries_are_not_loaded(tmp_path):
+    store = TradeStore(str(tmp_path), ttl=60)
+    store.save(KEY, frame(['BTC']))
+    old = time.time() - 120
+    os.utime(store._path(KEY), (old, old))
+    assert not store.exists(KEY)
+    assert store.load(KEY) is None
+
+
+def test_prune_keeps_the_newest_entries(store):
+    keys = [c * 64 for c in 'abcde']
+    for i, key in enumerate(keys):
+        store.save(key, frame(['BTC']))
+        os.utime(store._path(key), (1_000_000 + i, 1_000_000 + i))
+    assert files(store, '.arrow') == [f'{key}.arrow' for key in keys[-3:]]
+
+
+def test_disabled_store(tmp_path):
+    store = TradeStore(None)
+    store.save(KEY, frame(['BTC']))
+    assert not store.enabled and store.load(KEY) is None
+
+
+def test_writer_appends_chunks_with_different_categories(store):
+    parts = [frame(['BTC', 'ETH']), frame(['SOL', 'ADA', 'BTC'], start=2)]
+    with store.writer(KEY) as sink:
+        for part in parts:
+            sink.write(part)
+    loaded = store.load(KEY)
+    expected = pd.concat(parts, ignore_index=True)
+    assert loaded['Symbol'].tolist() == expected['Symbol'].astype(str).tolist()
+    pd.testing.assert_frame_equal(loaded.drop(columns=['Symbol', 'Side']), expected.drop(columns=['Symbol', 'Side']))
+    assert files(store, '.tmp') == []
+
+
+def test_writer_discards_the_file_on_error(store):
+    with pytest.raises(RuntimeError):
+        with store.writer(KEY) as sink:
+            sink.write(frame(['BTC']))
+            raise RuntimeError('stop')
+    assert not store.exists(KEY)
+    assert files(store, '.tmp') == []
+
+
+def assert_reanalysis_matches(store, key, raw):
+    data, _ = reanalyze_stored(store, key)
+    assert_same_json(analyze_csv_bytes(raw), data)
+
+
+@pytest.mark.parametrize('chunk_rows', [None, 500])
+def test_every_load_path_stores_the_trades(store, chunk_rows):
+    raw = csv(generate_trades(3000, symbols=12, seed=1, sort_by='Closed'))
+    analyze_csv_bytes_timed(raw, chunk_rows=chunk_rows, store=store, store_key=KEY)
+    assert list(store.load(KEY).columns) == STORED_COLUMNS
+    assert_reanalysis_matches(store, KEY, raw)
+
+
+def test_streaming_fallback_stores_the_whole_table(store):
+    # 没按平仓时间排序：流式分析中途回退整表模式，半截的分块缓存被丢弃，由整表模式重新保存
+    raw = csv(generate_trades(3000, symbols=12, seed=2, sort_by='Opened'))
+    analyze_csv_bytes_timed(raw, chunk_rows=500, store=store, store_key=KEY)
+    assert len(store.load(KEY)) == 3000
+    assert_reanalysis_matches(store, KEY, raw)
+    assert files(store, '.tmp') == []
+
+
+@pytest.mark.parametrize('chunk_rows', [None, 500])
+def test_incremental_upload_stores_old_and_new_trades(store, chunk_rows):
+    df = generate_trades(4000, symbols=12, seed=3, sort_by='Closed')
+    old, new = csv(df.iloc[:2500]), csv(df)
+    _, info = analyze_csv_bytes_timed(old, chunk_rows=chunk_rows, store=store, store_key=OTHER)
+    state = json.loads(json.dumps(info['state']))
+    _, info = analyze_csv_bytes_timed(new, chunk_rows=chunk_rows, state=state, store=store, store_key=KEY,
+                                      state_id=OTHER)
+    assert info['base_trades'] > 0
+    assert len(store.load(KEY)) == 4000
+    assert_reanalysis_matches(store, KEY, new)
+
+
+def test_incremental_upload_without_old_trades_is_not_stored(store):
+    df = generate_trades(2000, symbols=12, seed=4, sort_by='Closed')
+    _, info = analyze_csv_bytes_timed(csv(df.iloc[:1000]))
+    analyze_csv_bytes_timed(csv(df), state=info['state'], store=store, store_key=KEY, state_id=OTHER)
+    assert not store.exists(KEY)
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    pytest.importorskip('fastapi.testclient')
+    import main
+    from benchmark import StubModel
+    from cache import ResultCache
+    from fastapi.testclient import TestClient
+    monkeypatch.setattr(main, 'result_cache', ResultCache(max_entries=16))
+    monkeypatch.setattr(main, 'report_cache', ResultCache(max_entries=16))
+    monkeypatch.setattr(main, 'trade_store', TradeStore(str(tmp_path / 'trades')))
+    # 所有上传都走分块流式模式
+    monkeypatch.setattr(main, 'STREAMING_MIN_BYTES', 0)
+    monkeypatch.setattr(main, 'CHUNK_ROWS', 400)
+    with TestClient(main.app) as c:
+        main.models.use(StubModel(), 'stub')
+        yield c
+
+
+def test_reanalyze_after_streaming_upload(client):
+    raw = csv(generate_trades(2000, symbols=8, seed=5, sort_by='Closed'))
+    result = client.post('/analyze', files={'file': ('t.csv', raw, 'text/csv')}).json()
+    assert result['stored'] is True
+
+    response = client.post('/reanalyze', json={'dataset_id': result['state_id'], 'fee_rate': 0.0005})
+    assert response.status_code == 200
+    # /analyze 的 raw_data 另带组装 Prompt 时生成的 meta
+    expected = {k: v for k, v in result['raw_data'].items() if k != 'meta'}
+    assert_same_json(expected, response.json()['raw_data'])
+
+    response = client.post('/reanalyze', json={'dataset_id': OTHER})
+    assert response.status_code == 404
+    assert '明细缓存' in response.json()['error']
@@ -0,0 +1,166 @@
+import asyncio
+import gzip
+import io
+import os
+import struct
+import zipfile
+
+import pytest
+
+from analyzer import analyze_csv_bytes
+from synthetic import generate_trades
+from uploads import LimitedReader, UploadTooLargeError, decompress_upload, save_upload
+
+MB = 1024 * 1024
+
+
+class FakeUpload:
+    """最小的 UploadFile：按块异步读取"""
+
+    def __init__(self, data, filename='t.csv', size=None):
+        self.stream = io.BytesIO(data)
+        self.filename = filename
+        self.size = size
+
+    async def read(self, n=-1):
+        return self.stream.read(n)
+
+
+def save(tmp_path, data, max_bytes=0, max_csv_bytes=0):
+    return asyncio.run(save_upload(FakeUpload(data), str(tmp_path), max_bytes, max_csv_bytes))
+
+
+def leftovers(tmp_path):
+    return sorted(os.listdir(tmp_path))
+
+
+def csv(n=2000, seed=1):
+    return generate_trades(n, symbols=8, seed=seed).to_csv(index=False).encode()
+
+
+def gzip_bomb(size, declared):
+    """size 字节的 0 压缩成 gzip，尾部的 ISIZE 改写成 declared"""
+    data = gzip.compress(b'0' * size)
+    return data[:-4] + struct.pack('<I', declared)
+
+
+def test_limited_reader_counts_and_stops():
+    reader = LimitedReader(io.BytesIO(b'x' * 10), limit=8)
+    assert reader.read(5) == b'x' * 5 and reader.count == 5
+    with pytest.raises(UploadTooLargeError):
+        reader.read(5)
+
+
+def test_plain_csv(tmp_path):
+    raw = csv()
+    upload = save(tmp_path, raw)
+    assert upload.size == upload.csv_size == len(raw)
+    with open(upload.path, 'rb') as f:
+        assert f.read() == raw
+
+
+@pytest.mark.parametrize('pack', ['gzip', 'zip'])
+def test_archive_is_decompressed_with_counted_size(tmp_path, pack):
+    raw = csv()
+    if pack == 'gzip':
+        data = gzip.compress(raw)
+    else:
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr('trades.csv', raw)
+        data = buffer.getvalue()
+    upload = save(tmp_path, data, max_csv_bytes=len(raw))
+    assert upload.size == len(data)
+    assert upload.csv_size == len(raw)
+    # 压缩包已删除，只剩解压出的 CSV；key 仍是上传内容的哈希
+    assert leftovers(tmp_path) == [os.path.basename(upload.path)]
+    assert analyze_csv_bytes(upload.path) == analyze_csv_bytes(raw)
+
+
+def test_gzip_bomb_with_forged_isize_is_rejected(tmp_path):
+    # ISIZE 声称只有 1KB (或按 2^32 回绕后的值)，实际解压出 8MB
+    for declared in (1024, (8 * MB) % (1 << 32)):
+        with pytest.raises(UploadTooLargeError, match='解压后'):
+            save(tmp_path, gzip_bomb(8 * MB, declared), max_csv_bytes=2 * MB)
+        assert leftovers(tmp_path) == []
+
+
+def test_zip_with_forged_declared_size_is_rejected(tmp_path):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('trades.csv', b'0' * (8 * MB))
+    data = bytearray(buffer.getvalue())
+    # 把本地文件头和中央目录里的解压大小都改成 1KB
+    for signature, offset in ((b'PK\x03\x04', 22), (b'PK\x01\x02', 24)):
+        start = data.find(signature)
+        data[start + offset:start + offset + 4] = struct.pack('<I', 1024)
+    with pytest.raises((UploadTooLargeError, ValueError)):
+        save(tmp_path, bytes(data), max_csv_bytes=2 * MB)
+    assert leftovers(tmp_path) == []
+
+    with pytest.raises(UploadTooLargeError):
+        save(tmp_path, buffer.getvalue(), max_csv_bytes=2 * MB)
+    assert leftovers(tmp_path) == []
+
+
+def test_corrupt_archive(tmp_path):
+    data = gzip.compress(csv())[:200]
+    with pytest.raises(ValueError, match='无法解压'):
+        save(tmp_path, data)
+    assert leftovers(tmp_path) == []
+
+
+def test_decompress_without_limit(tmp_path):
+    path = tmp_path / 'big.gz'
+    path.write_bytes(gzip.compress(b'0' * (3 * MB)))
+    csv_path, size = decompress_upload(str(path), 'gzip', directory=str(tmp_path))
+    assert size == os.path.getsize(csv_path) == 3 * MB
+
+    # 不限大小时，伪造的 ISIZE 在读到 gzip 尾部时才被发现
+    path.write_bytes(gzip_bomb(3 * MB, 1))
+    with pytest.raises(ValueError, match='无法解压'):
+        decompress_upload(str(path), 'gzip', directory=str(tmp_path))
+    assert leftovers(tmp_path) == ['big.gz', os.path.basename(csv_path)]
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    pytest.importorskip('fastapi.testclient')
+    import main
+    from benchmark import StubModel
+    from cache import ResultCache
+    from fastapi.testclient import TestClient
+    monkeypatch.setattr(main, 'result_cache', ResultCache(max_entries=16))
+    monkeypatch.setattr(main, 'report_cache', ResultCache(max_entries=16))
+    monkeypatch.setattr(main, 'UPLOAD_DIR', str(tmp_path))
+    with TestClient(main.app) as c:
+        main.models.use(StubModel(), 'stub')
+        yield c, main
+
+
+@pytest.mark.parametrize('endpoint', ['/analyze', '/analyze/stream'])
+def test_gzip_bomb_endpoint(client, monkeypatch, tmp_path, endpoint):
+    c, main = client
+    monkeypatch.setattr(main, 'MAX_CSV_BYTES', 2 * MB)
+    response = c.post(endpoint, files={'file': ('t.csv.gz', gzip_bomb(8 * MB, 1024), 'application/gzip')})
+    assert response.status_code == 413
+    assert '解压后' in response.json()['error']
+    assert leftovers(tmp_path) == []
+
+
+def test_streaming_mode_uses_counted_size(client, monkeypatch):
+    c, main = client
+    raw = csv(3000, seed=2)
+    # 压缩后远小于门槛，解压后超过：按实际解压出的大小走分块流式
+    monkeypatch.setattr(main, 'STREAMING_MIN_BYTES', len(raw) - 1)
+    seen = []
+    run = main.analysis_pool.run
+
+    async def spy(fn, path, chunk_rows, *args):
+        seen.append(chunk_rows)
+        return await run(fn, path, chunk_rows, *args)
+
+    monkeypatch.setattr(main.analysis_pool, 'run', spy)
+    response = c.post('/analyze', files={'file': ('t.csv.gz', gzip.compress(raw), 'application/gzip')})
+    assert response.status_code == 200
+    assert seen == [main.CHUNK_ROWS]
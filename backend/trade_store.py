@@ -0,0 +1,189 @@
+import os
+import tempfile
+import time
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as ipc
+except ImportError:  # pyarrow 是可选依赖，没装时列式缓存整体关闭
+    pa = None
+    ipc = None
+
+
+class TradeStore:
+    """
+    标准化后的交易明细缓存：按上传文件哈希存成一个不压缩的 Arrow IPC (Feather v2) 文件。
+    同一份数据换手续费率 / 时间窗口重新分析时，直接内存映射读取需要的列，
+    不再重新解析 CSV、清洗数字和解析时间。
+
+    目录为空或没有安装 pyarrow 时不启用 (save 直接跳过，load 返回 None)。
+    对象本身只有目录和上限两个字段，可以传给进程池里的 worker。
+    """
+
+    def __init__(self, directory=None, max_entries=256, ttl=7 * 24 * 3600):
+        self.directory = directory if pa is not None else None
+        self.max_entries = max_entries
+        self.ttl = ttl
+        if directory and pa is None:
+            print("[WARN] ⚠️ 未安装 pyarrow，交易明细列式缓存已关闭")
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+    @property
+    def enabled(self):
+        return bool(self.directory)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.arrow")
+
+    def exists(self, key):
+        if not self.enabled:
+            return False
+        path = self._path(key)
+        try:
+            created = os.path.getmtime(path)
+        except OSError:
+            return False
+        return not (self.ttl > 0 and time.time() - created > self.ttl)
+
+    def _temp_path(self, key):
+        # 每次写入一个独立的临时文件：多个 worker 同时写同一个 key 时不会写进同一个文件
+        fd, tmp = tempfile.mkstemp(prefix=f"{key}.", suffix='.tmp', dir=self.directory)
+        os.close(fd)
+        return tmp
+
+    def save(self, key, df):
+        if not self.enabled:
+            return
+        tmp = None
+        try:
+            tmp = self._temp_path(key)
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            # 不压缩：读取时才能零拷贝地内存映射
+            with pa.OSFile(tmp, 'wb') as sink:
+                with ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+            os.replace(tmp, self._path(key))
+        except (OSError, pa.ArrowException) as e:
+            print(f"[WARN] ⚠️ 交易明细缓存写入失败: {e}")
+            if tmp is not None:
+                self._remove(tmp)
+            return
+        self._prune()
+
+    def writer(self, key):
+        """分块写入 (流式分析用)：返回 TradeStoreWriter，每块明细处理完就追加写入，不在内存里攒整张表"""
+        return TradeStoreWriter(self, key)
+
+    def load(self, key, columns=None):
+        """
+        内存映射读取，只取 columns 里的列 (None 为全部)。数值列直接引用映射的页面，
+        只有真正用到的部分才会从磁盘读入。缓存不存在或已过期时返回 None。
+        """
+        if not self.exists(key):
+            return None
+        try:
+            with pa.memory_map(self._path(key), 'r') as source:
+                table = ipc.open_file(source).read_all()
+                if columns is not None:
+                    table = table.select([c for c in columns if c in table.column_names])
+                return table.to_pandas(split_blocks=True)
+        except (OSError, pa.ArrowException) as e:
+            print(f"[WARN] ⚠️ 交易明细缓存读取失败: {e}")
+            return None
+
+    def _prune(self):
+        files = [os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith('.arrow')]
+        if len(files) <= self.max_entries:
+            return
+        files.sort(key=lambda p: os.path.getmtime(p) if os.path.exists(p) else 0)
+        for path in files[:len(files) - self.max_entries]:
+            self._remove(path)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class TradeStoreWriter:
+    """
+    把标准化明细逐块追加进一个 Arrow IPC 文件，作为上下文管理器使用：
+    正常退出时原子替换成正式的缓存文件；块内抛出异常 (如流式分析回退整表) 时丢弃临时文件。
+    写入失败只打印警告并停止写入，不影响分析本身。
+
+    各块的类别 (币种 / 方向) 不同，IPC 文件里又不能替换字典，category 列统一按普通字符串写入。
+    """
+
+    def __init__(self, store, key):
+        self.store = store
+        self.key = key
+        self.tmp = None
+        self.sink = None
+        self.writer = None
+        self.schema = None
+        self.failed = False
+        self.rows = 0
+
+    def write(self, df):
+        if self.failed or len(df) == 0:
+            return
+        try:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if self.writer is None:
+                self.schema = pa.schema([
+                    f.with_type(f.type.value_type) if pa.types.is_dictionary(f.type) else f for f in table.schema
+                ])
+                self.tmp = self.store._temp_path(self.key)
+                self.sink = pa.OSFile(self.tmp, 'wb')
+                self.writer = ipc.new_file(self.sink, self.schema)
+            self.writer.write_table(table.cast(self.schema))
+            self.rows += len(df)
+        except (OSError, pa.ArrowException) as e:
+            print(f"[WARN] ⚠️ 交易明细缓存写入失败: {e}")
+            self.failed = True
+            self._close()
+
+    def _close(self):
+        try:
+            if self.writer is not None:
+                self.writer.close()
+            if self.sink is not None:
+                self.sink.close()
+        except (OSError, pa.ArrowException):
+            self.failed = True
+        self.writer = self.sink = None
+
+    def abort(self):
+        self._close()
+        if self.tmp is not None:
+            self.store._remove(self.tmp)
+            self.tmp = None
+
+    def commit(self):
+        """写完：替换成正式缓存文件，返回是否保存成功 (一行都没写时不保存)"""
+        self._close()
+        if self.failed or self.tmp is None:
+            self.abort()
+            return False
+        try:
+            os.replace(self.tmp, self.store._path(self.key))
+        except OSError as e:
+            print(f"[WARN] ⚠️ 交易明细缓存写入失败: {e}")
+            self.abort()
+            return False
+        self.tmp = None
+        self.store._prune()
+        return True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
+        return False
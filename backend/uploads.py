@@ -0,0 +1,147 @@
+import io
+import os
+import gzip
+import zlib
+import shutil
+import asyncio
+import hashlib
+import zipfile
+import tempfile
+
+from schema import detect_compression
+
+# 从上传流里每次拷贝的字节数
+UPLOAD_CHUNK = 1024 * 1024
+
+
+class UploadTooLargeError(ValueError):
+    """上传文件 (或压缩包解压后的 CSV) 超过大小上限"""
+
+
+class SavedUpload:
+    """
+    落盘后的上传文件：path 直接交给解析 (进程池里按路径读取)，key 与 content_key(上传的内容) 相同。
+    size 为上传的字节数，csv_size 为 CSV 的实际大小：压缩包在落盘时已经解压成 path 指向的 CSV，
+    csv_size 是解压时实际读出的字节数 (不信任包里自己声明的大小)。
+    """
+
+    def __init__(self, path, key, size, filename=None, csv_size=None):
+        self.path = path
+        self.key = key
+        self.size = size
+        self.filename = filename
+        self.csv_size = size if csv_size is None else csv_size
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class LimitedReader(io.RawIOBase):
+    """
+    包在解压流外面的只读流：累计实际解压出的字节数，超过 limit (0 为不限) 立即抛出 UploadTooLargeError。
+    gzip 尾部的 ISIZE 和 zip 目录里的 file_size 都由上传者决定 (ISIZE 还会按 2^32 回绕)，只能边解压边数。
+    """
+
+    def __init__(self, raw, limit=0):
+        self.raw = raw
+        self.limit = limit
+        self.count = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        n = self.raw.readinto(buffer)
+        self.count += n or 0
+        if self.limit and self.count > self.limit:
+            raise UploadTooLargeError(f"解压后的 CSV 超过 {self.limit / (1024 * 1024):g}MB 上限")
+        return n
+
+
+def _open_member(path, compression):
+    """打开压缩包里的 CSV (zip 取第一个文件，与 polars 引擎读 zip 的规则相同)"""
+    if compression == 'gzip':
+        return gzip.open(path, 'rb')
+    archive = zipfile.ZipFile(path)
+    members = [info for info in archive.infolist() if not info.is_dir()]
+    if not members:
+        archive.close()
+        raise ValueError("zip 压缩包里没有文件")
+    # 关闭包内文件时一并关闭压缩包
+    member = archive.open(members[0])
+    close = member.close
+
+    def close_all():
+        close()
+        archive.close()
+
+    member.close = close_all
+    return member
+
+
+def decompress_upload(path, compression, max_csv_bytes=0, directory=None):
+    """
+    把 gzip / zip 上传解压成同目录下的普通 CSV，解压出的字节超过 max_csv_bytes 立即停止。
+    返回 (CSV 路径, 实际解压出的字节数)；出错时不留下半截文件。
+    """
+    fd, csv_path = tempfile.mkstemp(prefix="upload-", suffix=".csv", dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as out, _open_member(path, compression) as member:
+            reader = LimitedReader(member, max_csv_bytes)
+            shutil.copyfileobj(reader, out, UPLOAD_CHUNK)
+        return csv_path, reader.count
+    # zip 加密 (RuntimeError) 或不支持的压缩算法 (NotImplementedError) 同样按无法解压处理
+    except (OSError, EOFError, RuntimeError, NotImplementedError, zlib.error, zipfile.BadZipFile) as e:
+        _remove(csv_path)
+        raise ValueError(f"压缩包无法解压: {e}") from e
+    except BaseException:
+        _remove(csv_path)
+        raise
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+async def save_upload(file, directory=None, max_bytes=0, max_csv_bytes=0):
+    """
+    把 UploadFile 按 1MB 分块拷到 directory 下的临时文件，边拷边算内容哈希，不在内存里拼出整个文件。
+    超过 max_bytes 立即停止并抛出 UploadTooLargeError。gzip / zip 压缩包随后在线程里边解压边计数，
+    解压成普通 CSV (path 指向它，压缩包删除)，解压出的字节超过 max_csv_bytes 同样拒绝 (0 为不限)。
+    调用方用完后负责 remove()。
+    """
+    if max_bytes and file.size is not None and file.size > max_bytes:
+        raise UploadTooLargeError(f"文件超过 {max_bytes / (1024 * 1024):g}MB 上限")
+
+    fd, path = tempfile.mkstemp(prefix="upload-", suffix=".csv", dir=directory)
+    digest, size = hashlib.sha256(), 0
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if max_bytes and size > max_bytes:
+                    raise UploadTooLargeError(f"文件超过 {max_bytes / (1024 * 1024):g}MB 上限")
+                digest.update(chunk)
+                out.write(chunk)
+        with open(path, 'rb') as f:
+            compression = detect_compression(f.read(4))
+        if compression is None:
+            if max_csv_bytes and size > max_csv_bytes:
+                raise UploadTooLargeError(f"CSV 超过 {max_csv_bytes / (1024 * 1024):g}MB 上限")
+            return SavedUpload(path, digest.hexdigest(), size, file.filename)
+        # 解压是 CPU 密集的 (zlib 会释放 GIL)，放到线程里，不阻塞事件循环
+        csv_path, csv_size = await asyncio.to_thread(decompress_upload, path, compression, max_csv_bytes, directory)
+        _remove(path)
+        return SavedUpload(csv_path, digest.hexdigest(), size, file.filename, csv_size)
+    except BaseException:
+        _remove(path)
+        raise
@@ -0,0 +1,54 @@
+import os
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+
+class AnalysisPool:
+    """
+    CPU 密集的 CSV 解析 + 指标计算放到进程池里跑：
+    事件循环只负责收发请求，一个部署可以吃满所有核。
+
+    max_workers = 0 时不开进程，退化为默认线程池 (不阻塞事件循环，但受 GIL 限制)。
+    max_tasks_per_child > 0 时子进程处理这么多任务后自动重启，回收 pandas 的内存碎片。
+    """
+
+    def __init__(self, max_workers=0, max_tasks_per_child=0):
+        self.max_workers = max_workers
+        self.max_tasks_per_child = max_tasks_per_child or None
+        self._executor = None
+
+    def start(self):
+        if self.max_workers > 0 and self._executor is None:
+            # spawn：子进程不继承 uvicorn 的线程和事件循环状态
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                max_tasks_per_child=self.max_tasks_per_child,
+            )
+            print(f"[INFO] ✅ 分析进程池已启动: {self.max_workers} 个进程")
+
+    async def run(self, fn, *args):
+        """在进程池 (或线程池) 中执行 fn(*args)，参数和返回值必须可 pickle"""
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._executor, fn, *args)
+        except BrokenProcessPool:
+            # 子进程被 OOM 杀掉等情况会让整个池失效，重建后本次请求仍按失败处理
+            print("[WARN] ⚠️ 分析进程异常退出，正在重建进程池")
+            self.shutdown(wait=False)
+            self.start()
+            raise RuntimeError("分析进程异常退出，文件可能过大，请稍后再试")
+
+    def shutdown(self, wait=True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait, cancel_futures=not wait)
+            self._executor = None
+
+
+def parse_worker_count(value):
+    """进程数配置：数字，或 'auto' 表示 CPU 核数"""
+    if str(value).strip().lower() == "auto":
+        return os.cpu_count() or 1
+    return max(int(value), 0)
@@ -35,8 +35,9 @@ export function HeroSection() {
   }
 
   const handleFileUpload = async (file: File) => {
-    if (!file.name.endsWith(".csv")) {
-      setError("请上传 CSV 文件")
+    const name = file.name.toLowerCase()
+    if (![".csv", ".csv.gz", ".zip"].some((ext) => name.endsWith(ext))) {
+      setError("请上传 CSV 文件 (支持 .csv.gz / .zip 压缩包)")
       return
     }
 
@@ -215,7 +216,7 @@ export function HeroSection() {
           <input
             ref={fileInputRef}
             type="file"
-            accept=".csv"
+            accept=".csv,.gz,.zip"
             onChange={handleFileChange}
             className="hidden"
             aria-label="上传币安CSV文件"